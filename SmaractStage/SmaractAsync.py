@@ -0,0 +1,276 @@
+import asyncio
+import threading
+import time
+import numpy as np
+from SmaractStage import SmaractStage as stage
+from SmaractStage.SmaractWorker import IOWorker
+
+# ASYNCIO API
+# AsyncSmarAct runs every controller call of a SmarAct object on one I/O worker thread (see
+# SmaractWorker) and hands the results back to the event loop through futures. Motion
+# commands take priority over reads, and concurrent reads of the same property share one
+# transaction. Motion completion does not hold a thread: waitdone() registers a future that is
+# resolved when the MOVEMENT_FINISHED event of the channel arrives (confirmed with one state
+# read), or, without controller events, by a batched state poll of all waiting channels on
+# the worker.
+
+class AsyncSmarAct():
+    """
+    asyncio facade of a SmarAct controller.
+
+        ctrl = AsyncSmarAct(SmarAct("MCS2-00015447"))
+        await ctrl.mv("trans1", 1.0)
+        pos = await ctrl.get_positions()
+    """
+    def __init__(self, smaract):
+        self.smaract = smaract
+        # {channel: [(loop, future, count)]}, count is the MOVEMENT_FINISHED
+        # count of the channel when the move was issued (None: poll)
+        self._waiters = {}
+        self._lock = threading.Lock()
+        self._poll_delay = stage.POLL_MIN
+        self._next_poll = None
+        # state reads per waiting channel, for the move statistics
+        self._polls = {}
+        self.worker = IOWorker(smaract, tick=self._tick)
+        if smaract.events is not None:
+            smaract.events.add_callback(self._on_event)
+
+    # worker thread
+    def _tick(self):
+        # state polling of channels without events; returns the next poll delay
+        polling = self._poll_channels()
+        if not polling:
+            self._poll_delay = stage.POLL_MIN
+            self._next_poll = None
+            return None
+        now = time.monotonic()
+        if self._next_poll is None:
+            self._next_poll = now + self._poll_delay
+        elif now >= self._next_poll:
+            self._check(polling)
+            self._poll_delay = min(self._poll_delay*1.5, stage.POLL_MAX)
+            self._next_poll = now + self._poll_delay
+        return max(self._next_poll - now, 0)
+
+    def _poll_channels(self):
+        with self._lock:
+            return [ch for ch, waiters in self._waiters.items() if any(w[2] is None for w in waiters)]
+
+    def _check(self, channels):
+        # one batched state read; resolve the waiters of channels that stopped
+        for ch in channels:
+            self._polls[ch] = self._polls.get(ch, 0) + 1
+        states = self.smaract.get_states(channels)
+        for ch, state in zip(channels, states):
+            if not _busy(state):
+                self._resolve(ch)
+
+    def _resolve(self, channel):
+        with self._lock:
+            waiters = self._waiters.pop(channel, [])
+        self.smaract._record_move(channel, self._polls.pop(channel, 0))
+        for loop, future, _ in waiters:
+            loop.call_soon_threadsafe(_set_result, future, True)
+
+    def _on_event(self, event):
+        # called on the event listener thread
+        ctl = stage.ctl
+        if event.type != ctl.EventType.MOVEMENT_FINISHED or event.idx not in self._waiters:
+            return
+        self._confirm(event.idx)
+
+    def _confirm(self, channel):
+        # resolve the waiters of a channel if its state read says it stopped
+        ctl = stage.ctl
+        self._polls[channel] = self._polls.get(channel, 0) + 1
+        def done(future):
+            if future.exception() is None and not _busy(future.result()):
+                self._resolve(channel)
+        self.worker.read(channel, ctl.Property.CHANNEL_STATE).add_done_callback(done)
+
+    # event loop side
+    async def call(self, func, *args, **kwargs):
+        # run any SmarAct method (or other blocking controller call) on the worker
+        return await asyncio.wrap_future(self.worker.call(func, *args, **kwargs))
+
+    async def command(self, func, *args, **kwargs):
+        # like call(), with motion command priority
+        return await asyncio.wrap_future(self.worker.command(func, *args, **kwargs))
+
+    async def read(self, ax, pkey):
+        # raw property value; concurrent reads of the same property are coalesced
+        return await asyncio.wrap_future(self.worker.read(self.smaract._channel_index(ax), pkey))
+
+    async def _read_all(self, axes, pkey):
+        if axes is None:
+            axes = self.smaract.channels
+        return await asyncio.gather(*(self.read(ax, pkey) for ax in axes))
+
+    async def get_pos(self, ax):
+        return await self.read(ax, stage.ctl.Property.POSITION)/1E9
+
+    async def get_positions(self, axes=None):
+        values = await self._read_all(axes, stage.ctl.Property.POSITION)
+        return np.asarray(values, dtype=np.float64)/1E9
+
+    async def get_states(self, axes=None):
+        values = await self._read_all(axes, stage.ctl.Property.CHANNEL_STATE)
+        return np.asarray(values, dtype=np.int64)
+
+    async def read_status(self, axes=None):
+        if axes is None:
+            axes = self.smaract.channels
+        chans = [self.smaract._channel_index(ax) for ax in axes]
+        positions, states = await asyncio.gather(self.get_positions(chans), self.get_states(chans))
+        status = np.empty(len(chans), dtype=stage.status_dtype)
+        status['channel'] = chans
+        status['position'] = positions
+        status['state'] = states
+        return status.view(np.recarray)
+
+    async def get_speed(self, ax):
+        return await self.call(self.smaract.get_speed, ax)
+
+    async def set_speed(self, ax, vel=None, acc=None):
+        return await self.command(self.smaract.set_speed, ax, vel, acc)
+
+    async def ismoving(self, ax):
+        return await self.call(self.smaract.ismoving, ax)
+
+    async def mv(self, ax, target, wait=True):
+        await self.command(self.smaract.mv, ax, target, wait=False)
+        if wait:
+            await self.waitdone(ax)
+
+    async def mvr(self, ax, target, wait=True):
+        await self.command(self.smaract.mvr, ax, target, wait=False)
+        if wait:
+            await self.waitdone(ax)
+
+    async def mv_many(self, targets, absolute=True, wait=True, synchronize=False):
+        chans = [self.smaract._channel_index(ax) for ax in targets]
+        await self.command(self.smaract.mv_many, targets, absolute=absolute, wait=False, synchronize=synchronize)
+        if wait:
+            return await self.waitdone_many(chans)
+
+    async def waitdone_many(self, axes, timeout=None):
+        # see SmarAct.waitdone_many(); the waits do not hold the worker
+        smaract = self.smaract
+        chans = [smaract._channel_index(ax) for ax in axes]
+        await asyncio.gather(*(self.waitdone(ch, timeout) for ch in chans))
+        result = smaract._move_result(chans, await self.read_status(chans))
+        for ch in result.channel[result.done]:
+            if ch in smaract._sync_speeds:
+                await self.set_speed(ch, *smaract._sync_speeds.pop(ch))
+        return result
+
+    async def stop(self, ax):
+        return await self.command(self.smaract.stop, ax)
+
+    async def calibrate_all(self, axes=None, groups=None, skip_done=True, timeout=None):
+        # see SmarAct.calibrate_all(); the sequences are awaited without blocking the worker
+        return await self._run_sequence("calibrate", axes, groups, skip_done, None, timeout)
+
+    async def reference_all(self, axes=None, groups=None, skip_done=True, speed=(1, 10), timeout=None):
+        # see SmarAct.reference_all()
+        return await self._run_sequence("reference", axes, groups, skip_done, speed, timeout)
+
+    async def _run_sequence(self, kind, axes, groups, skip_done, speed, timeout):
+        smaract = self.smaract
+        groups = smaract._sequence_groups(axes, groups)
+        skipped = await self.call(smaract._sequence_skipped, kind, groups) if skip_done else set()
+        done = {}
+        for group in groups:
+            group = [ch for ch in group if ch not in skipped]
+            if not group:
+                continue
+            saved = await self.command(smaract._start_sequence, kind, group, speed)
+            finished = {}
+            try:
+                finished = await self._wait_sequence(kind, group, timeout)
+            finally:
+                await self.command(smaract._stop_sequence, kind, [ch for ch in group if not finished.get(ch)])
+                await self.command(smaract._restore_speeds, saved)
+            done.update(finished)
+            if not all(finished.values()) or not await self.call(smaract._sequence_ok, kind, group):
+                print("MCS2 {} failed on channels {}, remaining groups are not started.".format(kind, group))
+                break
+        return await self.call(smaract._sequence_result, kind, groups, skipped, done)
+
+    async def _wait_sequence(self, kind, chans, timeout=None):
+        # Like SmarAct._wait_sequence(): the MOVEMENT_FINISHED events (or the state
+        # poll) end the wait early, the sequence's running bit decides when it is
+        # done. Returns {channel: finished in time}.
+        running_bit, _ = self.smaract._sequence_flags(kind)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        await asyncio.gather(*(self.waitdone(ch, timeout) for ch in chans))
+        delay = stage.POLL_MIN
+        while True:
+            busy = (await self.get_states(chans) & running_bit) != 0
+            if not busy.any() or (deadline is not None and time.monotonic() >= deadline):
+                break
+            await asyncio.sleep(delay)
+            delay = min(delay*1.5, stage.POLL_MAX)
+        return {ch: not b for ch, b in zip(chans, busy)}
+
+    async def waitdone(self, ax, timeout=None):
+        # Wait for the end of the last move on the channel. Returns False on timeout.
+        channel = self.smaract._channel_index(ax)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        count = self.smaract._pending.pop(channel, None)
+        if self.smaract.events is None:
+            count = None
+        with self._lock:
+            self._waiters.setdefault(channel, []).append((loop, future, count))
+        if count is not None:
+            if self.smaract.events.count(channel) > count:
+                # finished before the waiter was registered
+                self._confirm(channel)
+            else:
+                # the periodic check covers an event that is lost
+                loop.call_later(stage.EVENT_RECHECK, self._recheck, channel, future)
+        else:
+            # wake the worker so it starts polling
+            self.worker.wake()
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            # on timeout or cancellation the waiter goes away with its future
+            future.cancel()
+            self._remove_waiter(channel, future)
+
+    def _remove_waiter(self, channel, future):
+        with self._lock:
+            waiters = self._waiters.get(channel)
+            if waiters is None:
+                return
+            waiters[:] = [w for w in waiters if w[1] is not future]
+            if not waiters:
+                del self._waiters[channel]
+
+    def _recheck(self, channel, future):
+        with self._lock:
+            registered = any(w[1] is future for w in self._waiters.get(channel, []))
+        if future.done() or not registered:
+            return
+        self._confirm(channel)
+        asyncio.get_running_loop().call_later(stage.EVENT_RECHECK, self._recheck, channel, future)
+
+    def close(self):
+        if self.smaract.events is not None:
+            self.smaract.events.remove_callback(self._on_event)
+        self.worker.close()
+
+def _busy(state):
+    ctl = stage.ctl
+    if state & ctl.ChannelState.END_STOP_REACHED:
+        return False
+    return bool(state & ctl.ChannelState.ACTIVELY_MOVING)
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
@@ -0,0 +1,117 @@
+import threading
+import time
+import numpy as np
+from SmaractStage import SmaractStage as stage
+
+# POSITION CAPTURE
+# Samples the position (and optionally the channel state) of a set of channels from a background
+# thread into preallocated buffers, with monotonic timestamps. Each sample is one pipelined
+# read of all channels. The buffers are "mirrored" ring buffers: every sample is stored at
+# index i and i + capacity, so the newest `capacity` samples are always one contiguous slice
+# and window() can return views instead of copies. With `path` the buffers are memory-mapped
+# files, so long runs do not have to fit in memory.
+
+class PositionCapture():
+    """
+    Position trace of several channels during motion.
+
+    Use start()/stop(), the object as a context manager, or pass it to
+    SmarAct.move(capture=...). window() returns (t, positions[, states]) of
+    the captured samples, oldest first, as views into the buffer.
+    Positions are in mm or deg, timestamps in seconds of time.monotonic().
+    """
+    def __init__(self, smaract, axes, capacity=100000, states=False, period=0.0, path=None):
+        self.smaract = smaract
+        self.channels = [smaract._channel_index(ax) for ax in axes]
+        self.capacity = int(capacity)
+        self.period = period
+        self.with_states = states
+        self.path = path
+        n = len(self.channels)
+        self.t = self._buffer("t", (2*self.capacity,), np.float64)
+        self.positions = self._buffer("pos", (2*self.capacity, n), np.float64)
+        self.states = self._buffer("state", (2*self.capacity, n), np.int64) if states else None
+        # total number of samples taken since start()
+        self.count = 0
+        self._running = threading.Event()
+        self._thread = None
+
+    def _buffer(self, name, shape, dtype):
+        if self.path is None:
+            return np.zeros(shape, dtype=dtype)
+        return np.lib.format.open_memmap("{}.{}.npy".format(self.path, name), mode="w+", dtype=dtype, shape=shape)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.count = 0
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name="smaract-capture", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._running.clear()
+        self._thread.join()
+        self._thread = None
+        if self.path is not None:
+            self.flush()
+
+    def flush(self):
+        for buf in (self.t, self.positions, self.states):
+            if isinstance(buf, np.memmap):
+                buf.flush()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        ctl = stage.ctl
+        handle = self.smaract.smaract
+        pos_key = ctl.Property.POSITION
+        state_key = ctl.Property.CHANNEL_STATE
+        channels = self.channels
+        n = len(channels)
+        cap = self.capacity
+        row = np.empty(n, dtype=np.float64)
+        srow = np.empty(n, dtype=np.int64)
+        while self._running.is_set():
+            t0 = time.monotonic()
+            p_ids = [ctl.RequestReadProperty(handle, ch, pos_key, 0) for ch in channels]
+            if self.with_states:
+                s_ids = [ctl.RequestReadProperty(handle, ch, state_key, 0) for ch in channels]
+            for k in range(n):
+                row[k] = ctl.ReadProperty_i64(handle, p_ids[k])
+            if self.with_states:
+                for k in range(n):
+                    srow[k] = ctl.ReadProperty_i32(handle, s_ids[k])
+            t1 = time.monotonic()
+            i = self.count % cap
+            # the sample time is the middle of the request/reply round trip
+            self.t[i] = self.t[i + cap] = 0.5*(t0 + t1)
+            row /= 1E9
+            self.positions[i] = self.positions[i + cap] = row
+            if self.with_states:
+                self.states[i] = self.states[i + cap] = srow
+            self.count += 1
+            if self.period:
+                delay = self.period - (time.monotonic() - t0)
+                if delay > 0:
+                    time.sleep(delay)
+
+    def window(self, last=None):
+        # Views of the newest `last` samples (default: all retained samples).
+        n = min(self.count, self.capacity)
+        if last is not None:
+            n = min(n, last)
+        # the newest sample sits at slot j; its copy at j + capacity ends a contiguous window
+        end = (self.count - 1) % self.capacity + self.capacity + 1 if self.count else 0
+        start = end - n
+        if self.with_states:
+            return self.t[start:end], self.positions[start:end], self.states[start:end]
+        return self.t[start:end], self.positions[start:end]
@@ -1,43 +1,164 @@
+import argparse
 import asyncio
+import os
+import time
+from caproto import ChannelType
 from caproto.server import pvproperty, PVGroup, run
+from SmaractStage import SmaractStage as stage
 from SmaractStage.SmaractStage import SmarAct
+from SmaractStage.SmaractAsync import AsyncSmarAct
+
+class StatusPoller():
+    """
+    Reads the status of all axes of one controller in a single batched
+    transaction and publishes RBV, DMOV, HLM and LLM of the registered motor
+    records. Values are only written (and monitors posted) when they change,
+    so the controller load does not depend on the number of CA clients.
+    The scan runs every `fast` seconds while any axis moves and every `slow`
+    seconds otherwise. While statistics are on (SmaractStage.enable_stats)
+    the statistics PVs are refreshed every `stats_period` seconds. With a
+    Telemetry attached, its samples are read in the same transaction as
+    the status. With a SmarActServer attached, other processes can use the
+    controller while the IOC runs; it is started and stopped with the poller.
+    """
+    def __init__(self, controller, fast=0.05, slow=1.0, stats_period=1.0):
+        # controller is an AsyncSmarAct
+        self.controller = controller
+        self.fast = fast
+        self.slow = slow
+        self.stats_period = stats_period
+        self._stats_time = time.monotonic()
+        self.records = []
+        self._task = None
+        self._wake = None
+        self.telemetry = None
+        self.server = None
+
+    def add(self, record):
+        self.records.append(record)
+
+    def start(self):
+        # start the scan task on the running event loop (once)
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self.run())
+            if self.server is not None:
+                asyncio.get_running_loop().create_task(self.server.start())
+
+    def kick(self):
+        # rescan now, e.g. right after a move was issued
+        if self._wake is not None:
+            self._wake.set()
+
+    async def scan(self):
+        # Read all axes once and publish the changes. Returns True if any axis moves.
+        channels = sorted(set(record.motor.axis for record in self.records))
+        telemetry = self.telemetry
+        if telemetry is not None and not telemetry.due():
+            telemetry = None
+        try:
+            if telemetry is None:
+                status = await self.controller.read_status(channels)
+            else:
+                # the reads are queued together, so the I/O worker sends them in one batch
+                status, values = await asyncio.gather(
+                    self.controller.read_status(sorted(set(channels) | set(telemetry.channels))),
+                    asyncio.gather(*(self.controller.read(ch, pkey) for ch, pkey, _ in telemetry.requests()),
+                                   return_exceptions=True))
+        except Exception as ex:
+            print("[StatusPoller] status read failed: {}".format(ex))
+            return False
+        if telemetry is not None:
+            # a failed telemetry read or write (e.g. a full disk) must not stop the status updates
+            try:
+                for value in values:
+                    if isinstance(value, Exception):
+                        raise value
+                by_channel = {int(st.channel): st for st in status}
+                sts = [by_channel[ch] for ch in telemetry.channels]
+                telemetry.record([st.position for st in sts], [st.state for st in sts], values)
+            except Exception as ex:
+                print("[StatusPoller] telemetry sample failed: {}".format(ex))
+        by_channel = {int(st.channel): st for st in status}
+        for record in self.records:
+            st = by_channel[record.motor.axis]
+            await record.update_status(st.position, int(st.state))
+        now = time.monotonic()
+        if stage.stats is not None and now - self._stats_time >= self.stats_period:
+            for record in self.records:
+                await record.update_stats(now - self._stats_time)
+            self._stats_time = now
+        for record in self.records:
+            await record.update_trigger()
+        return bool((status.state & stage.ctl.ChannelState.ACTIVELY_MOVING).any())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.server is not None:
+            self.server.stop()
+        if self.telemetry is not None:
+            self.telemetry.close()
+
+    async def run(self):
+        while True:
+            period = self.fast if await self.scan() else self.slow
+            try:
+                await asyncio.wait_for(self._wake.wait(), period)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
 
-smaract_controller = SmarAct(MCS2="MCS2-00015447", axis=[3,4])
 class Motor():
-    def __init__(self, axis):
+    def __init__(self, axis, controller):
         self.axis = axis
+        self.controller = controller
 
-    def waitdone(self):
-        smaract_controller.waitdone(self.axis)
+    async def waitdone(self):
+        await self.controller.waitdone(self.axis)
 
-    def ismoving(self, wait=True):
-        return smaract_controller.ismoving(self.axis)
+    async def ismoving(self, wait=True):
+        return await self.controller.ismoving(self.axis)
 
-    def onlimit(self):
-        val = smaract_controller.limit_reached(self.axis)
+    async def onlimit(self):
+        val = await self.controller.call(self.controller.smaract.limit_reached, self.axis)
         return val
 
-    def get_pos(self):
-        val = smaract_controller.get_pos(self.axis)
+    async def get_pos(self):
+        val = await self.controller.get_pos(self.axis)
         return val
 
-    def get_speed(self):
-        val = smaract_controller.get_speed(self.axis)
+    async def get_speed(self):
+        val = await self.controller.get_speed(self.axis)
         return val
     
-    def set_pos(self, value):
-        val = smaract_controller.set_pos(self.axis, value)
+    async def set_pos(self, value):
+        val = await self.controller.call(self.controller.smaract.set_pos, self.axis, value)
         return val
     
-    def set_speed(self, value):
-        val = smaract_controller.set_speed(self.axis, value)
+    async def set_speed(self, value, acc=None):
+        val = await self.controller.set_speed(self.axis, value, acc)
         return val
     
-    def mvr(self, val, wait=True):
-        smaract_controller.mvr(self.axis, val, wait=wait)
+    async def mvr(self, val, wait=True):
+        await self.controller.mvr(self.axis, val, wait=wait)
     
-    def mv(self, val, wait=True):
-        smaract_controller.mv(self.axis, val, wait=wait)
+    async def mv(self, val, wait=True):
+        await self.controller.mv(self.axis, val, wait=wait)
+
+    async def stop(self):
+        await self.controller.stop(self.axis)
+
+    async def set_trigger(self, start, increment, count=None, direction="forward", pulse_width=1E-6):
+        await self.controller.command(self.controller.smaract.set_trigger, self.axis, start, increment,
+                                      count, direction, pulse_width, arm=True)
+
+    async def disarm_trigger(self):
+        return await self.controller.command(self.controller.smaract.disarm_trigger, self.axis)
+
+    async def trigger_count(self):
+        return await self.controller.call(self.controller.smaract.trigger_count, self.axis)
 
 class SmarActMotorRecord(PVGroup):
     """
@@ -55,6 +176,31 @@ class SmarActMotorRecord(PVGroup):
       - TWV (Tweak Value): Adjustment value for tweaks.
       - HLM (High Limit): Maximum positional limit.
       - LLM (Low Limit): Minimum positional limit.
+      - STOP: Writing 1 stops the motor; VAL is set to the position where it stopped.
+      - SPMG (Stop/Pause/Move/Go): Stop and Pause stop the motor and hold off new
+        moves (Stop also sets VAL to the stopped position); Move and Go move to VAL,
+        and Move switches to Pause when that move is done.
+      - VELO: Move velocity [mm/s or deg/s].
+      - ACCL: Time to reach VELO [s].
+
+    Moves are non-blocking: the putters command the move and return, and a
+    completion task of the record sets DMOV when the motor stopped. A new VAL
+    during a move retargets the motor on the fly.
+
+    Position compare trigger fields (written to the controller on TRGARM = Arm):
+      - TRGSTART, TRGINCR: first trigger position and spacing [mm or deg].
+      - TRGCNT: number of pulses (0: no limit).
+      - TRGDIR: Forward, Backward or Either.
+      - TRGWIDTH: pulse width [us].
+      - TRGARM: Arm or Disarm the trigger output.
+      - TRGEMIT: pulses put out since the last Arm, updated by the StatusPoller while armed.
+
+    Statistics fields, updated while SmaractStage.enable_stats() is on:
+      - LATP50, LATP99: median and 99th percentile latency of the controller calls of this axis [ms].
+      - CALLRATE: controller calls per second of this axis.
+      - MOVELAT: median time from move command to completion detection [ms].
+
+    RBV, DMOV, HLM and LLM are published by the controller's StatusPoller.
     """
     RBV = pvproperty(value=0.0, doc='(RVAL) Current motor position')
     VAL = pvproperty(value=0.0, doc='(VAL) Desired motor position')
@@ -65,117 +211,378 @@ class SmarActMotorRecord(PVGroup):
     TWV = pvproperty(value=0.0, doc='(TWV) Tweak value')
     HLM = pvproperty(value=0.0, doc='(HLM) Higher Limit: 0 = not on limit, 1 = on limit')
     LLM = pvproperty(value=0.0, doc='(LLM) Lower Limite: 0 = not on limit, 1 = on limit')
+    STOP = pvproperty(value=0, doc='(STOP) Write 1 to stop the motor')
+    SPMG = pvproperty(value='Go', dtype=ChannelType.ENUM, enum_strings=['Stop', 'Pause', 'Move', 'Go'],
+                      doc='(SPMG) Stop/Pause/Move/Go')
+    VELO = pvproperty(value=0.0, doc='(VELO) Move velocity')
+    ACCL = pvproperty(value=0.0, doc='(ACCL) Acceleration time [s]')
+    LATP50 = pvproperty(value=0.0, read_only=True, doc='Median controller call latency [ms]')
+    LATP99 = pvproperty(value=0.0, read_only=True, doc='99th percentile controller call latency [ms]')
+    CALLRATE = pvproperty(value=0.0, read_only=True, doc='Controller calls per second')
+    MOVELAT = pvproperty(value=0.0, read_only=True, doc='Median move to DMOV latency [ms]')
+    TRGSTART = pvproperty(value=0.0, doc='Position of the first trigger pulse')
+    TRGINCR = pvproperty(value=0.1, doc='Distance between trigger pulses')
+    TRGCNT = pvproperty(value=0, doc='Number of trigger pulses (0: no limit)')
+    TRGDIR = pvproperty(value='Forward', dtype=ChannelType.ENUM, enum_strings=['Forward', 'Backward', 'Either'],
+                        doc='Trigger direction')
+    TRGWIDTH = pvproperty(value=1.0, doc='Trigger pulse width [us]')
+    TRGARM = pvproperty(value='Disarm', dtype=ChannelType.ENUM, enum_strings=['Disarm', 'Arm'],
+                        doc='Arm/disarm the position compare trigger output')
+    TRGEMIT = pvproperty(value=0, read_only=True, doc='Trigger pulses since arming')
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
+    def __init__(self, *args, axis, poller, **kwargs):
+        # poller is the StatusPoller of the controller of the axis (see open_controller)
+        super().__init__(*args, **kwargs)
         # Instantiate the motor device
-        axis_number = kwargs['axis']
-        self.motor = Motor(axis_number)
+        self.motor = Motor(axis, poller.controller)
+        self.poller = poller
+        poller.add(self)
+        # completion tracking of the commanded moves; _generation counts the move
+        # commands, so the tracker knows whether a retarget came in while it waited
+        self._tracker = None
+        self._generation = 0
+        self._move_lock = asyncio.Lock()
+        self._stopped = False
         # Optionally, perform any required initialization here:
         # self.motor.initialize() 
 
+    async def update_status(self, position, state):
+        """
+        Publish a status sample from the poller. Only changed values are
+        written, so monitors are posted on change.
+        """
+        end_stop = bool(state & stage.ctl.ChannelState.END_STOP_REACHED)
+        values = (
+            (self.RBV, position),
+            (self.HLM, int(end_stop and position > 0)),
+            (self.LLM, int(end_stop and position <= 0)),
+        )
+        if self._tracker is None and not self._move_lock.locked():
+            # moves commanded by this record set DMOV through the tracker (a scan
+            # while move_to() sends the command would see the axis not moving yet)
+            values += ((self.DMOV, 0 if state & stage.ctl.ChannelState.ACTIVELY_MOVING else 1),)
+        for pv, value in values:
+            if pv.value != value:
+                await pv.write(value)
+
+    async def update_stats(self, elapsed):
+        """
+        Publish the call statistics of this axis; elapsed is the time since
+        the last update.
+        """
+        stats = stage.stats
+        handle = self.motor.controller.smaract.smaract
+        calls = stats.merged(handle=handle, channel=self.motor.axis)
+        count = calls.count - getattr(self, '_call_count', 0)
+        self._call_count = calls.count
+        moves = stats.moves_summary(handle=handle, channel=self.motor.axis)
+        values = (
+            (self.LATP50, calls.percentile(50)*1E3 if calls.count else 0.0),
+            (self.LATP99, calls.percentile(99)*1E3 if calls.count else 0.0),
+            (self.CALLRATE, count/elapsed if elapsed > 0 else 0.0),
+            (self.MOVELAT, moves[self.motor.axis]['p50']*1E3 if moves else 0.0),
+        )
+        for pv, value in values:
+            if pv.value != value:
+                await pv.write(value)
+
+    async def update_trigger(self):
+        """
+        Publish the number of trigger pulses while the trigger output is armed.
+        """
+        if self.TRGARM.value != 'Arm':
+            return
+        try:
+            count = await self.motor.trigger_count()
+        except Exception as ex:
+            print("[SmarActMotorRecord] trigger count read failed: {}".format(ex))
+            return
+        if count is not None and self.TRGEMIT.value != count:
+            await self.TRGEMIT.write(count)
+
+    async def move_to(self, target):
+        """
+        Command a move to target and return; retargets a move in progress.
+        DMOV is cleared here and set by the completion tracker.
+        """
+        async with self._move_lock:
+            self._generation += 1
+            if self.DMOV.value != 0:
+                await self.DMOV.write(0)
+            await self.motor.mv(target, wait=False)
+            self.poller.kick()
+            if self._tracker is None:
+                self._tracker = asyncio.get_running_loop().create_task(self._track())
+
+    async def _track(self):
+        # wait until the last commanded move is done, then publish it
+        while True:
+            generation = self._generation
+            await self.motor.waitdone()
+            async with self._move_lock:
+                if generation != self._generation:
+                    # retargeted while waiting
+                    continue
+                await self.poller.scan()
+                if self._stopped:
+                    self._stopped = False
+                    await self.VAL.write(self.RBV.value, verify_value=False)
+                if self.SPMG.value == 'Move':
+                    await self.SPMG.write('Pause', verify_value=False)
+                self._tracker = None
+                await self.DMOV.write(1)
+                return
+
+    async def halt(self, hold_position=True):
+        """
+        Stop the motor. With hold_position VAL is set to the position where it stopped.
+        """
+        self._stopped = hold_position and self._tracker is not None
+        await self.motor.stop()
+        self.poller.kick()
+        if hold_position and self._tracker is None:
+            await self.poller.scan()
+            await self.VAL.write(self.RBV.value, verify_value=False)
+
+    @RBV.startup
+    async def RBV(self, instance, async_lib):
+        vel, acc = await self.motor.get_speed()
+        await self.VELO.write(vel, verify_value=False)
+        await self.ACCL.write(vel/acc if acc > 0 else 0.0, verify_value=False)
+        self.poller.start()
+
     @VAL.putter
     async def VAL(self, instance, value):
         """
         When a new target position is written, command the motor to move.
-        This method runs the (possibly blocking) move() call in a thread.
-        The dmov flag is updated to indicate motion is in progress and completion.
+        The putter returns once the move is commanded; a move in progress is
+        retargeted. With SPMG at Stop or Pause the target is only stored.
         """
         print(f"[SmarActMotorRecord] Received command to move motor to {value}")
-        # Set dmov to 0 to indicate movement start.
-        self.DMOV.put(0)
-        # Move the motor asynchronously.
-        await asyncio.to_thread(self.motor.mv, value)
-        # After moving, update dmov to 1 to indicate motion complete.
-        self.DMOV.put(1)
+        if self.SPMG.value in ('Stop', 'Pause'):
+            return value
+        await self.move_to(value)
         return value
 
     @TWR.putter
     async def TWR(self, instance, value):
         """
-        When a new target position is written, command the motor to move.
-        This method runs the (possibly blocking) move() call in a thread.
-        The dmov flag is updated to indicate motion is in progress and completion.
-        """
-        # Set dmov to 0 to indicate movement start.
-        self.DMOV.put(0)
-        # Move the motor asynchronously.
-        await asyncio.to_thread(self.motor.mvr, -1*self.TWV.get())
-        # After moving, update dmov to 1 to indicate motion complete.
-        self.DMOV.put(1)
-        return value
+        Tweak the target down by TWV.
+        """
+        await self.VAL.write(self.VAL.value - self.TWV.value)
+        return 0
 
     @TWF.putter
     async def TWF(self, instance, value):
         """
-        When a new target position is written, command the motor to move.
-        This method runs the (possibly blocking) move() call in a thread.
-        The dmov flag is updated to indicate motion is in progress and completion.
-        """
-        # Set dmov to 0 to indicate movement start.
-        self.DMOV.put(0)
-        # Move the motor asynchronously.
-        await asyncio.to_thread(self.motor.mvr, self.TWV.get())
-        # After moving, update dmov to 1 to indicate motion complete.
-        self.DMOV.put(1)
+        Tweak the target up by TWV.
+        """
+        await self.VAL.write(self.VAL.value + self.TWV.value)
+        return 0
+
+    @STOP.putter
+    async def STOP(self, instance, value):
+        if value:
+            await self.halt()
+        return 0
+
+    @SPMG.putter
+    async def SPMG(self, instance, value):
+        if value in ('Stop', 'Pause'):
+            await self.halt(hold_position=(value == 'Stop'))
+        elif abs(self.VAL.value - self.RBV.value) > 0 or self._tracker is not None:
+            await self.move_to(self.VAL.value)
+        elif value == 'Move':
+            # nothing to move
+            return 'Pause'
+        return value
+
+    @VELO.putter
+    async def VELO(self, instance, value):
+        if value <= 0:
+            raise ValueError("VELO must be positive.")
+        accl = self.ACCL.value
+        await self.motor.set_speed(value, value/accl if accl > 0 else 0)
         return value
 
-    @RBV.getter
-    async def RBV(self, instance):
+    @ACCL.putter
+    async def ACCL(self, instance, value):
+        if value < 0:
+            raise ValueError("ACCL must not be negative.")
+        vel = self.VELO.value
+        await self.motor.set_speed(vel, vel/value if value > 0 else 0)
+        return value
+
+    @TRGARM.putter
+    async def TRGARM(self, instance, value):
         """
-        Return the current motor position.
-        Runs the get_position() method in a thread to avoid blocking the event loop.
+        Arm writes the trigger setup fields to the controller and starts the
+        pulses; Disarm stops them and publishes the final count.
         """
-        pos = await asyncio.to_thread(self.motor.get_pos)
-        return pos
+        if value == 'Arm':
+            if self.TRGINCR.value <= 0 or self.TRGWIDTH.value <= 0 or self.TRGCNT.value < 0:
+                raise ValueError("TRGINCR and TRGWIDTH must be positive and TRGCNT not negative.")
+            await self.motor.set_trigger(self.TRGSTART.value, self.TRGINCR.value, self.TRGCNT.value or None,
+                                         self.TRGDIR.value.lower(), self.TRGWIDTH.value*1E-6)
+            await self.TRGEMIT.write(0)
+        else:
+            count = await self.motor.disarm_trigger()
+            if count is not None:
+                await self.TRGEMIT.write(count)
+        return value
 
     @VBAS.getter
     async def VBAS(self, instance):
         """
         Return the motor speed.
-        Runs the get_speed() method in a thread to avoid blocking the event loop.
+        The speed is served from the controller's property cache.
         """
-        pos = await asyncio.to_thread(self.motor.get_speed)
-        return pos
+        vel, acc = await self.motor.get_speed()
+        return vel
 
-    @DMOV.getter
-    async def DMOV(self, instance):
-        """
-        Return the current motor position.
-        Runs the get_position() method in a thread to avoid blocking the event loop.
-        """
-        pos = await asyncio.to_thread(self.motor.ismoving)
-        return pos
+# IOC CONFIGURATION
+# One process can serve the axes of several controllers. Each controller gets its own SmarAct
+# object, AsyncSmarAct (with its own I/O worker thread) and StatusPoller, so a slow or busy
+# controller does not hold up the others. The layout is read from a TOML or YAML file:
+#
+#   [[controller]]
+#   device = "MCS2-00015447"      # serial number or full locator
+#   events = true                 # optional
+#   lazy = false                  # optional
+#   fast = 0.05                   # optional status poll periods [s]
+#   slow = 1.0
+#   telemetry = {path = "/data/smaract/mcs2-15447", period = 1.0}   # optional
+#   server = "127.0.0.1:7455"     # optional, share the controller (see SmaractServer)
+#     [[controller.motor]]
+#     channel = 3
+#     prefix = "12ID:m3:"
+#
+# An optional top level `backend = "sim"` runs the IOC on the simulated controller
+# ("sdk" selects the SmarAct SDK).
 
-    @HLM.getter
-    async def HLM(self, instance):
-        """
-        Return the current motor position.
-        Runs the get_position() method in a thread to avoid blocking the event loop.
-        """
-        pos = await asyncio.to_thread(self.motor.onlimit)
-        if pos == 2:
-            pos = True
-        else:
-            pos = False
-        return pos
+def load_config(path):
+    """
+    Read an IOC configuration file (.toml, .yaml or .yml) into a dict.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".toml":
+        try:
+            import tomllib
+        except ImportError:
+            # python < 3.11
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise RuntimeError("tomli is required for TOML configuration files: python -m pip install tomli")
+        with open(path, "rb") as f:
+            config = tomllib.load(f)
+    elif ext in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError:
+            raise RuntimeError("PyYAML is required for YAML configuration files: python -m pip install pyyaml")
+        with open(path) as f:
+            config = yaml.safe_load(f) or {}
+    else:
+        raise ValueError("unknown configuration file type: {}".format(path))
+    check_config(config)
+    return config
+
+def check_config(config):
+    # raise ValueError on an incomplete or inconsistent configuration
+    controllers = config.get("controller")
+    if not controllers:
+        raise ValueError("the configuration has no [[controller]] entries.")
+    prefixes = set()
+    for c in controllers:
+        if "device" not in c:
+            raise ValueError("controller entry without 'device'.")
+        motors = c.get("motor")
+        if not motors:
+            raise ValueError("controller {} has no [[controller.motor]] entries.".format(c["device"]))
+        channels = set()
+        for m in motors:
+            if "channel" not in m or "prefix" not in m:
+                raise ValueError("motor entry of {} needs 'channel' and 'prefix'.".format(c["device"]))
+            if m["channel"] in channels:
+                raise ValueError("channel {} of {} is configured twice.".format(m["channel"], c["device"]))
+            if m["prefix"] in prefixes:
+                raise ValueError("PV prefix {} is used twice.".format(m["prefix"]))
+            channels.add(m["channel"])
+            prefixes.add(m["prefix"])
+
+def open_controller(device, channels, events=True, lazy=False, fast=0.05, slow=1.0, telemetry=None, server=None):
+    """
+    Open a controller for the IOC and return its StatusPoller; the
+    AsyncSmarAct is poller.controller and the SmarAct poller.controller.smaract.
+    telemetry is an optional dict of SmarAct.telemetry() arguments (path, period, ...).
+    server is an optional SmarActServer address for clients of other processes.
+    """
+    smaract = SmarAct(device, channels=channels, events=events, lazy=lazy)
+    if not hasattr(smaract, "smaract"):
+        raise RuntimeError("cannot open the controller {}.".format(device))
+    # all controller calls of one controller go through one I/O thread
+    poller = StatusPoller(AsyncSmarAct(smaract), fast=fast, slow=slow)
+    if telemetry is not None:
+        poller.telemetry = smaract.telemetry(**telemetry)
+    if server is not None:
+        from SmaractStage.SmaractServer import SmarActServer
+        poller.server = SmarActServer(poller.controller, server, fast=fast, slow=slow, on_move=poller.kick)
+    return poller
+
+def build_records(config):
+    """
+    Open the controllers of a configuration and create their motor records.
+    Returns (records, pollers).
+    """
+    if config.get("backend"):
+        stage.use_backend(str(config["backend"]))
+    records = []
+    pollers = []
+    for c in config["controller"]:
+        channels = [m["channel"] for m in c["motor"]]
+        poller = open_controller(c["device"], channels, events=c.get("events", True), lazy=c.get("lazy", False),
+                                 fast=c.get("fast", 0.05), slow=c.get("slow", 1.0),
+                                 telemetry=c.get("telemetry"), server=c.get("server"))
+        pollers.append(poller)
+        for m in c["motor"]:
+            records.append(SmarActMotorRecord(prefix=m["prefix"], axis=m["channel"], poller=poller))
+    return records, pollers
+
+def close_controllers(pollers):
+    for poller in pollers:
+        poller.stop()
+        poller.controller.close()
+        poller.controller.smaract.close()
+
+
+def main(argv=None):
+    """
+    Run the caproto server with the motor records of a configuration file,
+    or of channels 3 and 4 of the default controller (console script smaract-ioc).
+    """
+    parser = argparse.ArgumentParser(description="SmarAct motor record IOC")
+    parser.add_argument("--config", help="IOC configuration file (.toml or .yaml)")
+    parser.add_argument("--backend", choices=["sdk", "sim"],
+                        help="controller backend (default: SMARACT_BACKEND or the SmarAct SDK)")
+    args = parser.parse_args(argv)
+    if args.config:
+        config = load_config(args.config)
+    else:
+        config = {"controller": [{"device": "MCS2-00015447", "motor": [
+            {"channel": 3, "prefix": "SmarAct:m3:"},
+            {"channel": 4, "prefix": "SmarAct:m4:"}]}]}
+    if args.backend:
+        config["backend"] = args.backend
+    records, pollers = build_records(config)
+    pvdb = {}
+    for record in records:
+        pvdb.update(record.pvdb)
+    try:
+        run(pvdb)
+    finally:
+        close_controllers(pollers)
 
-    @LLM.getter
-    async def LLM(self, instance):
-        """
-        Return the current motor position.
-        Runs the get_position() method in a thread to avoid blocking the event loop.
-        """
-        pos = await asyncio.to_thread(self.motor.onlimit)
-        if pos == 1:
-            pos = True
-        else:
-            pos = False        
-        return pos
 
 if __name__ == '__main__':
-    # Run the caproto server with our motor records.
-    # These will start a PV server publishing the motor records.
-    motor1 = SmarActMotorRecord(axis=3)
-    motor2 = SmarActMotorRecord(axis=4)
-    run((motor1, motor2), pv_cache=True)
+    main()
@@ -0,0 +1,576 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import socket
+import struct
+import threading
+import time
+import numpy as np
+from SmaractStage import SmaractStage as stage
+
+# CONTROLLER SHARING
+# An MCS2 can only be opened by one process. SmarActServer holds the controller (through an
+# AsyncSmarAct, so all access goes through its I/O worker) and serves it to other processes on
+# a local TCP port or Unix socket; SmarActClient offers the SmarAct API on top of it.
+# Identical reads of different clients that arrive together are coalesced by the I/O worker
+# into one controller read, and position/state subscriptions of all clients are served by
+# one poll loop that only sends changes.
+#
+# Protocol: every message is a frame  <uint32 length> <uint32 request id> <uint8 op> body,
+# little endian. Replies carry the request id of the request, updates of subscriptions id 0.
+#   READ       n:u8, n x (channel:u8, property:u32)   -> n x (error:u16, value:i64)
+#   STATUS     n:u8, n x channel:u8                   -> n x (position:f64, state:i64)
+#   MOVE       channel:u8, target:f64, absolute:u8, wait:u8 -> done:u8
+#   STOP       channel:u8                             -> (empty)
+#   WAIT       channel:u8, timeout:f64 (< 0: none)    -> done:u8
+#   SUBSCRIBE  n:u8, n x channel:u8                   -> (empty), then UPDATE frames
+#   UNSUBSCRIBE                                       -> (empty)
+#   UPDATE     time:f64, n:u8, n x (channel:u8, position:f64, state:i64)
+#   CALL       json {"method", "args", "kwargs"}      -> json result
+#   ERROR      code:u16, utf-8 message (reply to a failed request)
+# Positions are in mm or deg.
+
+DEFAULT_ADDRESS = "127.0.0.1:7455"
+
+OP_READ = 1
+OP_STATUS = 2
+OP_MOVE = 3
+OP_STOP = 4
+OP_WAIT = 5
+OP_SUBSCRIBE = 6
+OP_UNSUBSCRIBE = 7
+OP_UPDATE = 8
+OP_CALL = 9
+OP_ERROR = 255
+
+_header = struct.Struct("<IIB")
+_read_item = struct.Struct("<BI")
+_read_reply = struct.Struct("<Hq")
+_status_item = struct.Struct("<dq")
+_move = struct.Struct("<BdBB")
+_wait = struct.Struct("<Bd")
+_update_head = struct.Struct("<dB")
+_update_item = struct.Struct("<Bdq")
+
+# SmarAct methods that clients may run with CALL
+CALL_METHODS = ("ismoving", "set_speed", "get_speed", "get_property", "set_property", "set_pos", "get_unit",
+                "limit_reached", "invalidate", "refresh",
+                "set_trigger", "arm_trigger", "disarm_trigger", "trigger_count")
+# methods with an asyncio implementation in AsyncSmarAct, so they do not hold the I/O worker
+ASYNC_METHODS = ("mv_many", "waitdone_many", "calibrate_all", "reference_all")
+
+class RemoteError(Exception):
+    """
+    A request failed on the server; code is the SmarActCTL error code (0 if
+    the failure was not a controller error).
+    """
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+def parse_address(address):
+    # "host:port" or a Unix socket path
+    if isinstance(address, tuple):
+        return address
+    if "/" in address:
+        return address
+    host, port = address.rsplit(":", 1)
+    return (host, int(port))
+
+def _pack_frame(rid, op, body=b""):
+    return _header.pack(len(body) + 5, rid, op) + body
+
+def _jsonable(value):
+    if isinstance(value, np.ndarray):
+        if value.dtype.names:
+            return [dict(zip(value.dtype.names, _jsonable(list(row)))) for row in value]
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple, set)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v) for k, v in value.items()}
+    return value
+
+def _axis(key):
+    # JSON object keys are strings; channel numbers come back as int
+    return int(key) if isinstance(key, str) and key.isdigit() else key
+
+def _move_result(rows):
+    # move_result_dtype record array from its JSON form
+    names = stage.move_result_dtype.names
+    result = np.array([tuple(row[name] for name in names) for row in rows], dtype=stage.move_result_dtype)
+    return result.view(np.recarray)
+
+class _Connection():
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.channels = None
+
+    def send(self, rid, op, body=b""):
+        if not self.writer.is_closing():
+            self.writer.write(_pack_frame(rid, op, body))
+
+    async def run(self):
+        tasks = set()
+        try:
+            while True:
+                head = await self.reader.readexactly(_header.size)
+                length, rid, op = _header.unpack(head)
+                body = await self.reader.readexactly(length - 5)
+                # every request runs in its own task, so a waiting move does not hold up the others
+                task = asyncio.ensure_future(self.handle(rid, op, body))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.server.unsubscribe(self)
+            self.writer.close()
+
+    async def handle(self, rid, op, body):
+        server = self.server
+        controller = server.controller
+        try:
+            if op == OP_READ:
+                n = body[0]
+                items = [_read_item.unpack_from(body, 1 + k*_read_item.size) for k in range(n)]
+                results = await asyncio.gather(*(controller.read(ch, pkey) for ch, pkey in items),
+                                               return_exceptions=True)
+                reply = b"".join(_read_reply.pack(getattr(r, "code", 1), 0) if isinstance(r, Exception)
+                                 else _read_reply.pack(0, int(r)) for r in results)
+            elif op == OP_STATUS:
+                status = await controller.read_status(list(body[1:1 + body[0]]))
+                reply = b"".join(_status_item.pack(st.position, int(st.state)) for st in status)
+            elif op == OP_MOVE:
+                channel, target, absolute, wait = _move.unpack(body)
+                if absolute:
+                    await controller.mv(channel, target, wait=False)
+                else:
+                    await controller.mvr(channel, target, wait=False)
+                # let the subscribers see the motion start
+                server.kick()
+                done = await controller.waitdone(channel) if wait else True
+                reply = b"\x01" if done else b"\x00"
+            elif op == OP_STOP:
+                await controller.stop(body[0])
+                reply = b""
+            elif op == OP_WAIT:
+                channel, timeout = _wait.unpack(body)
+                done = await controller.waitdone(channel, None if timeout < 0 else timeout)
+                reply = b"\x01" if done else b"\x00"
+            elif op == OP_SUBSCRIBE:
+                await server.subscribe(self, list(body[1:1 + body[0]]))
+                reply = b""
+            elif op == OP_UNSUBSCRIBE:
+                server.unsubscribe(self)
+                reply = b""
+            elif op == OP_CALL:
+                request = json.loads(body.decode())
+                result = await server.call(request["method"], request.get("args", []), request.get("kwargs", {}))
+                reply = json.dumps(_jsonable(result)).encode()
+            else:
+                raise ValueError("unknown request {}".format(op))
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            code = getattr(ex, "code", 0)
+            self.send(rid, OP_ERROR, struct.pack("<H", int(code) & 0xFFFF) + str(ex).encode())
+            return
+        self.send(rid, op, reply)
+
+class SmarActServer():
+    """
+    Serves the controller of an AsyncSmarAct to SmarActClient objects of
+    other processes. address is "host:port" (keep the host on localhost) or
+    a Unix socket path. start() runs it on the current event loop.
+    on_move, if given, is called after a client started a move (the IOC uses
+    it to rescan its motor records).
+    """
+    def __init__(self, controller, address=DEFAULT_ADDRESS, fast=0.05, slow=1.0, on_move=None):
+        self.controller = controller
+        self.address = parse_address(address)
+        self.fast = fast
+        self.slow = slow
+        self.on_move = on_move
+        self._server = None
+        self._subscribers = {}
+        self._last = {}
+        self._poll_task = None
+        self._wake = None
+
+    async def start(self):
+        if isinstance(self.address, tuple):
+            self._server = await asyncio.start_server(self._accept, *self.address)
+        else:
+            if os.path.exists(self.address):
+                os.remove(self.address)
+            self._server = await asyncio.start_unix_server(self._accept, self.address)
+
+    async def _accept(self, reader, writer):
+        sock = writer.get_extra_info("socket")
+        if sock is not None and sock.family != getattr(socket, "AF_UNIX", None):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        await _Connection(self, reader, writer).run()
+
+    async def call(self, method, args, kwargs):
+        smaract = self.controller.smaract
+        if method == "info":
+            return {"device": smaract.smaractstage, "channels": smaract.channels,
+                    "channel_names": smaract.channel_names, "units": smaract.units}
+        if method in ASYNC_METHODS:
+            if method == "mv_many":
+                args = [{_axis(k): v for k, v in args[0].items()}] + list(args[1:])
+            elif method == "waitdone_many":
+                args = [[_axis(ax) for ax in args[0]]] + list(args[1:])
+            return await getattr(self.controller, method)(*args, **kwargs)
+        if method not in CALL_METHODS:
+            raise ValueError("{} can not be called remotely.".format(method))
+        return await self.controller.call(getattr(smaract, method), *args, **kwargs)
+
+    # subscriptions: one poll loop for all clients, only changes are sent
+    async def subscribe(self, conn, channels):
+        self._subscribers[conn] = [self.controller.smaract._channel_index(ch) for ch in channels]
+        # the first update of a subscriber has all of its channels
+        status = await self.controller.read_status(self._subscribers[conn])
+        self._send_update(conn, [(int(st.channel), st.position, int(st.state)) for st in status])
+        if self._poll_task is None:
+            self._wake = asyncio.Event()
+            self._poll_task = asyncio.ensure_future(self._poll())
+        self._wake.set()
+
+    def unsubscribe(self, conn):
+        self._subscribers.pop(conn, None)
+
+    def _send_update(self, conn, items):
+        body = _update_head.pack(time.time(), len(items)) + b"".join(_update_item.pack(*item) for item in items)
+        conn.send(0, OP_UPDATE, body)
+
+    async def _poll(self):
+        moving = stage.ctl.ChannelState.ACTIVELY_MOVING
+        while True:
+            channels = sorted(set(ch for chans in self._subscribers.values() for ch in chans))
+            busy = False
+            if channels:
+                try:
+                    status = await self.controller.read_status(channels)
+                except Exception as ex:
+                    print("[SmarActServer] status read failed: {}".format(ex))
+                    status = []
+                changed = {}
+                for st in status:
+                    ch, value = int(st.channel), (st.position, int(st.state))
+                    busy = busy or bool(value[1] & moving)
+                    if self._last.get(ch) != value:
+                        self._last[ch] = changed[ch] = value
+                for conn, chans in list(self._subscribers.items()):
+                    items = [(ch,) + changed[ch] for ch in chans if ch in changed]
+                    if items:
+                        self._send_update(conn, items)
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.fast if busy else self.slow)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def kick(self):
+        # poll now, e.g. after a move
+        if self._wake is not None:
+            self._wake.set()
+        if self.on_move is not None:
+            self.on_move()
+
+    def stop(self):
+        # stop listening and polling; open connections end with the event loop
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            self._poll_task = None
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+    async def close(self):
+        server, task = self._server, self._poll_task
+        self.stop()
+        if task is not None:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if server is not None:
+            await server.wait_closed()
+
+class SmarActClient():
+    """
+    SmarAct API of a controller served by a SmarActServer.
+
+        s = SmarActClient("127.0.0.1:7455")
+        s.mv("trans1", 1.0)
+        print(s.get_positions())
+
+    Positions are in mm or deg as with SmarAct. Failed requests raise
+    RemoteError. Record array results of CALL methods (e.g. mv_many) come
+    back as lists of dicts.
+    """
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=None):
+        address = parse_address(address)
+        if isinstance(address, tuple):
+            self.sock = socket.create_connection(address)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(address)
+        self.timeout = timeout
+        self._send_lock = threading.Lock()
+        self._rids = itertools.count(1)
+        self._replies = {}
+        self._callbacks = []
+        self._closed = False
+        self._reader = threading.Thread(target=self._read_loop, name="smaract-client", daemon=True)
+        self._reader.start()
+        info = self._call("info")
+        self.smaractstage = info["device"]
+        self.channels = info["channels"]
+        self.channel_names = info["channel_names"]
+        self.units = info["units"]
+
+    # transport
+    def _recv_exactly(self, n):
+        data = bytearray()
+        while len(data) < n:
+            chunk = self.sock.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError("connection to the SmarAct server closed.")
+            data += chunk
+        return bytes(data)
+
+    def _read_loop(self):
+        try:
+            while True:
+                length, rid, op = _header.unpack(self._recv_exactly(_header.size))
+                body = self._recv_exactly(length - 5)
+                if rid == 0 and op == OP_UPDATE:
+                    self._dispatch_update(body)
+                    continue
+                slot = self._replies.get(rid)
+                if slot is not None:
+                    slot[1] = (op, body)
+                    slot[0].set()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self._closed = True
+            for event, _ in list(self._replies.values()):
+                event.set()
+
+    def _request(self, op, body=b""):
+        rid = next(self._rids)
+        slot = [threading.Event(), None]
+        self._replies[rid] = slot
+        try:
+            # checked after the slot is registered: the reader sets _closed
+            # before it wakes the registered slots
+            if self._closed:
+                raise ConnectionError("connection to the SmarAct server closed.")
+            with self._send_lock:
+                self.sock.sendall(_pack_frame(rid, op, body))
+            if not slot[0].wait(self.timeout):
+                raise TimeoutError("no reply from the SmarAct server.")
+        finally:
+            self._replies.pop(rid, None)
+        if slot[1] is None:
+            raise ConnectionError("connection to the SmarAct server closed.")
+        rop, rbody = slot[1]
+        if rop == OP_ERROR:
+            code, = struct.unpack_from("<H", rbody)
+            raise RemoteError(code, rbody[2:].decode())
+        return rbody
+
+    def _call(self, method, *args, **kwargs):
+        body = json.dumps({"method": method, "args": _jsonable(args), "kwargs": _jsonable(kwargs)}).encode()
+        return json.loads(self._request(OP_CALL, body).decode())
+
+    def _channel_index(self, ax):
+        if type(ax) == str:
+            return self.channels[self.channel_names.index(ax)]
+        return ax
+
+    # reads
+    def read_properties(self, requests):
+        # raw values of [(axis, property key)] in one request
+        body = bytes([len(requests)]) + b"".join(_read_item.pack(self._channel_index(ax), int(pkey))
+                                                 for ax, pkey in requests)
+        reply = self._request(OP_READ, body)
+        values = []
+        for k in range(len(requests)):
+            code, value = _read_reply.unpack_from(reply, k*_read_reply.size)
+            if code:
+                raise RemoteError(code, "reading property 0x{:08X} failed.".format(int(requests[k][1])))
+            values.append(value)
+        return values
+
+    def read_status(self, axes=None):
+        chans = [self._channel_index(ax) for ax in (self.channels if axes is None else axes)]
+        reply = self._request(OP_STATUS, bytes([len(chans)] + chans))
+        status = np.empty(len(chans), dtype=stage.status_dtype)
+        status['channel'] = chans
+        for k in range(len(chans)):
+            status['position'][k], status['state'][k] = _status_item.unpack_from(reply, k*_status_item.size)
+        return status.view(np.recarray)
+
+    def get_positions(self, axes=None):
+        return np.asarray(self.read_status(axes).position)
+
+    def get_states(self, axes=None):
+        return np.asarray(self.read_status(axes).state)
+
+    def get_pos(self, ax):
+        return float(self.read_status([ax]).position[0])
+
+    def ismoving(self, ax):
+        return self._call("ismoving", self._channel_index(ax))
+
+    # motion
+    def move(self, channel, target=0.001, absolute=True, wait=True):
+        reply = self._request(OP_MOVE, _move.pack(self._channel_index(channel), float(target), int(absolute), int(wait)))
+        return bool(reply[0])
+
+    def mv(self, ax, target, wait=True):
+        self.move(ax, target, absolute=True, wait=wait)
+
+    def mvr(self, ax, target, wait=True):
+        self.move(ax, target, absolute=False, wait=wait)
+
+    def waitdone(self, channel, timeout=None):
+        reply = self._request(OP_WAIT, _wait.pack(self._channel_index(channel), -1.0 if timeout is None else timeout))
+        return bool(reply[0])
+
+    def stop(self, channel):
+        self._request(OP_STOP, bytes([self._channel_index(channel)]))
+
+    def mv_many(self, targets, absolute=True, wait=True, synchronize=False):
+        rows = self._call("mv_many", {self._channel_index(ax): t for ax, t in targets.items()},
+                          absolute=absolute, wait=wait, synchronize=synchronize)
+        return None if rows is None else _move_result(rows)
+
+    def waitdone_many(self, axes, timeout=None):
+        return _move_result(self._call("waitdone_many", [self._channel_index(ax) for ax in axes], timeout=timeout))
+
+    def calibrate_all(self, axes=None, groups=None, skip_done=True, timeout=None):
+        return self._call("calibrate_all", axes=axes, groups=groups, skip_done=skip_done, timeout=timeout)
+
+    def reference_all(self, axes=None, groups=None, skip_done=True, speed=(1, 10), timeout=None):
+        return self._call("reference_all", axes=axes, groups=groups, skip_done=skip_done, speed=speed, timeout=timeout)
+
+    # configuration
+    def set_speed(self, channel, vel=None, acc=None):
+        self._call("set_speed", self._channel_index(channel), vel, acc)
+
+    def get_speed(self, channel):
+        return tuple(self._call("get_speed", self._channel_index(channel)))
+
+    def get_property(self, channel, pkey):
+        return self._call("get_property", self._channel_index(channel), int(pkey))
+
+    def set_property(self, channel, pkey, value):
+        self._call("set_property", self._channel_index(channel), int(pkey), value)
+
+    # position compare trigger
+    def set_trigger(self, ax, start, increment, count=None, direction="forward", pulse_width=1E-6,
+                    polarity="high", arm=False):
+        self._call("set_trigger", self._channel_index(ax), start, increment, count, direction, pulse_width,
+                   polarity, arm)
+
+    def arm_trigger(self, ax):
+        self._call("arm_trigger", self._channel_index(ax))
+
+    def disarm_trigger(self, ax):
+        return self._call("disarm_trigger", self._channel_index(ax))
+
+    def trigger_count(self, ax):
+        return self._call("trigger_count", self._channel_index(ax))
+
+    # subscriptions
+    def subscribe(self, callback, axes=None):
+        # callback(t, status) is called on the client's reader thread with the
+        # channels whose position or state changed; t is time.time() of the server.
+        # All callbacks of a client share one subscription of the given axes.
+        self._callbacks.append(callback)
+        chans = [self._channel_index(ax) for ax in (self.channels if axes is None else axes)]
+        self._request(OP_SUBSCRIBE, bytes([len(chans)] + chans))
+
+    def unsubscribe(self, callback=None):
+        if callback is None:
+            self._callbacks.clear()
+        elif callback in self._callbacks:
+            self._callbacks.remove(callback)
+        if not self._callbacks:
+            self._request(OP_UNSUBSCRIBE)
+
+    def _dispatch_update(self, body):
+        t, n = _update_head.unpack_from(body)
+        status = np.empty(n, dtype=stage.status_dtype)
+        for k in range(n):
+            status[k] = _update_item.unpack_from(body, _update_head.size + k*_update_item.size)
+        status = status.view(np.recarray)
+        for callback in list(self._callbacks):
+            # a failing callback must not end the reader thread
+            try:
+                callback(t, status)
+            except Exception as ex:
+                print("SmarAct client: update callback {!r} failed: {!r}".format(callback, ex))
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self._reader.join()
+
+def main(argv=None):
+    """
+    Run a controller sharing server (console script smaract-server).
+    """
+    parser = argparse.ArgumentParser(description="Share one SmarAct MCS2 controller between processes.")
+    parser.add_argument("--device", default="MCS2-00015447", help="serial number or locator of the controller")
+    parser.add_argument("--channels", type=int, nargs="+", default=[0, 1, 2, 3], help="channels to serve")
+    parser.add_argument("--address", default=DEFAULT_ADDRESS, help="host:port or Unix socket path")
+    parser.add_argument("--backend", choices=["sdk", "sim"],
+                        help="controller backend (default: SMARACT_BACKEND or the SmarAct SDK)")
+    args = parser.parse_args(argv)
+    if args.backend:
+        stage.use_backend(args.backend)
+    from SmaractStage.SmaractAsync import AsyncSmarAct
+    smaract = stage.SmarAct(args.device, channels=args.channels)
+    if not hasattr(smaract, "smaract"):
+        raise SystemExit("cannot open the controller {}.".format(args.device))
+    controller = AsyncSmarAct(smaract)
+
+    async def serve():
+        server = SmarActServer(controller, args.address)
+        await server.start()
+        print("serving {} on {}".format(args.device, args.address))
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        controller.close()
+        smaract.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,915 @@
+"""
+In-process simulation of the SmarActCTL python API (smaract.ctl) for MCS2.
+
+The module exposes the subset of smaract.ctl used by this package with the
+same names and call signatures, so it can be loaded in place of the vendor
+SDK:
+
+    SMARACT_BACKEND=sim python -m SmaractStage.SmaractMotorRecord
+
+or, from python,
+
+    import SmaractStage.SmaractStage as ss
+    from SmaractStage import SmaractSim
+    ss.use_backend(SmaractSim)
+
+Positions are integrated in wall-clock time from trapezoidal velocity
+profiles (MOVE_VELOCITY / MOVE_ACCELERATION), so a move takes as long as it
+would on the stage. Every controller transaction costs a configurable
+round-trip latency; RequestReadProperty/RequestWriteProperty_x are pipelined
+the way they are on the real link (the reply becomes available one latency
+after the request was sent).
+
+Property key values are arbitrary; code must only use the symbolic names.
+"""
+import math
+import struct
+import threading
+import time
+from collections import Counter, deque
+from enum import IntEnum, IntFlag
+
+api_version = (1, 3, 36)
+_lib_version = "1.3.36.0"
+
+INFINITE = 0xFFFFFFFF
+HOLD_TIME_INFINITE = 60000
+
+# one controller round trip [s]; see set_latency()
+latency = 0.0005
+
+
+class Property(IntEnum):
+    NUMBER_OF_CHANNELS = 0x020F0017
+    DEVICE_SERIAL_NUMBER = 0x020F0005
+    CHANNEL_STATE = 0x0305000F
+    CHANNEL_ERROR = 0x0305007A
+    POSITION = 0x0305001D
+    TARGET_POSITION = 0x0305001E
+    MOVE_MODE = 0x03050087
+    MOVE_VELOCITY = 0x0305002A
+    MOVE_ACCELERATION = 0x0305002B
+    SCAN_VELOCITY = 0x0305002C
+    STEP_FREQUENCY = 0x0305002E
+    STEP_AMPLITUDE = 0x03050030
+    MAX_CL_FREQUENCY = 0x0305002F
+    HOLD_TIME = 0x03050028
+    POS_BASE_UNIT = 0x03020042
+    CALIBRATION_OPTIONS = 0x0305005D
+    REFERENCING_OPTIONS = 0x0305005C
+    BROADCAST_STOP_OPTIONS = 0x0305005E
+    RANGE_LIMIT_MIN = 0x03050020
+    RANGE_LIMIT_MAX = 0x03050021
+    CH_OUTPUT_TRIG_MODE = 0x0306001D
+    CH_OUTPUT_TRIG_POLARITY = 0x0306001E
+    CH_OUTPUT_TRIG_PULSE_WIDTH = 0x0306001F
+    CH_POS_COMP_START_THRESHOLD = 0x03060020
+    CH_POS_COMP_INCREMENT = 0x03060021
+    CH_POS_COMP_DIRECTION = 0x03060022
+    CH_POS_COMP_LIMIT_MIN = 0x03060023
+    CH_POS_COMP_LIMIT_MAX = 0x03060024
+    STREAM_BASE_RATE = 0x040F002C
+    STREAM_OPTIONS = 0x040F002D
+
+
+class ChannelState(IntFlag):
+    ACTIVELY_MOVING = 0x0001
+    CLOSED_LOOP_ACTIVE = 0x0002
+    CALIBRATING = 0x0004
+    REFERENCING = 0x0008
+    MOVE_DELAYED = 0x0010
+    SENSOR_PRESENT = 0x0020
+    IS_CALIBRATED = 0x0040
+    IS_REFERENCED = 0x0080
+    END_STOP_REACHED = 0x0100
+    RANGE_LIMIT_REACHED = 0x0200
+    FOLLOWING_LIMIT_REACHED = 0x0400
+    MOVEMENT_FAILED = 0x0800
+    IS_STREAMING = 0x1000
+    POSITIONER_OVERLOAD = 0x2000
+    OVER_TEMPERATURE = 0x4000
+    REFERENCE_MARK = 0x8000
+
+
+class MoveMode(IntEnum):
+    CL_ABSOLUTE = 0
+    CL_RELATIVE = 1
+    SCAN_ABSOLUTE = 2
+    SCAN_RELATIVE = 3
+    STEP = 4
+
+
+class BaseUnit(IntEnum):
+    NONE = 0
+    METER = 2
+    DEGREE = 3
+
+
+class BroadcastStopOption(IntFlag):
+    END_OF_MOVEMENT = 0x0001
+    RANGE_LIMIT_REACHED = 0x0002
+    FOLLOWING_LIMIT_REACHED = 0x0004
+    END_STOP_REACHED = 0x0008
+
+
+class EventType(IntEnum):
+    NONE = 0x0000
+    MOVEMENT_FINISHED = 0x0001
+    SENSOR_STATE_CHANGED = 0x0002
+    REFERENCE_FOUND = 0x0003
+    FOLLOWING_LIMIT_REACHED = 0x0004
+    HOLDING_ABORTED = 0x0005
+    STREAM_FINISHED = 0x8000
+    STREAM_READY = 0x8001
+
+
+class StreamTriggerMode(IntEnum):
+    DIRECT = 0
+    EXTERNAL_ONCE = 1
+    EXTERNAL_SYNC = 2
+    EXTERNAL = 3
+
+
+class ErrorCode(IntEnum):
+    NONE = 0x0000
+    UNKNOWN_COMMAND = 0x0001
+    INVALID_PACKET_SIZE = 0x0002
+    TIMEOUT = 0x0004
+    BUFFER_UNDERFLOW = 0x000C
+    BUFFER_OVERFLOW = 0x000D
+    INVALID_KEY = 0x0012
+    INVALID_PARAMETER = 0x0013
+    ABORTED = 0x0019
+    INVALID_CHANNEL_INDEX = 0x0022
+    PERMISSION_DENIED = 0x0023
+    NO_SENSOR_PRESENT = 0x0100
+    END_STOP_REACHED = 0x0200
+    RANGE_LIMIT_REACHED = 0x0202
+    INVALID_LOCATOR = 0xF001
+    DEVICE_NOT_FOUND = 0xF003
+    INVALID_HANDLE = 0xF005
+    CANCELED = 0xF008
+
+
+class Error(Exception):
+    def __init__(self, func, code):
+        self.func = func
+        self.code = int(code)
+        super().__init__("{}: {} (0x{:04X})".format(func, GetResultInfo(code), self.code))
+
+
+class Event():
+    def __init__(self, idx, type, i32=0):
+        self.idx = idx
+        self.type = type
+        self.i32 = i32
+
+    def __repr__(self):
+        return "Event(idx={}, type={}, i32=0x{:04X})".format(self.idx, EventType(self.type).name, self.i32)
+
+
+def GetResultInfo(code):
+    try:
+        return ErrorCode(code).name.replace("_", " ").lower()
+    except ValueError:
+        return "unknown error"
+
+
+def GetFullVersionString():
+    return _lib_version
+
+
+# open loop model: full piezo scan range (65535 = 100 V) and step width at full amplitude [pm]
+SCAN_MAX = 65535
+SCAN_STROKE = 1.6e6
+STEP_WIDTH = 1.0e5
+# channel output trigger modes and position compare directions
+TRIGGER_CONSTANT = 0
+TRIGGER_POSITION_COMPARE = 1
+FORWARD_DIRECTION = 1
+BACKWARD_DIRECTION = 2
+EITHER_DIRECTION = 3
+
+
+def set_latency(seconds):
+    """Set the simulated controller round-trip time for all devices."""
+    global latency
+    latency = float(seconds)
+
+
+# ---------------------------------------------------------------------------
+# kinematics
+# ---------------------------------------------------------------------------
+def _plan(p0, v0, target, vmax, acc):
+    # Phases (duration, v_start, a) of a move from p0 with velocity v0 that
+    # comes to rest at target. acc == inf means no acceleration control.
+    d = target - p0
+    if math.isinf(acc):
+        if d == 0:
+            return []
+        return [(abs(d) / vmax, math.copysign(vmax, d), 0.0)]
+    phases = []
+    # moving away from the target, or too fast to stop in time: brake first
+    if v0 != 0 and (v0 * d < 0 or v0 * v0 / (2 * acc) > abs(d)):
+        t = abs(v0) / acc
+        a = -math.copysign(acc, v0)
+        phases.append((t, v0, a))
+        p0 += v0 * t + 0.5 * a * t * t
+        v0 = 0.0
+        d = target - p0
+    if d == 0:
+        return phases
+    s = math.copysign(1.0, d)
+    dist = abs(d)
+    u = abs(v0)
+    vp = min(vmax, math.sqrt((2 * acc * dist + u * u) / 2))
+    t1 = abs(vp - u) / acc
+    d1 = abs(vp * vp - u * u) / (2 * acc)
+    t3 = vp / acc
+    d3 = vp * vp / (2 * acc)
+    t2 = max(dist - d1 - d3, 0.0) / vp
+    a1 = s * acc if vp >= u else -s * acc
+    phases += [(t1, s * u, a1), (t2, s * vp, 0.0), (t3, s * vp, -s * acc)]
+    return phases
+
+
+class _Profile():
+    # A planned motion: position(t) is integrated over piecewise constant
+    # acceleration phases and ends exactly at p_end.
+    def __init__(self, t0, p0, phases, p_end, kind="move", result=ErrorCode.NONE, flags=0):
+        self.t0 = t0
+        self.p0 = p0
+        self.phases = phases
+        self.p_end = p_end
+        self.kind = kind
+        self.result = result
+        self.flags = flags
+        self.t_end = t0 + sum(ph[0] for ph in phases)
+
+    def sample(self, t):
+        if t >= self.t_end:
+            return self.p_end, 0.0
+        dt = t - self.t0
+        p = self.p0
+        for duration, v, a in self.phases:
+            if dt <= duration:
+                return p + v * dt + 0.5 * a * dt * dt, v + a * dt
+            p += v * duration + 0.5 * a * duration * duration
+            dt -= duration
+        return self.p_end, 0.0
+
+
+class _Stream():
+    # An open command stream. Frame k is executed at t0 + k/rate, channel
+    # positions are interpolated linearly between frames. The stream runs
+    # dry (underflow) if frame k has not arrived by then.
+    def __init__(self, handle, rate, capacity):
+        self.handle = handle
+        self.rate = float(rate)
+        self.capacity = capacity
+        self.t0 = None
+        self.closed = False
+        self.positions = {}
+        self.n_frames = 0
+
+    def consumed(self, now):
+        if self.t0 is None:
+            return 0
+        return min(int((now - self.t0)*self.rate) + 1, self.n_frames)
+
+    @property
+    def t_end(self):
+        if self.t0 is None:
+            return math.inf
+        return self.t0 + (self.n_frames - (1 if self.closed else 0))/self.rate
+
+
+class _StreamProfile():
+    # channel motion that follows a command stream
+    kind = "stream"
+
+    def __init__(self, stream, idx):
+        self.stream = stream
+        self.idx = idx
+
+    @property
+    def t_end(self):
+        return self.stream.t_end
+
+    def sample(self, t):
+        st = self.stream
+        pos = st.positions[self.idx]
+        f = (t - st.t0)*st.rate
+        if f <= 0:
+            return pos[0], 0.0
+        i = int(f)
+        if i >= len(pos) - 1:
+            return pos[-1], 0.0
+        step = pos[i + 1] - pos[i]
+        return pos[i] + (f - i)*step, step*st.rate
+
+
+class _Channel():
+    def __init__(self, base_unit=BaseUnit.METER, travel=(-12.0e9, 12.0e9), vmax=20.0e9):
+        self.props = {
+            Property.MOVE_MODE: MoveMode.CL_ABSOLUTE,
+            Property.MOVE_VELOCITY: 0,
+            Property.MOVE_ACCELERATION: 0,
+            Property.MAX_CL_FREQUENCY: 13000,
+            Property.HOLD_TIME: 0,
+            Property.POS_BASE_UNIT: int(base_unit),
+            Property.CALIBRATION_OPTIONS: 0,
+            Property.REFERENCING_OPTIONS: 0,
+            Property.BROADCAST_STOP_OPTIONS: 0,
+            Property.CHANNEL_ERROR: 0,
+            Property.RANGE_LIMIT_MIN: 0,
+            Property.RANGE_LIMIT_MAX: 0,
+            Property.SCAN_VELOCITY: 0,
+            Property.STEP_FREQUENCY: 1000,
+            Property.STEP_AMPLITUDE: 65535,
+            Property.CH_OUTPUT_TRIG_MODE: TRIGGER_CONSTANT,
+            Property.CH_OUTPUT_TRIG_POLARITY: 1,
+            Property.CH_OUTPUT_TRIG_PULSE_WIDTH: 1000,
+            Property.CH_POS_COMP_START_THRESHOLD: 0,
+            Property.CH_POS_COMP_INCREMENT: 0,
+            Property.CH_POS_COMP_DIRECTION: FORWARD_DIRECTION,
+            Property.CH_POS_COMP_LIMIT_MIN: 0,
+            Property.CH_POS_COMP_LIMIT_MAX: 0,
+        }
+        # mechanical travel in pm (ndeg) of the physical position
+        self.travel = travel
+        self.vmax = vmax
+        self.physical = 0.0
+        self.offset = 0.0
+        self.target = 0
+        # piezo scan value, 0 - 65535
+        self.scan_value = 32768
+        self.flags = ChannelState.SENSOR_PRESENT | ChannelState.IS_CALIBRATED
+        self.profile = None
+        # position compare output: pulses put out so far and the position they were counted up to
+        self.trigger_pulses = 0
+        self.trigger_pos = 0.0
+
+    def velocity_limits(self):
+        vel = self.props[Property.MOVE_VELOCITY]
+        acc = self.props[Property.MOVE_ACCELERATION]
+        vmax = self.vmax if vel <= 0 else min(float(vel), self.vmax)
+        acc = math.inf if acc <= 0 else float(acc)
+        return vmax, acc
+
+    def sample(self, t):
+        if self.profile is None:
+            return self.physical, 0.0
+        return self.profile.sample(t)
+
+    def count_triggers(self, t):
+        # Position compare pulses from trigger_pos to the position at t. Positions are
+        # only looked at when the device is accessed, which is exact for the monotonic
+        # moves of a fly scan.
+        p = self.sample(t)[0] + self.offset
+        prev, self.trigger_pos = self.trigger_pos, p
+        props = self.props
+        inc = props[Property.CH_POS_COMP_INCREMENT]
+        if props[Property.CH_OUTPUT_TRIG_MODE] != TRIGGER_POSITION_COMPARE or inc <= 0 or p == prev:
+            return
+        lo, hi = props[Property.CH_POS_COMP_LIMIT_MIN], props[Property.CH_POS_COMP_LIMIT_MAX]
+        if lo >= hi:
+            lo, hi = -math.inf, math.inf
+        direction = props[Property.CH_POS_COMP_DIRECTION]
+        threshold = props[Property.CH_POS_COMP_START_THRESHOLD]
+        if direction == EITHER_DIRECTION:
+            # every threshold of the grid within the limits, in both directions
+            a, b = min(max(prev, lo), hi), min(max(p, lo), hi)
+            self.trigger_pulses += abs(math.floor((b - threshold)/inc) - math.floor((a - threshold)/inc))
+            return
+        if direction == FORWARD_DIRECTION and p > prev and prev < threshold <= min(p, hi):
+            n = int((min(p, hi) - threshold)//inc) + 1
+            props[Property.CH_POS_COMP_START_THRESHOLD] = threshold + n*inc
+        elif direction == BACKWARD_DIRECTION and p < prev and max(p, lo) <= threshold < prev:
+            n = int((threshold - max(p, lo))//inc) + 1
+            props[Property.CH_POS_COMP_START_THRESHOLD] = threshold - n*inc
+        else:
+            return
+        self.trigger_pulses += n
+
+
+class _Device():
+    def __init__(self, serial, base_units):
+        self.serial = serial
+        self.locator = "network:sn:{}".format(serial)
+        self.channels = [_Channel(bu) for bu in base_units]
+        self.lock = threading.RLock()
+        self.cond = threading.Condition(self.lock)
+        self.events = deque(maxlen=1024)
+        self.replies = {}
+        self.next_rid = 1
+        self.handle = None
+        self.latency = None
+        self.stream = None
+        self.stream_capacity = 1024
+        self.base_rate = 1000
+        # number of controller transactions per api function
+        self.calls = Counter()
+        self.calibration_time = 1.0
+
+    def round_trip(self):
+        return latency if self.latency is None else self.latency
+
+    def channel(self, func, idx):
+        if not 0 <= idx < len(self.channels):
+            raise Error(func, ErrorCode.INVALID_CHANNEL_INDEX)
+        return self.channels[idx]
+
+    def update(self, now):
+        st = self.stream
+        if st is not None and now >= st.t_end:
+            self.finish_stream(st.t_end, ErrorCode.NONE if st.closed else ErrorCode.BUFFER_UNDERFLOW)
+        # retire finished profiles and queue their MOVEMENT_FINISHED events
+        for idx, ch in enumerate(self.channels):
+            prof = ch.profile
+            if prof is None or prof.kind == "stream" or now < prof.t_end:
+                ch.count_triggers(now)
+                continue
+            ch.physical = prof.p_end
+            ch.profile = None
+            ch.flags &= ~(ChannelState.ACTIVELY_MOVING | ChannelState.CALIBRATING | ChannelState.REFERENCING)
+            if not ch.props[Property.HOLD_TIME]:
+                ch.flags &= ~ChannelState.CLOSED_LOOP_ACTIVE
+            ch.count_triggers(prof.t_end)
+            ch.flags |= prof.flags
+            if prof.kind == "reference":
+                ch.offset = -ch.physical
+                ch.target = 0
+                ch.trigger_pos = 0.0
+            self.events.append((prof.t_end, Event(idx, EventType.MOVEMENT_FINISHED, int(prof.result))))
+            self.cond.notify_all()
+
+    def finish_stream(self, t, result):
+        st = self.stream
+        for idx in st.positions:
+            ch = self.channels[idx]
+            if st.t0 is not None:
+                ch.physical = ch.profile.sample(t)[0]
+            ch.profile = None
+            ch.flags &= ~(ChannelState.IS_STREAMING | ChannelState.ACTIVELY_MOVING)
+        self.stream = None
+        self.events.append((t, Event(st.handle, EventType.STREAM_FINISHED, int(result))))
+        self.cond.notify_all()
+
+    def next_deadline(self):
+        ends = [ch.profile.t_end for ch in self.channels
+                if ch.profile is not None and not math.isinf(ch.profile.t_end)]
+        return min(ends) if ends else None
+
+    def read(self, idx, pkey, now):
+        if pkey == Property.NUMBER_OF_CHANNELS:
+            return len(self.channels)
+        if pkey == Property.STREAM_BASE_RATE:
+            return self.base_rate
+        ch = self.channel("ReadProperty", idx)
+        if pkey == Property.CHANNEL_STATE:
+            return int(ch.flags)
+        if pkey == Property.POSITION:
+            return int(round(ch.sample(now)[0] + ch.offset))
+        if pkey == Property.TARGET_POSITION:
+            return int(ch.target)
+        return int(ch.props.get(pkey, 0))
+
+    def write(self, idx, pkey, value, now):
+        if pkey == Property.STREAM_BASE_RATE:
+            if not 1 <= value <= 15000:
+                raise Error("WriteProperty", ErrorCode.INVALID_PARAMETER)
+            self.base_rate = int(value)
+            return
+        ch = self.channel("WriteProperty", idx)
+        if pkey in (Property.CHANNEL_STATE, Property.NUMBER_OF_CHANNELS, Property.POS_BASE_UNIT):
+            raise Error("WriteProperty", ErrorCode.PERMISSION_DENIED)
+        if pkey == Property.POSITION:
+            ch.offset = value - ch.sample(now)[0]
+            ch.trigger_pos = value
+            return
+        ch.props[pkey] = int(value)
+        if pkey in (Property.CH_OUTPUT_TRIG_MODE, Property.CH_POS_COMP_START_THRESHOLD):
+            # pulses are only counted from (re)arming on
+            ch.trigger_pos = ch.sample(now)[0] + ch.offset
+
+    def start(self, idx, target_physical, now, kind="move", result=ErrorCode.NONE, flags=0):
+        ch = self.channels[idx]
+        p0, v0 = ch.sample(now)
+        lo, hi = ch.travel
+        end_flags = flags
+        if target_physical < lo or target_physical > hi:
+            target_physical = min(max(target_physical, lo), hi)
+            end_flags |= ChannelState.END_STOP_REACHED
+            result = ErrorCode.END_STOP_REACHED
+        vmax, acc = ch.velocity_limits()
+        phases = _plan(p0, v0, target_physical, vmax, acc)
+        ch.physical = p0
+        ch.flags &= ~ChannelState.END_STOP_REACHED
+        ch.profile = _Profile(now, p0, phases, target_physical, kind, result, end_flags)
+        # wake WaitForEvent so it sleeps until the end of the new profile
+        self.cond.notify_all()
+
+    def start_linear(self, idx, distance, duration, now, kind):
+        # open loop motion: constant velocity over `distance`, clamped by the end stops
+        ch = self.channels[idx]
+        p0 = ch.sample(now)[0]
+        lo, hi = ch.travel
+        p_end = p0 + distance
+        result, flags = ErrorCode.NONE, 0
+        if p_end < lo or p_end > hi:
+            p_end = min(max(p_end, lo), hi)
+            flags = ChannelState.END_STOP_REACHED
+            result = ErrorCode.END_STOP_REACHED
+        phases = [(duration, (p_end - p0) / duration, 0.0)] if duration > 0 and p_end != p0 else []
+        ch.physical = p0
+        ch.flags &= ~(ChannelState.END_STOP_REACHED | ChannelState.CLOSED_LOOP_ACTIVE)
+        ch.profile = _Profile(now, p0, phases, p_end, kind, result, flags)
+        self.cond.notify_all()
+
+    def stop(self, idx, now):
+        ch = self.channels[idx]
+        if self.stream is not None and idx in self.stream.positions:
+            # stopping a streaming channel aborts the stream
+            self.finish_stream(now, ErrorCode.ABORTED)
+        if ch.profile is None:
+            ch.flags &= ~ChannelState.CLOSED_LOOP_ACTIVE
+            return
+        p0, v0 = ch.sample(now)
+        _, acc = ch.velocity_limits()
+        if math.isinf(acc) or v0 == 0:
+            phases, p_end = [], p0
+        else:
+            t = abs(v0) / acc
+            a = -math.copysign(acc, v0)
+            phases = [(t, v0, a)]
+            p_end = p0 + v0 * t + 0.5 * a * t * t
+        ch.physical = p0
+        ch.flags &= ~(ChannelState.CALIBRATING | ChannelState.REFERENCING)
+        ch.profile = _Profile(now, p0, phases, p_end, "stop", ErrorCode.ABORTED)
+        self.cond.notify_all()
+
+
+# ---------------------------------------------------------------------------
+# device registry
+# ---------------------------------------------------------------------------
+_registry_lock = threading.Lock()
+_devices = {}
+_handles = {}
+_next_handle = 1
+
+
+def add_device(serial, base_units=(BaseUnit.METER, BaseUnit.METER, BaseUnit.METER,
+                                   BaseUnit.DEGREE, BaseUnit.METER, BaseUnit.METER)):
+    """Make a simulated MCS2 with one channel per entry of base_units discoverable."""
+    with _registry_lock:
+        dev = _Device(serial, [BaseUnit(bu) for bu in base_units])
+        _devices[serial] = dev
+        return dev
+
+
+def get_device(d_handle_or_serial):
+    """Return the simulated device behind a handle or serial number (for tests and benchmarks)."""
+    if d_handle_or_serial in _handles:
+        return _handles[d_handle_or_serial]
+    return _devices[d_handle_or_serial]
+
+
+def reset():
+    """Close all handles and restore the default device list."""
+    with _registry_lock:
+        _devices.clear()
+        _handles.clear()
+    add_device("MCS2-00015447")
+
+
+def _device(func, d_handle):
+    try:
+        dev = _handles[d_handle]
+    except KeyError:
+        raise Error(func, ErrorCode.INVALID_HANDLE)
+    dev.calls[func] += 1
+    return dev
+
+
+def _wait_until(t):
+    delay = t - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+
+def _transaction(dev):
+    # a blocking call: one full round trip on the link
+    rtt = dev.round_trip()
+    if rtt > 0:
+        time.sleep(rtt)
+
+
+# ---------------------------------------------------------------------------
+# smaract.ctl api
+# ---------------------------------------------------------------------------
+def FindDevices(options=""):
+    time.sleep(0.05)
+    with _registry_lock:
+        return "\n".join(dev.locator for dev in _devices.values())
+
+
+def Open(locator, config=""):
+    global _next_handle
+    with _registry_lock:
+        for dev in _devices.values():
+            if dev.locator == locator or dev.serial == locator:
+                break
+        else:
+            raise Error("Open", ErrorCode.DEVICE_NOT_FOUND)
+        if dev.handle is not None:
+            # an MCS2 can only be opened once
+            raise Error("Open", ErrorCode.PERMISSION_DENIED)
+        handle = _next_handle
+        _next_handle += 1
+        dev.handle = handle
+        _handles[handle] = dev
+    dev.calls["Open"] += 1
+    _transaction(dev)
+    return handle
+
+
+def Close(d_handle):
+    with _registry_lock:
+        dev = _handles.pop(d_handle, None)
+        if dev is None:
+            raise Error("Close", ErrorCode.INVALID_HANDLE)
+        dev.handle = None
+    with dev.lock:
+        dev.cond.notify_all()
+
+
+def GetProperty_i32(d_handle, idx, pkey):
+    dev = _device("GetProperty_i32", d_handle)
+    _transaction(dev)
+    with dev.lock:
+        now = time.monotonic()
+        dev.update(now)
+        return dev.read(idx, pkey, now)
+
+
+GetProperty_i64 = GetProperty_i32
+
+
+def SetProperty_i32(d_handle, idx, pkey, value):
+    dev = _device("SetProperty_i32", d_handle)
+    _transaction(dev)
+    with dev.lock:
+        now = time.monotonic()
+        dev.update(now)
+        dev.write(idx, pkey, value, now)
+
+
+SetProperty_i64 = SetProperty_i32
+
+
+def RequestReadProperty(d_handle, idx, pkey, tHandle=0):
+    dev = _device("RequestReadProperty", d_handle)
+    with dev.lock:
+        now = time.monotonic()
+        dev.update(now)
+        try:
+            reply = dev.read(idx, pkey, now)
+        except Error as e:
+            reply = e
+        rid = dev.next_rid
+        dev.next_rid += 1
+        dev.replies[rid] = (now + dev.round_trip(), reply)
+        return rid
+
+
+def _take_reply(func, dev, r_id):
+    with dev.lock:
+        try:
+            ready, reply = dev.replies.pop(r_id)
+        except KeyError:
+            raise Error(func, ErrorCode.INVALID_PARAMETER)
+    _wait_until(ready)
+    if isinstance(reply, Error):
+        raise Error(func, reply.code)
+    return reply
+
+
+def ReadProperty_i32(d_handle, r_id):
+    return _take_reply("ReadProperty_i32", _device("ReadProperty_i32", d_handle), r_id)
+
+
+def ReadProperty_i64(d_handle, r_id):
+    return _take_reply("ReadProperty_i64", _device("ReadProperty_i64", d_handle), r_id)
+
+
+def RequestWriteProperty_i32(d_handle, idx, pkey, value, tHandle=0, pass_rID=True):
+    dev = _device("RequestWriteProperty_i32", d_handle)
+    with dev.lock:
+        now = time.monotonic()
+        dev.update(now)
+        try:
+            dev.write(idx, pkey, value, now)
+            reply = None
+        except Error as e:
+            reply = e
+        if not pass_rID:
+            # call-and-forget: no result is generated
+            return None
+        rid = dev.next_rid
+        dev.next_rid += 1
+        dev.replies[rid] = (now + dev.round_trip(), reply)
+        return rid
+
+
+RequestWriteProperty_i64 = RequestWriteProperty_i32
+
+
+def WaitForWrite(d_handle, r_id):
+    _take_reply("WaitForWrite", _device("WaitForWrite", d_handle), r_id)
+
+
+def Move(d_handle, idx, move_value, tHandle=0):
+    dev = _device("Move", d_handle)
+    _transaction(dev)
+    with dev.lock:
+        now = time.monotonic()
+        dev.update(now)
+        ch = dev.channel("Move", idx)
+        if not ch.flags & ChannelState.SENSOR_PRESENT:
+            raise Error("Move", ErrorCode.NO_SENSOR_PRESENT)
+        mode = ch.props[Property.MOVE_MODE]
+        if mode in (MoveMode.SCAN_ABSOLUTE, MoveMode.SCAN_RELATIVE, MoveMode.STEP):
+            _open_loop_move(dev, idx, ch, mode, move_value, now)
+            return
+        if mode == MoveMode.CL_ABSOLUTE:
+            target = move_value
+        elif mode == MoveMode.CL_RELATIVE:
+            target = ch.target + move_value if ch.profile is not None else ch.sample(now)[0] + ch.offset + move_value
+        else:
+            raise Error("Move", ErrorCode.INVALID_PARAMETER)
+        ch.target = int(target)
+        ch.flags |= ChannelState.ACTIVELY_MOVING | ChannelState.CLOSED_LOOP_ACTIVE
+        dev.start(idx, target - ch.offset, now)
+
+
+def _open_loop_move(dev, idx, ch, mode, move_value, now):
+    if mode == MoveMode.STEP:
+        freq = ch.props[Property.STEP_FREQUENCY]
+        amplitude = ch.props[Property.STEP_AMPLITUDE]
+        if not 1 <= freq <= 20000:
+            raise Error("Move", ErrorCode.INVALID_PARAMETER)
+        distance = move_value * STEP_WIDTH * amplitude / SCAN_MAX
+        duration = abs(move_value) / freq
+        kind = "step"
+    else:
+        value = move_value if mode == MoveMode.SCAN_ABSOLUTE else ch.scan_value + move_value
+        if mode == MoveMode.SCAN_ABSOLUTE and not 0 <= value <= SCAN_MAX:
+            raise Error("Move", ErrorCode.INVALID_PARAMETER)
+        value = min(max(value, 0), SCAN_MAX)
+        distance = (value - ch.scan_value) * SCAN_STROKE / SCAN_MAX
+        vel = ch.props[Property.SCAN_VELOCITY]
+        duration = abs(value - ch.scan_value) / vel if vel > 0 else 0.0
+        ch.scan_value = value
+        kind = "scan"
+    ch.flags |= ChannelState.ACTIVELY_MOVING
+    dev.start_linear(idx, distance, duration, now, kind)
+
+
+def Stop(d_handle, idx, tHandle=0):
+    dev = _device("Stop", d_handle)
+    _transaction(dev)
+    with dev.lock:
+        now = time.monotonic()
+        dev.update(now)
+        dev.channel("Stop", idx)
+        dev.stop(idx, now)
+
+
+def Calibrate(d_handle, idx, tHandle=0):
+    dev = _device("Calibrate", d_handle)
+    _transaction(dev)
+    with dev.lock:
+        now = time.monotonic()
+        dev.update(now)
+        ch = dev.channel("Calibrate", idx)
+        p0 = ch.sample(now)[0]
+        ch.physical = p0
+        ch.flags &= ~(ChannelState.IS_CALIBRATED | ChannelState.IS_REFERENCED)
+        ch.flags |= ChannelState.CALIBRATING | ChannelState.ACTIVELY_MOVING
+        ch.profile = _Profile(now, p0, [(dev.calibration_time, 0.0, 0.0)], p0, "calibrate",
+                              flags=ChannelState.IS_CALIBRATED)
+        dev.cond.notify_all()
+
+
+def Reference(d_handle, idx, tHandle=0):
+    dev = _device("Reference", d_handle)
+    _transaction(dev)
+    with dev.lock:
+        now = time.monotonic()
+        dev.update(now)
+        ch = dev.channel("Reference", idx)
+        ch.flags &= ~ChannelState.IS_REFERENCED
+        ch.flags |= ChannelState.REFERENCING | ChannelState.ACTIVELY_MOVING | ChannelState.CLOSED_LOOP_ACTIVE
+        # the reference mark sits at physical position 0
+        dev.start(idx, 0.0, now, kind="reference", flags=ChannelState.IS_REFERENCED)
+
+
+def OpenCommandStream(d_handle, triggerMode=StreamTriggerMode.DIRECT):
+    dev = _device("OpenCommandStream", d_handle)
+    _transaction(dev)
+    with dev.lock:
+        dev.update(time.monotonic())
+        if dev.stream is not None:
+            raise Error("OpenCommandStream", ErrorCode.PERMISSION_DENIED)
+        dev.stream = _Stream(dev.next_rid, dev.base_rate, dev.stream_capacity)
+        dev.next_rid += 1
+        return dev.stream.handle
+
+
+def _stream(func, dev, s_handle):
+    st = dev.stream
+    if st is None or st.handle != s_handle:
+        raise Error(func, ErrorCode.INVALID_HANDLE)
+    return st
+
+
+def WriteCommandStream(d_handle, s_handle, buffer):
+    # buffer holds one frame: (uint8 channel, int64 position) pairs
+    dev = _device("WriteCommandStream", d_handle)
+    frame = list(struct.iter_unpack("<Bq", bytes(buffer)))
+    while True:
+        with dev.lock:
+            now = time.monotonic()
+            dev.update(now)
+            # raises if the stream ran dry or was aborted
+            st = _stream("WriteCommandStream", dev, s_handle)
+            if st.n_frames - st.consumed(now) < st.capacity:
+                break
+            wake = st.t0 + (st.n_frames - st.capacity)/st.rate
+        # flow control: block until the controller has room for the frame
+        _wait_until(wake)
+    with dev.lock:
+        if st.t0 is None:
+            for idx, _ in frame:
+                ch = dev.channel("WriteCommandStream", idx)
+                st.positions[idx] = []
+                ch.physical = ch.sample(now)[0]
+                ch.profile = _StreamProfile(st, idx)
+                ch.flags |= ChannelState.IS_STREAMING | ChannelState.ACTIVELY_MOVING
+                ch.flags &= ~ChannelState.END_STOP_REACHED
+            st.t0 = now
+        if sorted(idx for idx, _ in frame) != sorted(st.positions):
+            raise Error("WriteCommandStream", ErrorCode.INVALID_PARAMETER)
+        for idx, pos in frame:
+            ch = dev.channels[idx]
+            lo, hi = ch.travel
+            st.positions[idx].append(min(max(pos - ch.offset, lo), hi))
+        st.n_frames += 1
+        dev.cond.notify_all()
+
+
+def CloseCommandStream(d_handle, s_handle):
+    dev = _device("CloseCommandStream", d_handle)
+    _transaction(dev)
+    with dev.lock:
+        dev.update(time.monotonic())
+        st = _stream("CloseCommandStream", dev, s_handle)
+        st.closed = True
+        if st.t0 is None:
+            dev.finish_stream(time.monotonic(), ErrorCode.NONE)
+        dev.cond.notify_all()
+
+
+def AbortCommandStream(d_handle, s_handle):
+    dev = _device("AbortCommandStream", d_handle)
+    _transaction(dev)
+    with dev.lock:
+        now = time.monotonic()
+        dev.update(now)
+        _stream("AbortCommandStream", dev, s_handle)
+        dev.finish_stream(now, ErrorCode.ABORTED)
+
+
+def WaitForEvent(d_handle, timeout):
+    dev = _device("WaitForEvent", d_handle)
+    # timeout in ms, as in the SDK
+    deadline = None if timeout == INFINITE else time.monotonic() + timeout / 1000.0
+    with dev.lock:
+        while True:
+            now = time.monotonic()
+            dev.update(now)
+            delay = dev.round_trip() / 2
+            if dev.events and dev.events[0][0] + delay <= now:
+                return dev.events.popleft()[1]
+            if dev.handle != d_handle:
+                raise Error("WaitForEvent", ErrorCode.CANCELED)
+            if deadline is not None and now >= deadline:
+                raise Error("WaitForEvent", ErrorCode.TIMEOUT)
+            wake = [t for t in (deadline, dev.next_deadline()) if t is not None]
+            if dev.events:
+                wake.append(dev.events[0][0] + delay)
+            dev.cond.wait(max(min(wake) - now, 0.0) + 1e-4 if wake else None)
+
+
+reset()
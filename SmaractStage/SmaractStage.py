@@ -1,51 +1,296 @@
+import os
 import sys
-import smaract.ctl as ctl
+import threading
 import time
+from collections import namedtuple
+import numpy as np
 # installation: 
 # 1. download SDK
 # 2. Look for python package folder (C:\SmarAct\MCS2\SDK\Python\packages\)
 #    There, you will see a zip file, for example, smaract.ctl-1.3.36.zip
 # 3. python -m pip install smaract.<productname>-<version.zip
 
+def load_backend(name=None):
+    """
+    Import a SmarActCTL backend by name: "sdk" (smaract.ctl) or "sim"
+    (SmaractStage.SmaractSim). Without name the SMARACT_BACKEND environment
+    variable is used, and the SDK if it is not set.
+    """
+    if name is None:
+        name = os.environ.get("SMARACT_BACKEND") or "sdk"
+    name = name.lower()
+    if name == "sim":
+        from SmaractStage import SmaractSim
+        return SmaractSim
+    if name != "sdk":
+        raise ValueError("unknown backend {!r}, use 'sdk' or 'sim'.".format(name))
+    try:
+        import smaract.ctl
+    except ImportError:
+        raise ImportError("the SmarAct SDK (smaract.ctl) is not installed, see the README; "
+                          "set SMARACT_BACKEND=sim to use the simulator.")
+    return smaract.ctl
+
+class _LazyBackend():
+    # Stands in for the backend until it is first used, so importing the package
+    # neither needs the SDK nor spends time loading it.
+    def __init__(self):
+        self._backend = None
+
+    def __getattr__(self, name):
+        global ctl
+        if self._backend is None:
+            self._backend = load_backend()
+            if ctl is self:
+                ctl = self._backend
+        return getattr(self._backend, name)
+
+# the SmarActCTL api: smaract.ctl or the simulator, see use_backend()
+ctl = _LazyBackend()
+
+# record returned by SmarAct.read_status()
+status_dtype = np.dtype([('channel', np.int32), ('position', np.float64), ('state', np.int64)])
+# record returned by SmarAct.mv_many() and SmarAct.waitdone_many()
+move_result_dtype = np.dtype([('channel', np.int32), ('target', np.float64), ('position', np.float64),
+                              ('done', np.bool_), ('end_stop', np.bool_)])
+# record returned by SmarAct.calibrate_all() and SmarAct.reference_all()
+sequence_result_dtype = np.dtype([('channel', np.int32), ('skipped', np.bool_), ('done', np.bool_),
+                                  ('ok', np.bool_), ('state', np.int64)])
+# point yielded by SmarAct.scan(); commanded and measured are arrays with one entry per axis
+ScanPoint = namedtuple("ScanPoint", ["index", "commanded", "measured", "timestamp", "settle", "done"])
+# element of the array filled by SmarAct.grid_scan(): measured positions and timestamp
+grid_point_dtype = np.dtype([('fast', np.float64), ('slow', np.float64), ('timestamp', np.float64)])
+
+# configuration properties kept in the SmarAct property cache
+CACHED_PROPERTIES = ("MOVE_VELOCITY", "MOVE_ACCELERATION", "MOVE_MODE", "POS_BASE_UNIT",
+                     "HOLD_TIME", "MAX_CL_FREQUENCY", "SCAN_VELOCITY", "STEP_FREQUENCY", "STEP_AMPLITUDE")
+# properties with 64 bit values
+I64_PROPERTIES = ("MOVE_VELOCITY", "MOVE_ACCELERATION", "POSITION", "TARGET_POSITION",
+                  "CH_POS_COMP_START_THRESHOLD", "CH_POS_COMP_INCREMENT",
+                  "CH_POS_COMP_LIMIT_MIN", "CH_POS_COMP_LIMIT_MAX")
+
+def _is_cached(pkey):
+    return any(pkey == getattr(ctl.Property, name) for name in CACHED_PROPERTIES)
+
+def _is_i64(pkey):
+    return any(pkey == getattr(ctl.Property, name) for name in I64_PROPERTIES)
+
+def _unit_name(base_unit):
+    if base_unit == ctl.BaseUnit.METER:
+        return "mm"
+    return "deg"
+
+def move_time(distance, vel, acc):
+    # duration of a trapezoidal move; vel and acc <= 0 mean "no limit"
+    distance = abs(distance)
+    if vel <= 0:
+        return 0.0
+    if acc <= 0:
+        return distance/vel
+    if distance <= vel*vel/acc:
+        return 2*(distance/acc)**0.5
+    return distance/vel + vel/acc
+
+def grid_positions(start, stop, step):
+    # positions from start to stop (included) in steps of `step`
+    n = int(round(abs(stop - start)/abs(step))) + 1
+    return start + np.copysign(abs(step), stop - start)*np.arange(n)
+
+def velocity_for_time(distance, duration, acc):
+    # velocity that makes a trapezoidal move of `distance` last `duration`
+    distance = abs(distance)
+    if duration <= 0:
+        return 0.0
+    if acc <= 0:
+        return distance/duration
+    disc = max(acc*acc*duration*duration - 4*acc*distance, 0.0)
+    return (acc*duration - disc**0.5)/2
+
+# open loop moves: the piezo scan value is 16 bit, 65535 = 100 V; step frequency limits [Hz]
+SCAN_MAX = 65535
+SCAN_VOLTAGE = 100.0
+STEP_FREQUENCY_MIN = 1
+STEP_FREQUENCY_MAX = 20000
+
+def volts_to_scan(volts, relative=False):
+    # piezo voltage(s) [V] to scan values; raises ValueError when out of range
+    values = np.round(np.asarray(volts, dtype=np.float64)*(SCAN_MAX/SCAN_VOLTAGE)).astype(np.int64)
+    lo = -SCAN_MAX if relative else 0
+    if values.size and (values.min() < lo or values.max() > SCAN_MAX):
+        raise ValueError("scan voltage must be within {} and {} V.".format(lo*SCAN_VOLTAGE/SCAN_MAX, SCAN_VOLTAGE))
+    return values
+
+# position compare trigger output: channel output trigger modes, polarities and compare
+# directions (values of the SA_CTL_CH_OUTPUT_TRIG_MODE_*, SA_CTL_ACTIVE_* and SA_CTL_*_DIRECTION
+# constants)
+TRIGGER_MODE_CONSTANT = 0
+TRIGGER_MODE_POSITION_COMPARE = 1
+TRIGGER_POLARITIES = {"low": 0, "high": 1}
+TRIGGER_DIRECTIONS = {"forward": 1, "backward": 2, "either": 3}
+
+# default move velocity [mm/s] and acceleration [mm/s2]
+DEFAULT_VELOCITY = 5
+DEFAULT_ACCELERATION = 10
+
+# CallStats of the controller calls while enable_stats() is on, else None
+stats = None
+
+# FindDevices results per options string, see find_devices()
+_found_devices = {}
+
+def find_devices(options="", refresh=False):
+    # Device discovery enumerates the network/USB and is slow, so its result
+    # is kept for the lifetime of the process unless refresh is True.
+    if refresh or options not in _found_devices:
+        _found_devices[options] = ctl.FindDevices(options)
+    return _found_devices[options]
+
+# adaptive back-off of the state polling fallback [s]
+POLL_MIN = 0.001
+POLL_MAX = 0.05
+# state read interval while waiting for a MOVEMENT_FINISHED event [s]
+EVENT_RECHECK = 1.0
+
+class EventListener():
+    """
+    Reads the controller event queue (ctl.WaitForEvent) from one thread and
+    counts MOVEMENT_FINISHED events per channel. Moves, calibration and
+    referencing all end with a MOVEMENT_FINISHED event, so a caller can
+    block on the event instead of polling CHANNEL_STATE.
+    """
+    def __init__(self, handle, timeout_ms=200):
+        self.handle = handle
+        self.timeout_ms = timeout_ms
+        self._cond = threading.Condition()
+        self._finished = {}
+        self._results = {}
+        self._callbacks = []
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="smaract-events", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self._running:
+            try:
+                event = ctl.WaitForEvent(self.handle, self.timeout_ms)
+            except ctl.Error as e:
+                if e.code == ctl.ErrorCode.TIMEOUT:
+                    continue
+                if not self._running:
+                    break
+                print("MCS2 WaitForEvent: {} (0x{:04X})".format(ctl.GetResultInfo(e.code), e.code))
+                time.sleep(0.1)
+                continue
+            if event.type == ctl.EventType.MOVEMENT_FINISHED:
+                with self._cond:
+                    self._finished[event.idx] = self._finished.get(event.idx, 0) + 1
+                    self._results[event.idx] = event.i32
+                    self._cond.notify_all()
+            for callback in list(self._callbacks):
+                # a failing callback must not end the listener, every wait depends on it
+                try:
+                    callback(event)
+                except Exception as ex:
+                    print("MCS2 event callback {} failed: {!r}".format(getattr(callback, "__qualname__", callback), ex))
+
+    def add_callback(self, callback):
+        # callback(event) is called from the listener thread for every event
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self._callbacks.remove(callback)
+
+    def count(self, channel):
+        # number of MOVEMENT_FINISHED events seen so far on a channel
+        with self._cond:
+            return self._finished.get(channel, 0)
+
+    def result(self, channel):
+        # result code of the last finished movement on a channel
+        with self._cond:
+            return self._results.get(channel, ctl.ErrorCode.NONE)
+
+    def wait(self, channel, count, timeout=None):
+        # Block until more than `count` MOVEMENT_FINISHED events have been
+        # seen on the channel. Returns False on timeout.
+        with self._cond:
+            return self._cond.wait_for(lambda: self._finished.get(channel, 0) > count, timeout)
+
+    def wait_all(self, counts, timeout=None):
+        # Same as wait() for several channels at once; counts is {channel: count}.
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: all(self._finished.get(ch, 0) > n for ch, n in counts.items()), timeout)
+
+    def close(self):
+        self._running = False
+        self._thread.join()
+
 class SmarAct():
-    
-    base_units = []
-    units = []
-    channel_names = []
-
-    def __init__(self, smaractstage = 'MCS2-00015447', channels = [0, 1, 2, 3]):
-        self.channels = channels
-        print("")
-        buffer = ctl.FindDevices()
-        print(buffer)
-        if len(buffer)==0:
-            print("no MCS2 device is found.")
-            return
-        buff = buffer.split("\n")
-        print("")
-        if not (smaractstage in buffer):
-            print(f"{smaractstage} is not found.")
-            return
-        print("")
-        for stage in buff:
-            if smaractstage in stage:
-                self.smaractstage = stage
+
+    def __init__(self, smaractstage = 'MCS2-00015447', channels = [0, 1, 2, 3], events=True, lazy=False, verbose=False):
+        # smaractstage is a serial number, looked up with (cached) device discovery,
+        # or a full locator such as "network:sn:MCS2-00015447", which is opened directly.
+        # With lazy=True the per-channel configuration is sent on first use of a channel.
+        self.channels = list(channels)
+        self.verbose = verbose
+        # per channel, in the order of self.channels
+        self.base_units = []
+        self.units = []
+        self.channel_names = []
+        self.events = None
+        self._pending = {}
+        self._sync_speeds = {}
+        self._many_targets = {}
+        # cached configuration properties: {(channel, property): value}
+        self._props = {}
+        self._configured = set()
+        self._stream = None
+        # measured piezo scan gain per channel [mm/V or deg/V]
+        self._scan_gains = {}
+        # position compare setup per channel, see set_trigger()
+        self._triggers = {}
+        # start time of the last move per channel, only while statistics are on
+        self._move_started = {}
+        if ":" in smaractstage:
+            self.smaractstage = smaractstage
+        else:
+            buffer = find_devices()
+            if verbose:
+                print(buffer)
+            if len(buffer)==0:
+                print("no MCS2 device is found.")
+                return
+            buff = buffer.split("\n")
+            if not (smaractstage in buffer):
+                print(f"{smaractstage} is not found.")
+                return
+            for stage in buff:
+                if smaractstage in stage:
+                    self.smaractstage = stage
         #try:
             # Open the first MCS2 device from the list
         try:
             smaract = ctl.Open(self.smaractstage)
-            print("MCS2 opened {}.".format(self.smaractstage))
+            if verbose:
+                print("MCS2 opened {}.".format(self.smaractstage))
             self.smaract = smaract
         except:
             print(f"Error in loading {self.smaractstage}")
             return
+        # base units of all channels in one pipelined read
+        base_units = self._read_many([(ch, ctl.Property.POS_BASE_UNIT, False) for ch in channels])
+        for ch, base_unit in zip(channels, base_units):
+            self._props[(ch, ctl.Property.POS_BASE_UNIT)] = base_unit
+        if not lazy:
+            for ch in channels:
+                self._ensure_configured(ch)
         trnum=0
         tinum=0
-        for ch in channels:
-            ctl.SetProperty_i32(self.smaract, ch, ctl.Property.MAX_CL_FREQUENCY, 6000)
-            ctl.SetProperty_i32(self.smaract, ch, ctl.Property.HOLD_TIME, 1000)
-            self.set_speed(ch)  # return the speed and acc to defaults (1mm/s, 10mm/s2)
-            un, base_unit = self.get_unit(ch)
+        k=0
+        # units from the batch read: get_unit() would configure a lazy channel
+        for ch, base_unit in zip(channels, base_units):
+            un = _unit_name(base_unit)
             self.base_units.append(base_unit)
             self.units.append(un)
             if un == 'mm':
@@ -63,6 +308,29 @@ class SmarAct():
             self.channel_names.append("%s%i"%(name0, n))
         self.version = ctl.GetFullVersionString()
         #print("SmarActCTL library version: '{}'.".format(version))
+        # Motion completion is signalled by controller events; without them
+        # (events=False or an SDK without WaitForEvent) the channel state is polled.
+        if events and hasattr(ctl, "WaitForEvent"):
+            self.events = EventListener(self.smaract)
+
+    def _ensure_configured(self, channel):
+        # Initial channel configuration, sent as call-and-forget writes: the
+        # controller does not reply, so the writes of all channels are
+        # pipelined. Errors are not reported, hence only known-good values.
+        if channel in self._configured:
+            return
+        self._configured.add(channel)
+        self.write_property_nowait(channel, ctl.Property.MAX_CL_FREQUENCY, 6000)
+        self.write_property_nowait(channel, ctl.Property.HOLD_TIME, 1000)
+        # return the speed and acc to defaults (5mm/s, 10mm/s2)
+        self.write_property_nowait(channel, ctl.Property.MOVE_VELOCITY, int(DEFAULT_VELOCITY*1E9))
+        self.write_property_nowait(channel, ctl.Property.MOVE_ACCELERATION, int(DEFAULT_ACCELERATION*1E9))
+
+    def close(self):
+        if self.events is not None:
+            self.events.close()
+            self.events = None
+        ctl.Close(self.smaract)
 
 
     def calibrate(self, channel):
@@ -70,16 +338,13 @@ class SmarAct():
         # Set calibration options (start direction: forward)
         ctl.SetProperty_i32(self.smaract, channel, ctl.Property.CALIBRATION_OPTIONS, 0)
         # Start calibration sequence
+        self._ensure_configured(channel)
+        self._start_motion(channel)
         ctl.Calibrate(self.smaract, channel)
         # Note that the function call returns immediately, without waiting for the movement to complete.
-        # The "ChannelState.CALIBRATING" flag in the channel state can be monitored to determine
-        # the end of the calibration sequence.
-        while True:
-            state = ctl.GetProperty_i32(self.smaract, channel, ctl.Property.CHANNEL_STATE)
-            if bool(state & ctl.ChannelState.CALIBRATING):
-                time.sleep(0.1)
-            else:
-                break
+        # The sequence ends with a MOVEMENT_FINISHED event; without events the
+        # "ChannelState.CALIBRATING" flag in the channel state is monitored.
+        self._wait_motion(channel, lambda ch: self._state_is(ch, ctl.ChannelState.CALIBRATING))
     # FIND REFERENCE
     # Since the position sensors work on an incremental base, the referencing sequence is used to
     # establish an absolute positioner reference for the positioner after system startup.
@@ -94,51 +359,244 @@ class SmarAct():
         # Note: In contrast to previous controller systems this is not mandatory.
         # The MCS2 controller is able to find the reference position "on-the-fly".
         # See the MCS2 Programmer Guide for a description of the different modes.
+        self._ensure_configured(channel)
         ctl.SetProperty_i32(self.smaract, channel, ctl.Property.REFERENCING_OPTIONS, 0)
         # Set velocity to 1mm/s
-        ctl.SetProperty_i64(self.smaract, channel, ctl.Property.MOVE_VELOCITY, 1000000000)
+        self.set_property(channel, ctl.Property.MOVE_VELOCITY, 1000000000)
         # Set acceleration to 10mm/s2.
-        ctl.SetProperty_i64(self.smaract, channel, ctl.Property.MOVE_ACCELERATION, 10000000000)
+        self.set_property(channel, ctl.Property.MOVE_ACCELERATION, 10000000000)
         # Start referencing sequence
+        self._start_motion(channel)
         ctl.Reference(self.smaract, channel)
         # Note that the function call returns immediately, without waiting for the movement to complete.
-        # The "ChannelState.REFERENCING" flag in the channel state can be monitored to determine
-        # the end of the referencing sequence.
-        while True:
-            state = ctl.GetProperty_i32(self.smaract, channel, ctl.Property.CHANNEL_STATE)
-            if bool(state & ctl.ChannelState.REFERENCING):
-                time.sleep(0.1)
+        # The sequence ends with a MOVEMENT_FINISHED event; without events the
+        # "ChannelState.REFERENCING" flag in the channel state is monitored.
+        self._wait_motion(channel, lambda ch: self._state_is(ch, ctl.ChannelState.REFERENCING))
+    # PARALLEL CALIBRATION AND REFERENCING
+    # The sequences of several channels run at the same time, so bringing up a controller takes
+    # as long as the slowest channel instead of the sum of all. groups orders mechanically
+    # coupled axes: the groups run one after another, the channels of a group in parallel, and
+    # a group only starts if the previous one succeeded.
+    def calibrate_all(self, axes=None, groups=None, skip_done=True, timeout=None):
+        # Calibrate axes (default: all channels), or the channels of groups
+        # ([[axes], ...]) group by group. With skip_done, channels that are already
+        # calibrated are left alone. timeout is per group. Returns a record array
+        # of sequence_result_dtype per channel: skipped, done (finished in time),
+        # ok (IS_CALIBRATED is set) and the final channel state.
+        return self._run_sequence("calibrate", axes, groups, skip_done, None, timeout)
+
+    def reference_all(self, axes=None, groups=None, skip_done=True, speed=(1, 10), timeout=None):
+        # Same as calibrate_all() for the find reference sequence; ok means
+        # IS_REFERENCED is set. speed is the (vel, acc) of the sequence; the
+        # configured speeds are restored afterwards.
+        return self._run_sequence("reference", axes, groups, skip_done, speed, timeout)
+
+    def _run_sequence(self, kind, axes, groups, skip_done, speed, timeout):
+        groups = self._sequence_groups(axes, groups)
+        skipped = self._sequence_skipped(kind, groups) if skip_done else set()
+        done = {}
+        for group in groups:
+            group = [ch for ch in group if ch not in skipped]
+            if not group:
+                continue
+            saved = self._start_sequence(kind, group, speed)
+            finished = {}
+            try:
+                finished = self._wait_sequence(kind, group, timeout)
+            finally:
+                # sequences that did not finish are stopped before their speeds are restored
+                self._stop_sequence(kind, [ch for ch in group if not finished.get(ch)])
+                self._restore_speeds(saved)
+            done.update(finished)
+            if not all(done[ch] for ch in group) or not self._sequence_ok(kind, group):
+                print("MCS2 {} failed on channels {}, remaining groups are not started.".format(kind, group))
+                break
+        return self._sequence_result(kind, groups, skipped, done)
+
+    def _sequence_groups(self, axes, groups):
+        if groups is None:
+            groups = [self.channels if axes is None else axes]
+        return [[self._channel_index(ax) for ax in group] for group in groups]
+
+    def _sequence_flags(self, kind):
+        # (state bit while running, state bit when done)
+        if kind == "calibrate":
+            return ctl.ChannelState.CALIBRATING, ctl.ChannelState.IS_CALIBRATED
+        return ctl.ChannelState.REFERENCING, ctl.ChannelState.IS_REFERENCED
+
+    def _sequence_skipped(self, kind, groups):
+        # channels whose sequence is already done, from one batched state read
+        chans = [ch for group in groups for ch in group]
+        _, done_bit = self._sequence_flags(kind)
+        return {ch for ch, state in zip(chans, self.get_states(chans)) if state & done_bit}
+
+    def _sequence_ok(self, kind, chans):
+        _, done_bit = self._sequence_flags(kind)
+        return bool((self.get_states(chans) & done_bit).all())
+
+    def _start_sequence(self, kind, chans, speed=None):
+        # Start the sequence on all chans back to back; returns the speeds to restore.
+        saved = {}
+        for ch in chans:
+            self._ensure_configured(ch)
+            if kind == "calibrate":
+                ctl.SetProperty_i32(self.smaract, ch, ctl.Property.CALIBRATION_OPTIONS, 0)
             else:
+                ctl.SetProperty_i32(self.smaract, ch, ctl.Property.REFERENCING_OPTIONS, 0)
+                if speed is not None:
+                    saved[ch] = self.get_speed(ch)
+                    self.set_speed(ch, *speed)
+        print("MCS2 start {} on channels: {}.".format(kind, chans))
+        for ch in chans:
+            self._start_motion(ch)
+            if kind == "calibrate":
+                ctl.Calibrate(self.smaract, ch)
+            else:
+                ctl.Reference(self.smaract, ch)
+        return saved
+
+    def _stop_sequence(self, kind, chans):
+        for ch in chans:
+            print("MCS2 {} of channel {} did not finish, stopping it.".format(kind, ch))
+            ctl.Stop(self.smaract, ch)
+
+    def _restore_speeds(self, saved):
+        for ch, (vel, acc) in saved.items():
+            self.set_speed(ch, vel, acc)
+
+    def _wait_sequence(self, kind, chans, timeout=None):
+        # One wait for the sequences of chans; returns {channel: finished in time}.
+        running_bit, _ = self._sequence_flags(kind)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        counts = {ch: self._pending.pop(ch) for ch in chans if ch in self._pending}
+        if self.events is not None and counts:
+            self._wait_events(counts, deadline, lambda: bool((self.get_states(chans) & running_bit).any()))
+        delay = POLL_MIN
+        while True:
+            busy = (self.get_states(chans) & running_bit) != 0
+            if not busy.any() or (deadline is not None and time.monotonic() >= deadline):
                 break
-    def mv(self, ax, target, wait=True):
+            time.sleep(delay)
+            delay = min(delay*1.5, POLL_MAX)
+        return {ch: not b for ch, b in zip(chans, busy)}
+
+    def _sequence_result(self, kind, groups, skipped, done):
+        _, done_bit = self._sequence_flags(kind)
+        chans = [ch for group in groups for ch in group]
+        states = self.get_states(chans)
+        result = np.empty(len(chans), dtype=sequence_result_dtype)
+        result['channel'] = chans
+        result['skipped'] = [ch in skipped for ch in chans]
+        result['done'] = [ch in skipped or done.get(ch, False) for ch in chans]
+        result['ok'] = (states & done_bit) != 0
+        result['state'] = states
+        return result.view(np.recarray)
+
+    # PROPERTY CACHE
+    # Configuration properties in CACHED_PROPERTIES only change when written, so they are kept
+    # per channel: reads are served from the cache, writes go through it and writes of an
+    # unchanged value are skipped. Call invalidate() or refresh() when another client may
+    # have changed the settings.
+    def get_property(self, channel, pkey):
+        channel = self._channel_index(channel)
+        if channel in self.channels:
+            # with lazy=True the first read applies the initial configuration, so it
+            # does not return a value that the first move would overwrite
+            self._ensure_configured(channel)
+        key = (channel, pkey)
+        if key in self._props:
+            return self._props[key]
+        i64 = _is_i64(pkey)
+        if i64:
+            value = ctl.GetProperty_i64(self.smaract, channel, pkey)
+        else:
+            value = ctl.GetProperty_i32(self.smaract, channel, pkey)
+        if _is_cached(pkey):
+            self._props[key] = value
+        return value
+
+    def set_property(self, channel, pkey, value):
+        channel = self._channel_index(channel)
+        key = (channel, pkey)
+        value = int(value)
+        if self._props.get(key) == value:
+            return
+        self._props.pop(key, None)
+        if _is_i64(pkey):
+            ctl.SetProperty_i64(self.smaract, channel, pkey, value)
+        else:
+            ctl.SetProperty_i32(self.smaract, channel, pkey, value)
+        if _is_cached(pkey):
+            self._props[key] = value
+
+    def write_property_nowait(self, channel, pkey, value):
+        # call-and-forget write through the cache; no result is requested
+        channel = self._channel_index(channel)
+        key = (channel, pkey)
+        value = int(value)
+        if self._props.get(key) == value:
+            return
+        if _is_i64(pkey):
+            ctl.RequestWriteProperty_i64(self.smaract, channel, pkey, value, pass_rID=False)
+        else:
+            ctl.RequestWriteProperty_i32(self.smaract, channel, pkey, value, pass_rID=False)
+        if _is_cached(pkey):
+            self._props[key] = value
+
+    def invalidate(self, channel=None):
+        # drop cached properties of one channel, or of all channels
+        if channel is None:
+            self._props.clear()
+            return
+        channel = self._channel_index(channel)
+        for key in [key for key in self._props if key[0] == channel]:
+            del self._props[key]
+
+    def refresh(self, channels=None):
+        # re-read all cached properties from the controller in one pipelined pass
+        if channels is None:
+            channels = self.channels
+        chans = [self._channel_index(ch) for ch in channels]
+        keys = [(ch, getattr(ctl.Property, name)) for ch in chans for name in CACHED_PROPERTIES]
+        values = self._read_many([(ch, pkey, _is_i64(pkey)) for ch, pkey in keys])
+        for ch in chans:
+            self.invalidate(ch)
+        self._props.update(zip(keys, values))
+
+    def mv(self, ax, target, wait=True, capture=None):
         if type(ax) == str:
             ax = self.channels[self.channel_names.index(ax)]
         #ax = channels[chname]
-        self.move(ax, target=target, absolute=True, wait=wait)
+        self.move(ax, target=target, absolute=True, wait=wait, capture=capture)
         
-    def mvr(self, ax, target, wait=True):
+    def mvr(self, ax, target, wait=True, capture=None):
         if type(ax) == str:
             ax = self.channels[self.channel_names.index(ax)]
         #ax = channels[chname]
-        self.move(ax, target=target, absolute=False, wait=wait)
+        self.move(ax, target=target, absolute=False, wait=wait, capture=capture)
 
-    def set_speed(self, channel, vel=5, acc=10):
+    def set_speed(self, channel, vel=None, acc=None):
         if type(channel) == str:
             channel = self.channels[self.channel_names.index(channel)]
+        self._ensure_configured(channel)
+        if vel is None:
+            vel = DEFAULT_VELOCITY
+        if acc is None:
+            acc = DEFAULT_ACCELERATION
 
         # input vel and acc should be in mm/s and mm/s^2
         vel = int(vel*1E9)
         acc = int(acc*1E9)
         # velocity 1000000000 equals 1mm/s
         # acceler  10000000000 equals 10mm/s2.
-        ctl.SetProperty_i64(self.smaract, channel, ctl.Property.MOVE_VELOCITY, vel)
-        ctl.SetProperty_i64(self.smaract, channel, ctl.Property.MOVE_ACCELERATION, acc)
+        self.set_property(channel, ctl.Property.MOVE_VELOCITY, vel)
+        self.set_property(channel, ctl.Property.MOVE_ACCELERATION, acc)
 
     def get_speed(self, channel):
         if type(channel) == str:
             channel = self.channels[self.channel_names.index(channel)]
-        vel = ctl.GetProperty_i64(self.smaract, channel, ctl.Property.MOVE_VELOCITY)
-        acc = ctl.GetProperty_i64(self.smaract, channel, ctl.Property.MOVE_ACCELERATION)
+        vel = self.get_property(channel, ctl.Property.MOVE_VELOCITY)
+        acc = self.get_property(channel, ctl.Property.MOVE_ACCELERATION)
         return (vel/1E9, acc/1E9)
 
     # MOVE
@@ -146,8 +604,10 @@ class SmarAct():
     # The given "move_value" parameter is interpreted according to the previously configured move mode.
     # It can be a position value (in case of closed loop movement mode), a scan value (in case of scan move mode)
     # or a number of steps (in case of step move mode).
-    def move(self, channel, target=0.001, absolute=True, wait=True):
+    def move(self, channel, target=0.001, absolute=True, wait=True, capture=None):
         # input target is in mm or deg.
+        # capture is an optional PositionCapture that records the move; it is
+        # started before the move command and stopped after the move when wait is True.
         target = int(target*1E9)
         # Set move mode depending properties for the next movement.
         if absolute:
@@ -171,17 +631,531 @@ class SmarAct():
     #        print("MCS2 move channel {} relative: {} pm.".format(channel, target))
 
         # Start actual movement.
-        ctl.SetProperty_i32(self.smaract, channel, ctl.Property.MOVE_MODE, move_mode)
+        self._ensure_configured(channel)
+        self.set_property(channel, ctl.Property.MOVE_MODE, move_mode)
+        self._start_motion(channel)
+        if capture is not None:
+            capture.start()
         ctl.Move(self.smaract, channel, target, 0)
         # Note that the function call returns immediately, without waiting for the movement to complete.
         if wait:
-            while self.ismoving(channel):
-                time.sleep(0.01)
-        # The "ChannelState.ACTIVELY_MOVING" (and "ChannelState.CLOSED_LOOP_ACTIVE") flag in the channel state
-        # can be monitored to determine the end of the movement.
-    def waitdone(self, channel):
-        while self.ismoving(channel):
-            time.sleep(0.01)
+            self.waitdone(channel)
+            if capture is not None:
+                capture.stop()
+        # The end of the movement is signalled by a MOVEMENT_FINISHED event. Without events the
+        # "ChannelState.ACTIVELY_MOVING" (and "ChannelState.CLOSED_LOOP_ACTIVE") flag in the channel state
+        # is monitored.
+    def waitdone(self, channel, timeout=None):
+        # Wait for the end of the last move on the channel. Returns False on timeout.
+        channel = self._channel_index(channel)
+        return self._wait_motion(channel, self.ismoving, timeout)
+
+    def _start_motion(self, channel):
+        # Remember how many movements had finished before a new command, so
+        # that _wait_motion can wait for the event of this one.
+        if self.events is not None:
+            self._pending[channel] = self.events.count(channel)
+        if stats is not None:
+            self._move_started[channel] = time.perf_counter()
+
+    def _record_move(self, channel, polls):
+        # move-to-completion latency for the statistics
+        started = self._move_started.pop(channel, None)
+        if stats is not None and started is not None:
+            stats.record_move(self.smaract, channel, time.perf_counter() - started, polls)
+
+    def _state_is(self, channel, mask):
+        r_id = ctl.RequestReadProperty(self.smaract, channel, ctl.Property.CHANNEL_STATE, 0)
+        return bool(ctl.ReadProperty_i32(self.smaract, r_id) & mask)
+
+    def _wait_motion(self, channel, busy, timeout=None):
+        # Block until busy(channel) is False. With events, sleep until the
+        # MOVEMENT_FINISHED event of the pending command and confirm with a
+        # single state read; otherwise poll with adaptive back-off.
+        if stats is None:
+            return self._wait_for(channel, busy, timeout)
+        polls = [0]
+        def counted(ch):
+            polls[0] += 1
+            return busy(ch)
+        done = self._wait_for(channel, counted, timeout)
+        if done:
+            self._record_move(channel, polls[0])
+        return done
+
+    def _wait_for(self, channel, busy, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        count = self._pending.pop(channel, None)
+        if self.events is not None and count is not None:
+            while True:
+                # re-check the state now and then in case an event got lost
+                remaining = EVENT_RECHECK if deadline is None else min(max(deadline - time.monotonic(), 0), EVENT_RECHECK)
+                if self.events.wait(channel, count, remaining):
+                    count = self.events.count(channel)
+                elif deadline is not None and time.monotonic() >= deadline:
+                    return not busy(channel)
+                if not busy(channel):
+                    return True
+        delay = POLL_MIN
+        while busy(channel):
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(delay)
+            delay = min(delay*1.5, POLL_MAX)
+        return True
+
+    def _wait_events(self, counts, deadline, busy):
+        # Sleep until the MOVEMENT_FINISHED events of all channels in counts
+        # ({channel: count}) arrived or the deadline passed. busy() is checked
+        # every EVENT_RECHECK seconds, so a lost event does not block forever.
+        while True:
+            remaining = EVENT_RECHECK if deadline is None else min(max(deadline - time.monotonic(), 0), EVENT_RECHECK)
+            if self.events.wait_all(counts, remaining):
+                return
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            if not busy():
+                return
+
+    # OPEN LOOP MOVES
+    # In scan mode the move value sets the piezo voltage directly (fine, fast and without the
+    # closed loop settling), in step mode it is a number of stick-slip steps (coarse). The
+    # positions are still measured by the sensor. mv_fine() combines both: a closed loop
+    # approach followed by scan mode corrections.
+    def scan_move(self, ax, volts, absolute=True, velocity=None, wait=True):
+        # Move the piezo to the scan voltage `volts` (0 - 100 V), or by `volts`
+        # with absolute=False. velocity is the scan speed in V/s (None: keep the
+        # current setting, 0: as fast as possible).
+        channel = self._channel_index(ax)
+        value = int(volts_to_scan(volts, relative=not absolute))
+        mode = ctl.MoveMode.SCAN_ABSOLUTE if absolute else ctl.MoveMode.SCAN_RELATIVE
+        self._set_scan_mode(channel, mode, velocity)
+        self._start_motion(channel)
+        ctl.Move(self.smaract, channel, value, 0)
+        if wait:
+            return self.waitdone(channel)
+
+    def step_move(self, ax, steps, frequency=None, amplitude=None, wait=True):
+        # Open loop stepping: `steps` steps, the sign gives the direction.
+        # frequency in Hz (1 - 20000) and amplitude in V (0 - 100); None keeps
+        # the current setting.
+        channel = self._channel_index(ax)
+        self._ensure_configured(channel)
+        if frequency is not None:
+            if not STEP_FREQUENCY_MIN <= frequency <= STEP_FREQUENCY_MAX:
+                raise ValueError("step frequency must be within {} and {} Hz.".format(STEP_FREQUENCY_MIN, STEP_FREQUENCY_MAX))
+            self.set_property(channel, ctl.Property.STEP_FREQUENCY, int(frequency))
+        if amplitude is not None:
+            self.set_property(channel, ctl.Property.STEP_AMPLITUDE, int(volts_to_scan(amplitude)))
+        self.set_property(channel, ctl.Property.MOVE_MODE, ctl.MoveMode.STEP)
+        self._start_motion(channel)
+        ctl.Move(self.smaract, channel, int(steps), 0)
+        if wait:
+            return self.waitdone(channel)
+
+    def scan_values(self, ax, volts, rate=None, velocity=None, wait=True):
+        # Feed an array of scan voltages to the piezo, e.g. for dithering. The
+        # array is converted and range checked at once and the move mode is set
+        # once; the values are then sent back to back, or paced at `rate` Hz.
+        # Returns the time.monotonic() of each command.
+        channel = self._channel_index(ax)
+        values = volts_to_scan(volts).ravel()
+        self._set_scan_mode(channel, ctl.MoveMode.SCAN_ABSOLUTE, velocity)
+        times = np.empty(len(values))
+        handle = self.smaract
+        t0 = time.monotonic()
+        for i, value in enumerate(values.tolist()):
+            if rate:
+                delay = t0 + i/rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            if i == len(values) - 1:
+                self._start_motion(channel)
+            times[i] = time.monotonic()
+            ctl.Move(handle, channel, value, 0)
+        if wait and len(values):
+            self.waitdone(channel)
+        return times
+
+    def _set_scan_mode(self, channel, mode, velocity=None):
+        self._ensure_configured(channel)
+        if velocity is not None:
+            if velocity < 0:
+                raise ValueError("scan velocity must not be negative.")
+            self.set_property(channel, ctl.Property.SCAN_VELOCITY, int(round(velocity*SCAN_MAX/SCAN_VOLTAGE)))
+        self.set_property(channel, ctl.Property.MOVE_MODE, mode)
+
+    def scan_gain(self, ax, volts=5.0, refresh=False):
+        # Displacement per scan volt [mm/V or deg/V], measured once per channel
+        # with a scan of +volts and back around the current piezo voltage.
+        channel = self._channel_index(ax)
+        if not refresh and channel in self._scan_gains:
+            return self._scan_gains[channel]
+        p0 = self.get_pos(channel)
+        self.scan_move(channel, volts, absolute=False)
+        p1 = self.get_pos(channel)
+        self.scan_move(channel, -volts, absolute=False)
+        p2 = self.get_pos(channel)
+        gain = ((p1 - p0) + (p1 - p2))/(2*volts)
+        if gain == 0:
+            raise RuntimeError("channel {} did not move in scan mode.".format(channel))
+        self._scan_gains[channel] = gain
+        return gain
+
+    def mv_fine(self, ax, target, tolerance=1E-5, max_iter=5):
+        # Closed loop approach to target (mm or deg), then open loop scan moves
+        # until the position is within tolerance. Returns the final position.
+        channel = self._channel_index(ax)
+        self.move(channel, target, absolute=True)
+        gain = self.scan_gain(channel)
+        position = self.get_pos(channel)
+        for _ in range(max_iter):
+            error = target - position
+            if abs(error) <= tolerance:
+                break
+            self.scan_move(channel, error/gain, absolute=False)
+            position = self.get_pos(channel)
+        return position
+
+    # SIMULTANEOUS MOVES
+    # All move commands are sent back to back, so the axes travel at the same time and a
+    # reposition takes as long as the longest move instead of the sum of all moves.
+    def mv_many(self, targets, absolute=True, wait=True, synchronize=False, timeout=None):
+        # targets is {axis: target} with axis a channel number or name and
+        # target in mm or deg. With synchronize=True the velocity of the
+        # shorter moves is reduced so that all axes arrive together; the
+        # configured speeds are restored by waitdone_many().
+        # Returns the waitdone_many() result when wait is True.
+        moves = [(self._channel_index(ax), float(target)) for ax, target in targets.items()]
+        chans = [ch for ch, _ in moves]
+        if absolute:
+            start = self.get_positions(chans)
+            goals = [target for _, target in moves]
+        else:
+            start = np.zeros(len(moves))
+            goals = list(self.get_positions(chans) + [target for _, target in moves])
+        if synchronize:
+            speeds = [self.get_speed(ch) for ch in chans]
+            distances = [abs(target - p0) if absolute else abs(target) for (_, target), p0 in zip(moves, start)]
+            duration = max(move_time(d, v, a) for d, (v, a) in zip(distances, speeds))
+            for ch, d, (v, a) in zip(chans, distances, speeds):
+                if v <= 0 or d == 0:
+                    continue
+                vel = velocity_for_time(d, duration, a)
+                if 0 < vel < v:
+                    self._sync_speeds[ch] = (v, a)
+                    self.set_speed(ch, vel, a)
+        move_mode = ctl.MoveMode.CL_ABSOLUTE if absolute else ctl.MoveMode.CL_RELATIVE
+        for ch in chans:
+            self._ensure_configured(ch)
+            self.set_property(ch, ctl.Property.MOVE_MODE, move_mode)
+        for ch, target in moves:
+            self._start_motion(ch)
+            ctl.Move(self.smaract, ch, int(target*1E9), 0)
+        self._many_targets.update(zip(chans, goals))
+        if wait:
+            return self.waitdone_many(chans, timeout=timeout)
+
+    def waitdone_many(self, axes, timeout=None):
+        # Wait for the moves of several axes with one completion mechanism
+        # and return a numpy record array with the fields channel, target,
+        # position, done and end_stop per axis.
+        chans = [self._channel_index(ax) for ax in axes]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        counts = {ch: self._pending.pop(ch) for ch in chans if ch in self._pending}
+        moving = ctl.ChannelState.ACTIVELY_MOVING
+        if self.events is not None and counts:
+            self._wait_events(counts, deadline, lambda: bool((self.get_states(chans) & moving).any()))
+        delay = POLL_MIN
+        polls = 0
+        while True:
+            polls += 1
+            status = self.read_status(chans)
+            busy = (status.state & moving) != 0
+            if not busy.any() or (deadline is not None and time.monotonic() >= deadline):
+                break
+            time.sleep(delay)
+            delay = min(delay*1.5, POLL_MAX)
+        result = self._move_result(chans, status)
+        for ch in result.channel[result.done]:
+            self._record_move(ch, polls)
+            if ch in self._sync_speeds:
+                self.set_speed(ch, *self._sync_speeds.pop(ch))
+        return result
+
+    def _move_result(self, chans, status):
+        # waitdone_many() result from the final status read; the targets of
+        # finished moves are forgotten
+        busy = (status.state & ctl.ChannelState.ACTIVELY_MOVING) != 0
+        result = np.empty(len(chans), dtype=move_result_dtype)
+        result['channel'] = chans
+        result['target'] = [self._many_targets.get(ch, np.nan) for ch in chans]
+        result['position'] = status.position
+        result['done'] = ~busy
+        result['end_stop'] = (status.state & ctl.ChannelState.END_STOP_REACHED) != 0
+        for ch in result['channel'][result['done']]:
+            self._many_targets.pop(ch, None)
+        return result.view(np.recarray)
+
+    # STEP SCAN
+    # The move mode (and speed) is set once for the whole scan, and each point costs the move
+    # commands plus one pipelined status read, which both confirms the end of the move and
+    # gives the measured positions. The next point is commanded before the current one is
+    # handed to the caller, so the motion overlaps with whatever the caller does with it.
+    def scan(self, targets, dwell=0.0, trigger=None, speed=None, prefetch=True, timeout=None):
+        # targets is {axis: array of positions in mm or deg}, all arrays of the same
+        # length. At each point the axes are moved, then trigger(point) is called if
+        # given and the scan waits `dwell` seconds before it moves on.
+        # speed is an optional (vel, acc) used for the scan; the configured speeds are
+        # restored at the end. Yields a ScanPoint per point: commanded and measured
+        # positions, timestamp (time.monotonic() of the readback), settle time (from
+        # the move command to the detected end of the move) and done (False if the
+        # axes did not stop within `timeout`).
+        # With prefetch=False the next point is only commanded after the current one
+        # was consumed, e.g. when the consumer has to act before the axes move on.
+        chans = [self._channel_index(ax) for ax in targets]
+        try:
+            points = np.column_stack([np.asarray(targets[ax], dtype=np.float64) for ax in targets])
+        except ValueError:
+            raise ValueError("all scan arrays must have the same length.")
+        saved = {}
+        for ch in chans:
+            self._ensure_configured(ch)
+            if speed is not None:
+                saved[ch] = self.get_speed(ch)
+                self.set_speed(ch, *speed)
+            self.set_property(ch, ctl.Property.MOVE_MODE, ctl.MoveMode.CL_ABSOLUTE)
+        issued = None
+        try:
+            if len(points):
+                issued = self._scan_command(chans, points[0])
+            for i in range(len(points)):
+                status = self.waitdone_many(chans, timeout=timeout)
+                now = time.monotonic()
+                point = ScanPoint(i, points[i], status.position.copy(), now, time.perf_counter() - issued,
+                                  bool(status.done.all()))
+                issued = None
+                if trigger is not None:
+                    trigger(point)
+                if dwell > 0:
+                    time.sleep(dwell)
+                if prefetch and i + 1 < len(points):
+                    issued = self._scan_command(chans, points[i + 1])
+                yield point
+                if not prefetch and i + 1 < len(points):
+                    issued = self._scan_command(chans, points[i + 1])
+        finally:
+            if issued is not None:
+                # the scan was abandoned with a move in flight
+                for ch in chans:
+                    ctl.Stop(self.smaract, ch)
+                self.waitdone_many(chans, timeout=timeout)
+            for ch, (vel, acc) in saved.items():
+                self.set_speed(ch, vel, acc)
+
+    # GRID SCAN
+    # A 2D step scan of a fast and a slow axis. With serpentine ordering every other row is
+    # scanned backwards, so a new row only needs the slow step. The row change is commanded
+    # as one simultaneous move, and with a `tolerance` it is issued as soon as the fast axis
+    # is within tolerance of the last point of the row, i.e. during its final deceleration.
+    def grid_scan(self, fast, slow, fast_range, slow_range, step, dwell=0.0, serpentine=True,
+                  tolerance=None, trigger=None, speed=None, out=None, timeout=None):
+        # fast_range and slow_range are (start, stop), both included; step is the
+        # step of both axes or (fast step, slow step), in mm or deg.
+        # The measured positions and timestamp of each point are stored in out[j, i]
+        # (slow index j, fast index i) as the scan goes, so another thread can watch
+        # the array fill; points not yet scanned are NaN. out is allocated if not
+        # given (dtype grid_point_dtype) and returned. trigger(j, i) is called at
+        # every point before the dwell. speed is an optional (vel, acc) for the scan.
+        # With a tolerance the last point of a row is taken when the fast axis is within
+        # tolerance of it and the row change starts right then, so it needs dwell=0.
+        if tolerance is not None and dwell > 0:
+            raise ValueError("grid_scan with a tolerance needs dwell=0.")
+        chans = [self._channel_index(fast), self._channel_index(slow)]
+        fstep, sstep = (step, step) if np.ndim(step) == 0 else step
+        xs = grid_positions(fast_range[0], fast_range[1], fstep)
+        ys = grid_positions(slow_range[0], slow_range[1], sstep)
+        if out is None:
+            out = np.empty((len(ys), len(xs)), dtype=grid_point_dtype)
+            for name in grid_point_dtype.names:
+                out[name] = np.nan
+        elif out.shape != (len(ys), len(xs)) or out.dtype != grid_point_dtype:
+            raise ValueError("out must be a {} array of grid_point_dtype.".format((len(ys), len(xs))))
+        saved = {}
+        for ch in chans:
+            self._ensure_configured(ch)
+            if speed is not None:
+                saved[ch] = self.get_speed(ch)
+                self.set_speed(ch, *speed)
+            self.set_property(ch, ctl.Property.MOVE_MODE, ctl.MoveMode.CL_ABSOLUTE)
+        def next_row(j):
+            if serpentine:
+                self._scan_command(chans[1:], (ys[j],))
+            else:
+                self._scan_command(chans, (xs[0], ys[j]))
+        try:
+            self._scan_command(chans, (xs[0], ys[0]))
+            for j in range(len(ys)):
+                cols = range(len(xs) - 1, -1, -1) if serpentine and j % 2 else range(len(xs))
+                for k, i in enumerate(cols):
+                    if k > 0:
+                        self._scan_command(chans[:1], (xs[i],))
+                    if tolerance is not None and k == len(cols) - 1 and j + 1 < len(ys):
+                        position = self._approach(chans, xs[i], tolerance, timeout)
+                        # the row change overlaps the final deceleration of the fast axis
+                        next_row(j + 1)
+                    else:
+                        position = self.waitdone_many(chans, timeout=timeout).position
+                    out[j, i] = (position[0], position[1], time.monotonic())
+                    if trigger is not None:
+                        trigger(j, i)
+                    if dwell > 0:
+                        time.sleep(dwell)
+                if tolerance is None and j + 1 < len(ys):
+                    next_row(j + 1)
+            self.waitdone_many(chans, timeout=timeout)
+        finally:
+            for ch, (vel, acc) in saved.items():
+                self.set_speed(ch, vel, acc)
+        return out
+
+    def _approach(self, chans, target, tolerance, timeout=None):
+        # wait until chans[0] is within tolerance of target (or stopped) and
+        # return the positions of chans
+        deadline = None if timeout is None else time.monotonic() + timeout
+        moving = ctl.ChannelState.ACTIVELY_MOVING
+        while True:
+            status = self.read_status(chans)
+            if abs(status.position[0] - target) <= tolerance or not status.state[0] & moving:
+                return status.position
+            if deadline is not None and time.monotonic() >= deadline:
+                return status.position
+            time.sleep(POLL_MIN)
+
+    def _scan_command(self, chans, row):
+        # issue the moves of one scan point; returns the command time
+        t = time.perf_counter()
+        for ch, target in zip(chans, row):
+            self._start_motion(ch)
+            ctl.Move(self.smaract, ch, int(target*1E9), 0)
+        self._many_targets.update(zip(chans, row))
+        return t
+
+    # POSITION COMPARE TRIGGER
+    # The controller puts out a pulse on the channel's trigger output each time the position
+    # crosses the next threshold (start, start + increment, ...), so detectors are triggered
+    # at the stage speed with a timing that does not depend on the host. The compare limits
+    # restrict the pulses to the `count` thresholds of the setup. The controller moves the
+    # start threshold on by one increment with every pulse; trigger_count() reads it back.
+    def set_trigger(self, ax, start, increment, count=None, direction="forward", pulse_width=1E-6,
+                    polarity="high", arm=False):
+        # start and increment in mm or deg (increment > 0, the direction gives the sign);
+        # count limits the number of pulses (None: no limit); direction is "forward",
+        # "backward" or "either"; pulse_width in seconds.
+        channel = self._channel_index(ax)
+        if increment <= 0:
+            raise ValueError("the trigger increment must be positive.")
+        if count is not None and count < 1:
+            raise ValueError("the trigger count must be at least 1.")
+        if direction not in TRIGGER_DIRECTIONS:
+            raise ValueError("trigger direction must be one of {}.".format(", ".join(TRIGGER_DIRECTIONS)))
+        if polarity not in TRIGGER_POLARITIES:
+            raise ValueError("trigger polarity must be 'high' or 'low'.")
+        if pulse_width <= 0:
+            raise ValueError("the trigger pulse width must be positive.")
+        self.disarm_trigger(channel)
+        if count is None:
+            limits = (0, 0)
+        else:
+            # half an increment of margin, so the last threshold is still inside
+            span = (count - 1)*increment
+            lo, hi = (start - span, start) if direction == "backward" else (start, start + span)
+            limits = (int((lo - increment/2)*1E9), int((hi + increment/2)*1E9))
+        P = ctl.Property
+        self.set_property(channel, P.CH_OUTPUT_TRIG_POLARITY, TRIGGER_POLARITIES[polarity])
+        self.set_property(channel, P.CH_OUTPUT_TRIG_PULSE_WIDTH, int(round(pulse_width*1E9)))
+        self.set_property(channel, P.CH_POS_COMP_INCREMENT, int(round(increment*1E9)))
+        self.set_property(channel, P.CH_POS_COMP_DIRECTION, TRIGGER_DIRECTIONS[direction])
+        self.set_property(channel, P.CH_POS_COMP_LIMIT_MIN, limits[0])
+        self.set_property(channel, P.CH_POS_COMP_LIMIT_MAX, limits[1])
+        self._triggers[channel] = {"start": start, "increment": increment, "count": count,
+                                   "direction": direction, "pulse_width": pulse_width, "polarity": polarity}
+        if arm:
+            self.arm_trigger(channel)
+
+    def arm_trigger(self, ax):
+        # (Re)start the pulses of the channel's set_trigger() setup: the start threshold
+        # is rewritten, so the count starts at 0. Arm before the axis reaches start.
+        channel = self._channel_index(ax)
+        setup = self._triggers.get(channel)
+        if setup is None:
+            raise RuntimeError("channel {} has no trigger setup, call set_trigger() first.".format(channel))
+        self.set_property(channel, ctl.Property.CH_POS_COMP_START_THRESHOLD, int(round(setup["start"]*1E9)))
+        self.set_property(channel, ctl.Property.CH_OUTPUT_TRIG_MODE, TRIGGER_MODE_POSITION_COMPARE)
+        setup["armed"] = True
+
+    def disarm_trigger(self, ax):
+        # Switch the trigger output back to constant level. Returns the number of
+        # pulses put out since arm_trigger() (see trigger_count()).
+        channel = self._channel_index(ax)
+        setup = self._triggers.get(channel)
+        count = self.trigger_count(channel) if setup is not None and setup.get("armed") else None
+        self.set_property(channel, ctl.Property.CH_OUTPUT_TRIG_MODE, TRIGGER_MODE_CONSTANT)
+        if setup is not None:
+            setup["armed"] = False
+        return count
+
+    def trigger_count(self, ax):
+        # Number of pulses since the last arm_trigger(), from the start threshold the
+        # controller advanced. None without a setup or for direction "either", where
+        # the threshold does not advance.
+        channel = self._channel_index(ax)
+        setup = self._triggers.get(channel)
+        if setup is None or setup["direction"] == "either":
+            return None
+        threshold = self.get_property(channel, ctl.Property.CH_POS_COMP_START_THRESHOLD)
+        passed = (threshold - int(round(setup["start"]*1E9)))/int(round(setup["increment"]*1E9))
+        if setup["direction"] == "backward":
+            passed = -passed
+        count = max(int(round(passed)), 0)
+        return count if setup["count"] is None else min(count, setup["count"])
+
+    def trigger_positions(self, ax):
+        # positions [mm or deg] of the pulses of the channel's setup (needs a count)
+        setup = self._triggers[self._channel_index(ax)]
+        step = -setup["increment"] if setup["direction"] == "backward" else setup["increment"]
+        return setup["start"] + step*np.arange(setup["count"])
+
+    def fly_scan(self, ax, start, stop, step, velocity=None, pulse_width=1E-6, polarity="high", timeout=None):
+        # Constant velocity move over start..stop with a trigger pulse every `step`
+        # (mm or deg), both ends included. The axis runs up before start and out after
+        # stop, so the pulses are spaced evenly in time; velocity (mm/s or deg/s) is
+        # used for the scan move and restored afterwards. Returns the number of pulses.
+        channel = self._channel_index(ax)
+        step = abs(step)
+        count = int(np.floor(abs(stop - start)/step + 1E-9)) + 1
+        sign = 1 if stop >= start else -1
+        vel, acc = self.get_speed(channel)
+        scan_vel = vel if velocity is None else velocity
+        # distance to reach the scan velocity, plus one step of margin
+        runup = (scan_vel*scan_vel/(2*acc) if acc > 0 else 0.0) + step
+        self.move(channel, start - sign*runup, absolute=True)
+        self.set_trigger(channel, start, step, count, "forward" if sign > 0 else "backward",
+                         pulse_width, polarity, arm=True)
+        try:
+            if velocity is not None:
+                self.set_speed(channel, velocity, acc)
+            self.move(channel, stop + sign*runup, absolute=True, wait=False)
+            if not self.waitdone(channel, timeout):
+                print("MCS2 fly scan of channel {} did not finish within {} s.".format(channel, timeout))
+        finally:
+            if velocity is not None:
+                self.set_speed(channel, vel, acc)
+            emitted = self.disarm_trigger(channel)
+        if emitted != count:
+            print("MCS2 fly scan of channel {}: {} of {} trigger pulses.".format(channel, emitted, count))
+        return emitted
+
     # STOP
     # This command stops any ongoing movement. It also stops the hold position feature of a closed loop command.
     # Note for closed loop movements with acceleration control enabled:
@@ -189,21 +1163,99 @@ class SmarAct():
     # A second "stop" command triggers a hard stop ("emergency stop").
     def stop(self, channel):
         if type(channel) == str:
-            self.channels[self.channel_names.index(channel)]
+            channel = self.channels[self.channel_names.index(channel)]
         print("MCS2 stop channel: {}.".format(channel))
+        stream = self._stream
+        if stream is not None and stream.running() and channel in stream.channels:
+            stream.abort()
         ctl.Stop(self.smaract, channel)
 
+    # STATISTICS
+    def get_stats(self, channel=None):
+        # Latency of the controller calls of this controller while enable_stats() is on:
+        # {(function, channel): {count, mean, p50, p99, max}}, times in seconds.
+        if stats is None:
+            return {}
+        if channel is not None:
+            channel = self._channel_index(channel)
+        return stats.calls_summary(handle=self.smaract, channel=channel)
+
+    def get_move_stats(self, channel=None):
+        # Time from move command to detected completion and state reads per move:
+        # {channel: {count, mean, p50, p99, max, polls}}
+        if stats is None:
+            return {}
+        if channel is not None:
+            channel = self._channel_index(channel)
+        return stats.moves_summary(handle=self.smaract, channel=channel)
+
+    # POSITION CAPTURE
+    def capture(self, axes=None, capacity=100000, states=False, period=0.0, path=None):
+        # Create a PositionCapture of the given axes (default: all channels).
+        # It samples as fast as the link allows (or every `period` seconds) into
+        # a preallocated ring buffer of `capacity` samples, memory-mapped to
+        # files starting with `path` if given. Start it with start(), as a
+        # context manager or by passing it to mv/mvr/move(capture=...).
+        from SmaractStage.SmaractCapture import PositionCapture
+        if axes is None:
+            axes = self.channels
+        return PositionCapture(self, axes, capacity=capacity, states=states, period=period, path=path)
+
+    # TELEMETRY
+    def telemetry(self, path, axes=None, period=1.0, extra=(), tiers=None, flush_interval=60.0):
+        # Create a Telemetry of the given axes (default: all channels) that stores
+        # position, target, state and error, plus the properties named in extra,
+        # every `period` seconds under directory `path` (see SmaractTelemetry).
+        # Start it with start(); query(t0, t1) returns time windows as arrays.
+        # Samples reach the disk at least every flush_interval seconds.
+        from SmaractStage.SmaractTelemetry import Telemetry, DEFAULT_TIERS
+        return Telemetry(self, path, axes=axes, period=period, extra=extra,
+                         tiers=DEFAULT_TIERS if tiers is None else tiers, flush_interval=flush_interval)
+
+    # TRAJECTORY
+    def stream_trajectory(self, trajectory, rate=None, timestamps=None, approach=True, wait=True,
+                          trigger_mode=None):
+        # Run a multi-axis path on the controller's command stream.
+        # trajectory is {axis: array of positions in mm or deg}, all arrays of the
+        # same length. The frames are executed at `rate` Hz; with `timestamps`
+        # (seconds, one per frame) the path is resampled onto a uniform grid at
+        # `rate`, which defaults to the smallest timestamp spacing.
+        # With approach=True the axes are first moved to the start of the path.
+        # Returns the TrajectoryStream; stop() on any streamed axis aborts it.
+        from SmaractStage.SmaractStream import TrajectoryStream, resample, MIN_RATE, MAX_RATE
+        chans = [self._channel_index(ax) for ax in trajectory]
+        try:
+            positions = np.column_stack([np.asarray(trajectory[ax], dtype=np.float64) for ax in trajectory])
+        except ValueError:
+            raise ValueError("all trajectory arrays must have the same length.")
+        if timestamps is not None:
+            if rate is None:
+                rate = 1.0/np.min(np.diff(np.asarray(timestamps, dtype=np.float64)))
+            positions = resample(timestamps, positions, rate)
+        if rate is None:
+            raise ValueError("either rate or timestamps is required.")
+        rate = int(round(rate))
+        if not MIN_RATE <= rate <= MAX_RATE:
+            raise ValueError("stream rate must be within {} and {} Hz.".format(MIN_RATE, MAX_RATE))
+        if self._stream is not None and self._stream.running():
+            raise RuntimeError("a trajectory is already streaming.")
+        if approach:
+            self.mv_many(dict(zip(chans, positions[0])))
+        frames = np.round(positions*1E9).astype(np.int64)
+        self._stream = TrajectoryStream(self, chans, frames, rate, trigger_mode)
+        self._stream.start()
+        if wait:
+            self._stream.wait()
+        return self._stream
+
 
     def _get_unit(self, channel):
-        base_unit = ctl.GetProperty_i32(self.smaract, channel, ctl.Property.POS_BASE_UNIT)
+        base_unit = self.get_property(channel, ctl.Property.POS_BASE_UNIT)
         return base_unit
 
     def get_unit(self, channel):
         base_unit = self._get_unit(channel)
-        if base_unit == ctl.BaseUnit.METER:
-            return "mm", base_unit
-        else: 
-            return "deg", base_unit
+        return _unit_name(base_unit), base_unit
 
 
         # The move mode states the type of movement performed when sending the "Move" command.
@@ -268,7 +1320,7 @@ class SmarAct():
         # set the position to -0.1 mm respectively -100 degree.
     #    position = -100000000
         print("MCS2 set position of channel {} to {}".format(ax, pos), end='')
-        print("pm.") if self.base_units[ax] == ctl.BaseUnit.METER else print("ndeg.")
+        print("pm.") if self.base_units[self.channels.index(ax)] == ctl.BaseUnit.METER else print("ndeg.")
         r_id = ctl.RequestWriteProperty_i64(self.smaract, ax, ctl.Property.POSITION, pos)
         # The function call returns immediately, without waiting for the reply from the controller.
         # ...process other tasks...
@@ -300,6 +1352,64 @@ class SmarAct():
         return bool(state & ctl.ChannelState.ACTIVELY_MOVING)
     
     
+    def _channel_index(self, ax):
+        if type(ax) == str:
+            return self.channels[self.channel_names.index(ax)]
+        return ax
+
+    def _read_many(self, requests):
+        # Pipelined read: send every (channel, property) request first, then
+        # collect the replies, so N reads cost one round trip instead of N.
+        # All replies are drained even if one of them fails.
+        r_ids = [ctl.RequestReadProperty(self.smaract, ch, pkey, 0) for ch, pkey, _ in requests]
+        values = []
+        error = None
+        for r_id, (ch, pkey, i64) in zip(r_ids, requests):
+            try:
+                if i64:
+                    values.append(ctl.ReadProperty_i64(self.smaract, r_id))
+                else:
+                    values.append(ctl.ReadProperty_i32(self.smaract, r_id))
+            except ctl.Error as e:
+                values.append(0)
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
+        return values
+
+    def read_status(self, axes=None):
+        # Position (mm or deg) and channel state of several axes sampled in a
+        # single pipelined transaction. Returns a numpy record array with the
+        # fields channel, position and state.
+        if axes is None:
+            axes = self.channels
+        chans = [self._channel_index(ax) for ax in axes]
+        requests = []
+        for ch in chans:
+            requests.append((ch, ctl.Property.POSITION, True))
+            requests.append((ch, ctl.Property.CHANNEL_STATE, False))
+        values = self._read_many(requests)
+        status = np.empty(len(chans), dtype=status_dtype)
+        status['channel'] = chans
+        status['position'] = np.asarray(values[0::2], dtype=np.float64)/1E9
+        status['state'] = values[1::2]
+        return status.view(np.recarray)
+
+    def get_positions(self, axes=None):
+        # positions in mm or deg of several axes, read in one round trip
+        if axes is None:
+            axes = self.channels
+        requests = [(self._channel_index(ax), ctl.Property.POSITION, True) for ax in axes]
+        return np.asarray(self._read_many(requests), dtype=np.float64)/1E9
+
+    def get_states(self, axes=None):
+        # CHANNEL_STATE words of several axes, read in one round trip
+        if axes is None:
+            axes = self.channels
+        requests = [(self._channel_index(ax), ctl.Property.CHANNEL_STATE, False) for ax in axes]
+        return np.asarray(self._read_many(requests), dtype=np.int64)
+
     def get_numberofchannels(self):
         return ctl.GetProperty_i32(self.smaract, 0, ctl.Property.NUMBER_OF_CHANNELS)
     
@@ -333,6 +1443,40 @@ class SmarAct():
                 return 1
         else:
             return 0
+def use_backend(backend):
+    """
+    Select the module that implements the SmarActCTL api, e.g. smaract.ctl
+    or SmaractStage.SmaractSim, or its name for load_backend() ("sdk" or
+    "sim"). All SmarAct objects share the selected backend, so call this
+    before opening a controller.
+    """
+    global ctl
+    if isinstance(backend, str):
+        backend = load_backend(backend)
+    if stats is not None:
+        from SmaractStage.SmaractStats import InstrumentedBackend
+        backend = InstrumentedBackend(backend, stats)
+    ctl = backend
+    _found_devices.clear()
+
+def enable_stats():
+    """
+    Time every controller call (see SmaractStats) and return the CallStats
+    object that collects the histograms. Stays on until disable_stats().
+    """
+    global ctl, stats
+    from SmaractStage.SmaractStats import CallStats, InstrumentedBackend
+    if stats is None:
+        stats = CallStats()
+        ctl = InstrumentedBackend(ctl, stats)
+    return stats
+
+def disable_stats():
+    global ctl, stats
+    if stats is not None:
+        ctl = ctl.backend
+        stats = None
+
 def assert_lib_compatibility():
     """
     Checks that the major version numbers of the Python API and the
@@ -0,0 +1,184 @@
+import math
+import threading
+import time
+import numpy as np
+
+# LATENCY INSTRUMENTATION
+# InstrumentedBackend wraps the smaract.ctl module (or the simulator): every api function call
+# is timed and counted per (device handle, function, channel) in log-spaced histograms.
+# SmaractStage.enable_stats() installs it as the backend and disable_stats() restores the plain
+# module, so with statistics off the controller calls go straight to the SDK and cost nothing
+# extra. Besides calls, the time from a move command to the detection of its completion and
+# the number of state reads spent waiting are recorded per channel.
+
+# histogram: 10 bins per decade from 1 us to 100 s, plus under- and overflow
+BINS_PER_DECADE = 10
+MIN_EXP = -6
+MAX_EXP = 2
+N_BINS = (MAX_EXP - MIN_EXP)*BINS_PER_DECADE + 2
+# upper edge of each bin [s]
+BIN_EDGES = np.concatenate((10.0**(MIN_EXP + np.arange(N_BINS - 1)/BINS_PER_DECADE), [np.inf]))
+
+# api functions whose second argument is a channel index
+CHANNEL_FUNCTIONS = ("GetProperty_i32", "GetProperty_i64", "SetProperty_i32", "SetProperty_i64",
+                     "Move", "Stop", "Calibrate", "Reference")
+# blocking waits for the controller, not calls: passed through untimed
+UNTIMED_FUNCTIONS = ("WaitForEvent",)
+
+def _bin(dt):
+    if dt <= 0:
+        return 0
+    b = int(math.ceil((math.log10(dt) - MIN_EXP)*BINS_PER_DECADE))
+    return min(max(b, 0), N_BINS - 1)
+
+class Histogram():
+    def __init__(self):
+        self.counts = np.zeros(N_BINS, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, dt):
+        self.counts[_bin(dt)] += 1
+        self.count += 1
+        self.total += dt
+        if dt > self.max:
+            self.max = dt
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        # upper bin edge below which q percent of the samples fall (within 26 %)
+        if self.count == 0:
+            return math.nan
+        idx = int(np.searchsorted(np.cumsum(self.counts), q/100.0*self.count))
+        return float(min(BIN_EDGES[min(idx, N_BINS - 1)], self.max))
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.total/self.count if self.count else math.nan,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+class CallStats():
+    """
+    Latency histograms of controller calls, keyed by (handle, function, channel),
+    and of move completion, keyed by (handle, channel). Times are in seconds.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = {}
+            self.moves = {}
+            self.move_polls = {}
+            self.t0 = time.monotonic()
+
+    def record(self, handle, func, channel, dt):
+        key = (handle, func, channel)
+        with self._lock:
+            hist = self.calls.get(key)
+            if hist is None:
+                hist = self.calls[key] = Histogram()
+            hist.add(dt)
+
+    def record_move(self, handle, channel, latency, polls):
+        key = (handle, channel)
+        with self._lock:
+            hist = self.moves.get(key)
+            if hist is None:
+                hist = self.moves[key] = Histogram()
+            hist.add(latency)
+            self.move_polls[key] = self.move_polls.get(key, 0) + polls
+
+    def _select(self, table, handle, channel, func=None):
+        with self._lock:
+            for key, hist in table.items():
+                if handle is not None and key[0] != handle:
+                    continue
+                if func is not None and key[1] != func:
+                    continue
+                if channel is not None and key[-1] != channel:
+                    continue
+                yield key, hist
+
+    def calls_summary(self, handle=None, channel=None, func=None):
+        # {(function, channel): {count, mean, p50, p99, max}}
+        return {key[1:]: hist.summary() for key, hist in list(self._select(self.calls, handle, channel, func))}
+
+    def merged(self, handle=None, channel=None, func=None):
+        # one histogram over all selected calls
+        total = Histogram()
+        for _, hist in list(self._select(self.calls, handle, channel, func)):
+            total.merge(hist)
+        return total
+
+    def moves_summary(self, handle=None, channel=None):
+        # {channel: {count, mean, p50, p99, max, polls}}, polls per move
+        result = {}
+        for key, hist in list(self._select(self.moves, handle, channel)):
+            summary = hist.summary()
+            summary['polls'] = self.move_polls.get(key, 0)/hist.count if hist.count else math.nan
+            result[key[1]] = summary
+        return result
+
+class InstrumentedBackend():
+    """
+    Drop-in replacement of the smaract.ctl module that times every api call.
+    Reads through RequestReadProperty/ReadProperty_x are attributed to the
+    channel of the request; WaitForEvent is not timed, it blocks until an
+    event arrives.
+    """
+    def __init__(self, backend, stats):
+        self.backend = backend
+        self.stats = stats
+        self._rids = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self.backend, name)
+        if callable(attr) and not isinstance(attr, type) and name[:1].isupper() and name not in UNTIMED_FUNCTIONS:
+            attr = self._wrap(name, attr)
+        # cache, so the wrapper is only built once per name
+        setattr(self, name, attr)
+        return attr
+
+    def _wrap(self, name, func):
+        stats = self.stats
+        rids = self._rids
+        clock = time.perf_counter
+        if name.startswith("RequestReadProperty") or name.startswith("RequestWriteProperty"):
+            def call(d_handle, idx, *args, **kwargs):
+                t = clock()
+                r_id = func(d_handle, idx, *args, **kwargs)
+                stats.record(d_handle, name, idx, clock() - t)
+                if r_id is not None:
+                    rids[(d_handle, r_id)] = idx
+                return r_id
+        elif name.startswith("ReadProperty") or name == "WaitForWrite":
+            def call(d_handle, r_id, *args, **kwargs):
+                t = clock()
+                try:
+                    return func(d_handle, r_id, *args, **kwargs)
+                finally:
+                    stats.record(d_handle, name, rids.pop((d_handle, r_id), None), clock() - t)
+        else:
+            has_channel = name in CHANNEL_FUNCTIONS
+            def call(*args, **kwargs):
+                t = clock()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    handle = args[0] if args else None
+                    channel = args[1] if has_channel and len(args) > 1 else None
+                    stats.record(handle, name, channel, clock() - t)
+        call.__name__ = name
+        return call
@@ -0,0 +1,149 @@
+import threading
+import time
+import numpy as np
+from SmaractStage import SmaractStage as stage
+
+# TRAJECTORY STREAMING
+# A command stream sends a sequence of frames to the controller. Each frame holds one target
+# position per streamed channel; the controller executes the frames at the stream base rate
+# (STREAM_BASE_RATE) and interpolates between them, so the path timing does not depend on the
+# host. Frames are written with WriteCommandStream, which blocks while the controller buffer
+# is full (flow control). If the buffer runs empty before the stream is closed, the controller
+# aborts the stream with a buffer underflow.
+
+# stream base rate limits of the MCS2 [Hz]
+MIN_RATE = 1
+MAX_RATE = 15000
+
+def resample(timestamps, positions, rate):
+    # Linear resampling of (timestamps, positions[n, m]) onto a uniform grid at `rate`.
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if timestamps.ndim != 1 or len(timestamps) != len(positions):
+        raise ValueError("timestamps must be a 1d array with one entry per frame.")
+    if np.any(np.diff(timestamps) <= 0):
+        raise ValueError("timestamps must be strictly increasing.")
+    t = np.arange(timestamps[0], timestamps[-1] + 0.5/rate, 1.0/rate)
+    return np.column_stack([np.interp(t, timestamps, positions[:, i]) for i in range(positions.shape[1])])
+
+class TrajectoryStream():
+    """
+    Feeds frames (n_frames x n_channels, in pm or ndeg) to a command stream
+    from a background thread and tracks the outcome.
+
+    Attributes after the stream finished:
+      - frames_written: number of frames accepted by the controller
+      - result: controller result code (ErrorCode.NONE on success)
+      - underrun: True if the controller ran out of frames
+      - aborted: True if the stream was aborted with abort() or SmarAct.stop()
+      - error: code of a failed stream call of the feeder, if any
+    """
+    def __init__(self, smaract, channels, frames, rate, trigger_mode=None, chunk=1024):
+        ctl = stage.ctl
+        self.smaract = smaract
+        self.channels = list(channels)
+        self.frames = frames
+        self.rate = rate
+        self.trigger_mode = ctl.StreamTriggerMode.DIRECT if trigger_mode is None else trigger_mode
+        self.chunk = chunk
+        self.frames_written = 0
+        self.result = None
+        self.underrun = False
+        self.aborted = False
+        self.error = None
+        self.s_handle = None
+        self._abort = threading.Event()
+        self._done = threading.Event()
+        self._thread = None
+        self._events = smaract.events
+        # (uint8 channel, int64 position) pairs, one row per frame
+        self._dtype = np.dtype([('ch', 'u1'), ('pos', '<i8')])
+
+    def start(self):
+        ctl = stage.ctl
+        handle = self.smaract.smaract
+        ctl.SetProperty_i32(handle, 0, ctl.Property.STREAM_BASE_RATE, int(self.rate))
+        if self._events is not None:
+            self._events.add_callback(self._on_event)
+        self.s_handle = ctl.OpenCommandStream(handle, self.trigger_mode)
+        self._thread = threading.Thread(target=self._feed, name="smaract-stream", daemon=True)
+        self._thread.start()
+
+    def _feed(self):
+        ctl = stage.ctl
+        handle = self.smaract.smaract
+        n_frames = len(self.frames)
+        try:
+            for first in range(0, n_frames, self.chunk):
+                block = self.frames[first:first + self.chunk]
+                packed = np.empty(block.shape, dtype=self._dtype)
+                packed['ch'] = self.channels
+                packed['pos'] = block
+                for row in packed:
+                    if self._abort.is_set():
+                        return
+                    ctl.WriteCommandStream(handle, self.s_handle, row.tobytes())
+                    self.frames_written += 1
+            ctl.CloseCommandStream(handle, self.s_handle)
+        except ctl.Error as e:
+            # The controller ended the stream (underflow or abort) or rejected a
+            # frame. Make sure the stream is gone; the outcome is reported by the
+            # STREAM_FINISHED event or found by _poll_finished.
+            self.error = e.code
+            try:
+                ctl.AbortCommandStream(handle, self.s_handle)
+            except ctl.Error:
+                pass
+        finally:
+            if self._events is None:
+                self._poll_finished()
+
+    def _on_event(self, event):
+        ctl = stage.ctl
+        if event.type == ctl.EventType.STREAM_FINISHED and event.idx == self.s_handle:
+            self._finish(event.i32)
+
+    def _poll_finished(self):
+        # without events: wait for the IS_STREAMING bit to clear on all channels
+        ctl = stage.ctl
+        delay = stage.POLL_MIN
+        while (self.smaract.get_states(self.channels) & ctl.ChannelState.IS_STREAMING).any():
+            time.sleep(delay)
+            delay = min(delay*1.5, stage.POLL_MAX)
+        if self.aborted:
+            self._finish(ctl.ErrorCode.ABORTED)
+        elif self.frames_written < len(self.frames):
+            self._finish(ctl.ErrorCode.BUFFER_UNDERFLOW)
+        else:
+            self._finish(ctl.ErrorCode.NONE)
+
+    def _finish(self, result):
+        ctl = stage.ctl
+        if self._done.is_set():
+            return
+        self.result = result
+        self.underrun = result == ctl.ErrorCode.BUFFER_UNDERFLOW
+        self.aborted = self.aborted or result == ctl.ErrorCode.ABORTED
+        if self._events is not None:
+            self._events.remove_callback(self._on_event)
+        self._done.set()
+        if self.underrun:
+            print("MCS2 stream underrun after {} of {} frames.".format(self.frames_written, len(self.frames)))
+
+    def running(self):
+        return self._thread is not None and not self._done.is_set()
+
+    def abort(self):
+        ctl = stage.ctl
+        if not self.running():
+            return
+        self.aborted = True
+        self._abort.set()
+        try:
+            ctl.AbortCommandStream(self.smaract.smaract, self.s_handle)
+        except ctl.Error:
+            # the stream already finished
+            pass
+
+    def wait(self, timeout=None):
+        # Wait for the end of the stream. Returns False on timeout.
+        return self._done.wait(timeout)
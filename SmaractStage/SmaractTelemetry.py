@@ -0,0 +1,315 @@
+import glob
+import math
+import os
+import threading
+import time
+import numpy as np
+from SmaractStage import SmaractStage as stage
+
+# CONTROLLER TELEMETRY
+# Telemetry samples position, target position, channel state and channel error (plus optional
+# extra properties, e.g. temperatures of the module type at hand) of all channels, one pipelined
+# batch per sample. Samples go into a TelemetryStore: an append-only columnar store on disk with
+# retention tiers. Tier 0 keeps every sample; each further tier keeps per-period aggregates
+# (mean/min/max position, OR of the state bits, last non-zero error) for longer. Rows are kept
+# in a fixed size in-memory chunk per tier and written as one .npz file (one array per column)
+# when the chunk is full, and chunk files older than the tier's retention are deleted, so
+# memory and disk use stay bounded. The rows of the unfilled chunk are also saved to
+# current.npz every flush_interval seconds and read back on the next start, so a killed
+# process loses at most that much data.
+# In the IOC the StatusPoller takes the samples: the extra reads are issued together with its
+# status read, so they share one controller transaction.
+
+# (aggregation period [s], retention [s]) per tier; period 0 keeps the raw samples
+DEFAULT_TIERS = ((0, 2*86400), (10, 30*86400), (300, 400*86400))
+# properties read for every sample besides position and state
+TELEMETRY_PROPERTIES = ("TARGET_POSITION", "CHANNEL_ERROR")
+
+def _column_name(pkey_name):
+    return pkey_name.lower()
+
+class _Tier():
+    def __init__(self, directory, period, retention, dtype, chunk):
+        self.directory = directory
+        self.period = period
+        self.retention = retention
+        self.dtype = dtype
+        self.buffer = np.empty(chunk, dtype=dtype)
+        self.n = 0
+        os.makedirs(directory, exist_ok=True)
+        # rows of the unfilled chunk, saved by checkpoint()
+        self.current = os.path.join(directory, "current.npz")
+        # chunk files on disk: [(t_first, t_last, path)], oldest first
+        self.chunks = []
+        for path in glob.glob(os.path.join(directory, "*.npz")):
+            if path == self.current:
+                continue
+            t0, t1 = os.path.basename(path)[:-4].split("_")
+            self.chunks.append((float(t0), float(t1), path))
+        self.chunks.sort()
+        # aggregate of the current period
+        self.bucket = None
+        self._agg = None
+        if os.path.exists(self.current):
+            # the chunk that was open when the last process ended
+            with np.load(self.current) as data:
+                rows = np.zeros(len(data['t']), dtype=dtype)
+                for name in dtype.names:
+                    rows[name] = data[name]
+            for row in rows:
+                self._append(row)
+
+    def add(self, row):
+        if self.period == 0:
+            self._append(row)
+            return
+        bucket = math.floor(row['t']/self.period)
+        if self.bucket is not None and bucket != self.bucket:
+            self._emit()
+        if self._agg is None:
+            self.bucket = bucket
+            self._agg = {'count': 0}
+            for name in self.dtype.names:
+                if name != 't':
+                    self._agg[name] = row[name].copy()
+            self._agg['position'] = np.zeros_like(row['position'])
+            for name in self._extra_names():
+                self._agg[name] = np.zeros_like(row[name])
+        agg = self._agg
+        agg['count'] += 1
+        agg['position'] += row['position']
+        np.minimum(agg['position_min'], row['position_min'], out=agg['position_min'])
+        np.maximum(agg['position_max'], row['position_max'], out=agg['position_max'])
+        agg['target'] = row['target']
+        agg['state'] |= row['state']
+        agg['error'] = np.where(row['error'] != 0, row['error'], agg['error'])
+        for name in self._extra_names():
+            agg[name] += row[name]
+
+    def _extra_names(self):
+        return self.dtype.names[7:]
+
+    def _emit(self):
+        agg = self._agg
+        row = np.zeros((), dtype=self.dtype)
+        row['t'] = self.bucket*self.period
+        for name in self.dtype.names[1:]:
+            row[name] = agg[name]
+        row['position'] = agg['position']/agg['count']
+        for name in self._extra_names():
+            row[name] = agg[name]/agg['count']
+        self._agg = None
+        self.bucket = None
+        self._append(row)
+
+    def _append(self, row):
+        self.buffer[self.n] = row
+        self.n += 1
+        if self.n == len(self.buffer):
+            self.flush()
+
+    def flush(self, final=False):
+        # write the buffered rows as a chunk file and apply the retention
+        if final and self._agg is not None:
+            self._emit()
+        if self.n:
+            rows = self.buffer[:self.n]
+            t0, t1 = rows['t'][0], rows['t'][-1]
+            path = os.path.join(self.directory, "{:.6f}_{:.6f}.npz".format(t0, t1))
+            self._save(rows, path)
+            self.chunks.append((t0, t1, path))
+            self.n = 0
+            if os.path.exists(self.current):
+                os.remove(self.current)
+        if self.retention:
+            limit = time.time() - self.retention
+            while self.chunks and self.chunks[0][1] < limit:
+                os.remove(self.chunks.pop(0)[2])
+
+    def checkpoint(self):
+        # save the rows of the unfilled chunk, replaced by the next checkpoint
+        if self.n:
+            self._save(self.buffer[:self.n], self.current)
+
+    def _save(self, rows, path):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **{name: rows[name] for name in self.dtype.names})
+        os.replace(tmp, path)
+
+    def query(self, t0, t1, columns):
+        parts = {name: [] for name in columns}
+        for c0, c1, path in self.chunks:
+            if c1 < t0 or c0 >= t1:
+                continue
+            with np.load(path) as data:
+                t = data['t']
+                sel = (t >= t0) & (t < t1)
+                for name in columns:
+                    parts[name].append(t[sel] if name == 't' else data[name][sel])
+        rows = self.buffer[:self.n]
+        sel = (rows['t'] >= t0) & (rows['t'] < t1)
+        for name in columns:
+            parts[name].append(rows[name][sel])
+        return {name: np.concatenate(parts[name]) for name in columns}
+
+class TelemetryStore():
+    """
+    Append-only columnar telemetry of n channels under directory `path`.
+
+    Columns: t (seconds since the epoch), position, position_min,
+    position_max, target (mm or deg), state, error, and one column per extra
+    property; all but t have one entry per channel. tiers is a list of
+    (aggregation period, retention) in seconds, finest first. Buffered rows
+    reach the disk at least every flush_interval seconds (None: only when a
+    chunk is full).
+    """
+    def __init__(self, path, channels, extra=(), tiers=DEFAULT_TIERS, chunk=4096, flush_interval=60.0):
+        self.path = path
+        self.channels = list(channels)
+        self.extra = [_column_name(name) for name in extra]
+        n = len(self.channels)
+        fields = [('t', np.float64), ('position', np.float64, (n,)), ('position_min', np.float64, (n,)),
+                  ('position_max', np.float64, (n,)), ('target', np.float64, (n,)),
+                  ('state', np.int64, (n,)), ('error', np.int64, (n,))]
+        fields += [(name, np.float64, (n,)) for name in self.extra]
+        self.dtype = np.dtype(fields)
+        self.columns = self.dtype.names
+        self._lock = threading.Lock()
+        self.flush_interval = flush_interval
+        self._checkpoint = time.monotonic()
+        self.tiers = [_Tier(os.path.join(path, "tier{}_{}s".format(i, period)), period, retention, self.dtype, chunk)
+                      for i, (period, retention) in enumerate(tiers)]
+
+    def append(self, t, positions, targets, states, errors, extras=()):
+        row = np.zeros((), dtype=self.dtype)
+        row['t'] = t
+        row['position'] = row['position_min'] = row['position_max'] = positions
+        row['target'] = targets
+        row['state'] = states
+        row['error'] = errors
+        for name, values in zip(self.extra, extras):
+            row[name] = values
+        with self._lock:
+            for tier in self.tiers:
+                tier.add(row)
+            now = time.monotonic()
+            if self.flush_interval is not None and now - self._checkpoint >= self.flush_interval:
+                for tier in self.tiers:
+                    tier.checkpoint()
+                self._checkpoint = now
+
+    def query(self, t0=None, t1=None, columns=None, tier=None):
+        # Rows with t0 <= t < t1 as {column: array}, oldest first. Without tier the
+        # finest tier whose retention still covers t0 is used, or without t0 the
+        # finest tier that holds any rows.
+        now = time.time()
+        t1 = np.inf if t1 is None else t1
+        if tier is None:
+            if t0 is None:
+                tier = next((i for i, tr in enumerate(self.tiers) if tr.chunks or tr.n), 0)
+            else:
+                tier = len(self.tiers) - 1
+                for i, tr in enumerate(self.tiers):
+                    if not tr.retention or t0 >= now - tr.retention:
+                        tier = i
+                        break
+        t0 = -np.inf if t0 is None else t0
+        columns = self.columns if columns is None else ('t',) + tuple(c for c in columns if c != 't')
+        with self._lock:
+            return self.tiers[tier].query(t0, t1, columns)
+
+    def flush(self, final=False):
+        # write all buffered rows to disk; final also closes the open aggregation periods
+        with self._lock:
+            for tier in self.tiers:
+                tier.flush(final)
+
+    def close(self):
+        self.flush(final=True)
+
+class Telemetry():
+    """
+    Periodic telemetry of the channels of a SmarAct controller into a
+    TelemetryStore. Runs its own sampling thread with start()/stop(), or is
+    fed by an IOC StatusPoller (see SmaractMotorRecord).
+    """
+    def __init__(self, smaract, path, axes=None, period=1.0, extra=(), tiers=DEFAULT_TIERS, chunk=4096,
+                 flush_interval=60.0):
+        self.smaract = smaract
+        if axes is None:
+            axes = smaract.channels
+        self.channels = [smaract._channel_index(ax) for ax in axes]
+        self.period = period
+        self.extra = list(extra)
+        self.store = TelemetryStore(path, self.channels, extra=extra, tiers=tiers, chunk=chunk,
+                                    flush_interval=flush_interval)
+        self._stop = threading.Event()
+        self._thread = None
+        self._next = 0.0
+
+    def requests(self):
+        # (channel, property, is_i64) of one sample besides position and state
+        ctl = stage.ctl
+        names = TELEMETRY_PROPERTIES + tuple(self.extra)
+        return [(ch, getattr(ctl.Property, name), stage._is_i64(getattr(ctl.Property, name)))
+                for name in names for ch in self.channels]
+
+    def due(self, now=None):
+        # True (once per period) when the next sample should be taken
+        now = time.monotonic() if now is None else now
+        if now < self._next:
+            return False
+        self._next = now + self.period
+        return True
+
+    def record(self, positions, states, values):
+        # store one sample; values are the results of requests(), raw
+        n = len(self.channels)
+        values = np.asarray(values, dtype=np.float64).reshape(-1, n)
+        targets = values[0]/1E9
+        errors = values[1].astype(np.int64)
+        self.store.append(time.time(), positions, targets, states, errors, values[2:])
+
+    def sample(self):
+        # one sample in a single pipelined read
+        ctl = stage.ctl
+        requests = [(ch, ctl.Property.POSITION, True) for ch in self.channels]
+        requests += [(ch, ctl.Property.CHANNEL_STATE, False) for ch in self.channels]
+        requests += self.requests()
+        values = self.smaract._read_many(requests)
+        n = len(self.channels)
+        positions = np.asarray(values[:n], dtype=np.float64)/1E9
+        self.record(positions, values[n:2*n], values[2*n:])
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="smaract-telemetry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.store.flush()
+
+    def _run(self):
+        delay = 0
+        while not self._stop.wait(delay):
+            t0 = time.monotonic()
+            try:
+                self.sample()
+            except stage.ctl.Error as e:
+                print("MCS2 telemetry: {} (0x{:04X})".format(stage.ctl.GetResultInfo(e.code), e.code))
+            delay = max(self.period - (time.monotonic() - t0), 0)
+
+    def query(self, t0=None, t1=None, columns=None, tier=None):
+        return self.store.query(t0, t1, columns, tier)
+
+    def close(self):
+        self.stop()
+        self.store.close()
@@ -0,0 +1,155 @@
+import threading
+from collections import deque
+from concurrent.futures import Future
+from SmaractStage import SmaractStage as stage
+
+# I/O WORKER
+# One thread owns the device handle and executes all requests in cycles:
+#   1. motion commands (move, stop, ...), in submission order,
+#   2. other calls, re-checking for motion commands after each one,
+#   3. property reads, coalesced: all reads of the same (channel, property) that are queued in
+#      the cycle share one controller transaction, and the distinct reads are pipelined.
+# Requests return concurrent.futures.Future objects (asyncio.wrap_future turns them into
+# awaitables), so callers on any thread never touch the handle themselves.
+
+class IOWorker():
+    """
+    Serializes controller access of a SmarAct object on one thread.
+
+    command(func, ...) and call(func, ...) run func(*args) on the worker,
+    commands before anything else; read(channel, pkey) returns the raw
+    property value. tick, if given, is called after every cycle and returns
+    the time in seconds until it wants to be called again (None: only
+    after the next request).
+    """
+    def __init__(self, smaract, tick=None):
+        self.smaract = smaract
+        self.tick = tick
+        self._cond = threading.Condition()
+        self._commands = deque()
+        self._calls = deque()
+        self._reads = {}
+        # number of read requests and of controller reads they were served with
+        self.reads_requested = 0
+        self.reads_issued = 0
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="smaract-io", daemon=True)
+        self._thread.start()
+
+    def command(self, func, *args, **kwargs):
+        return self._put(self._commands, func, args, kwargs)
+
+    def call(self, func, *args, **kwargs):
+        return self._put(self._calls, func, args, kwargs)
+
+    def read(self, channel, pkey):
+        future = Future()
+        with self._cond:
+            self._reads.setdefault((channel, pkey), []).append(future)
+            self.reads_requested += 1
+            self._cond.notify()
+        return future
+
+    def wake(self):
+        with self._cond:
+            self._cond.notify()
+
+    def _put(self, queue, func, args, kwargs):
+        future = Future()
+        with self._cond:
+            queue.append((future, func, args, kwargs))
+            self._cond.notify()
+        return future
+
+    def _run(self):
+        timeout = None
+        while True:
+            with self._cond:
+                # _running is checked too, so a close() between two cycles is not missed
+                if self._running and not (self._commands or self._calls or self._reads):
+                    self._cond.wait(timeout)
+                if not self._running:
+                    break
+            self._run_commands()
+            while True:
+                with self._cond:
+                    if not self._calls:
+                        break
+                    item = self._calls.popleft()
+                self._execute(*item)
+                self._run_commands()
+            with self._cond:
+                reads, self._reads = self._reads, {}
+            if reads:
+                try:
+                    self._run_reads(reads)
+                except Exception as ex:
+                    print("MCS2 I/O worker: read failed: {!r}".format(ex))
+                    self._fail(reads, ex)
+            timeout = None
+            if self.tick is not None:
+                # the worker must outlive a failed poll, every caller depends on it
+                try:
+                    timeout = self.tick()
+                except Exception as ex:
+                    print("MCS2 I/O worker: poll failed, retrying: {!r}".format(ex))
+                    timeout = stage.POLL_MAX
+
+    def _run_commands(self):
+        while True:
+            with self._cond:
+                if not self._commands:
+                    return
+                item = self._commands.popleft()
+            self._execute(*item)
+
+    def _execute(self, future, func, args, kwargs):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as ex:
+            future.set_exception(ex)
+
+    def _run_reads(self, reads):
+        # one pipelined transaction for all distinct reads of the cycle
+        ctl = stage.ctl
+        handle = self.smaract.smaract
+        keys = list(reads)
+        self.reads_issued += len(keys)
+        r_ids = []
+        for ch, pkey in keys:
+            try:
+                r_ids.append(ctl.RequestReadProperty(handle, ch, pkey, 0))
+            except Exception as e:
+                r_ids.append(e)
+        for (ch, pkey), r_id in zip(keys, r_ids):
+            # a failed read fails the futures of that read only
+            try:
+                if isinstance(r_id, Exception):
+                    raise r_id
+                if stage._is_i64(pkey):
+                    value, ex = ctl.ReadProperty_i64(handle, r_id), None
+                else:
+                    value, ex = ctl.ReadProperty_i32(handle, r_id), None
+            except Exception as e:
+                value, ex = None, e
+            for future in reads[(ch, pkey)]:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if ex is None:
+                    future.set_result(value)
+                else:
+                    future.set_exception(ex)
+
+    def _fail(self, reads, ex):
+        for futures in reads.values():
+            for future in futures:
+                if not future.done() and future.set_running_or_notify_cancel():
+                    future.set_exception(ex)
+
+    def close(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join()
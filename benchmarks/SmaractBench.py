@@ -0,0 +1,243 @@
+"""
+Throughput and latency benchmarks of SmaractStage against the simulated MCS2
+(SmaractStage/SmaractSim.py), so results do not depend on hardware.
+
+    python benchmarks/SmaractBench.py --latency 0.0005 --output new.json
+    python benchmarks/SmaractBench.py --compare old.json new.json
+
+Results are written as JSON: {"meta": {...}, "results": {name: {"value",
+"unit", "better"}}}. The compare mode prints the change of every metric and
+exits with status 1 if any metric got worse by more than --threshold.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import numpy as np
+
+# the benchmarks always run on the simulator
+os.environ["SMARACT_BACKEND"] = "sim"
+# keep channel access on the loopback interface for the IOC benchmark
+os.environ.setdefault("EPICS_CA_ADDR_LIST", "127.0.0.1")
+os.environ.setdefault("EPICS_CA_AUTO_ADDR_LIST", "NO")
+os.environ.setdefault("EPICS_CAS_INTF_ADDR_LIST", "127.0.0.1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SmaractStage import SmaractStage as stage
+from SmaractStage import SmaractSim
+
+SERIAL = "MCS2-00015447"
+CHANNELS = [0, 1, 2, 4]
+
+def _result(value, unit, better):
+    return {"value": value, "unit": unit, "better": better}
+
+def _rate(func, duration):
+    # calls of func per second over about `duration` seconds
+    n = 0
+    t0 = time.perf_counter()
+    while True:
+        func()
+        n += 1
+        elapsed = time.perf_counter() - t0
+        if elapsed >= duration:
+            return n/elapsed
+
+def bench_construct(args):
+    # median time to open and configure a controller, with and without device discovery
+    results = {}
+    for name, refresh in (("construct_cold", True), ("construct", False)):
+        times = []
+        for _ in range(args.repeat):
+            if refresh:
+                stage._found_devices.clear()
+            t0 = time.perf_counter()
+            s = stage.SmarAct(SERIAL, channels=CHANNELS)
+            times.append(time.perf_counter() - t0)
+            s.close()
+        results[name] = _result(statistics.median(times)*1E3, "ms", "lower")
+    return results
+
+def bench_readback(args):
+    s = stage.SmarAct(SERIAL, channels=CHANNELS)
+    try:
+        single = _rate(lambda: s.get_pos(CHANNELS[0]), args.duration)
+        many = _rate(lambda: s.get_positions(CHANNELS), args.duration)
+    finally:
+        s.close()
+    return {
+        "get_pos_rate": _result(single, "reads/s", "higher"),
+        "get_positions_rate": _result(many*len(CHANNELS), "axis reads/s", "higher"),
+    }
+
+def bench_move_latency(args):
+    # time from the move command until the move is detected as finished,
+    # minus the time the move itself takes
+    s = stage.SmarAct(SERIAL, channels=CHANNELS)
+    ch = CHANNELS[0]
+    step = 0.01
+    try:
+        vel, acc = s.get_speed(ch)
+        expected = stage.move_time(step, vel, acc)
+        overhead = []
+        for i in range(args.moves):
+            t0 = time.perf_counter()
+            s.mvr(ch, step if i % 2 == 0 else -step)
+            overhead.append(time.perf_counter() - t0 - expected)
+    finally:
+        s.close()
+    overhead.sort()
+    return {
+        "move_detect_p50": _result(statistics.median(overhead)*1E3, "ms", "lower"),
+        "move_detect_max": _result(overhead[-1]*1E3, "ms", "lower"),
+    }
+
+def bench_step_scan(args):
+    # small steps on two axes: a mv - get_positions loop and SmarAct.scan()
+    s = stage.SmarAct(SERIAL, channels=CHANNELS)
+    axes = CHANNELS[:2]
+    xs = 0.001*np.arange(args.points)
+    try:
+        t0 = time.perf_counter()
+        for x in xs:
+            s.mv(axes[0], x)
+            s.get_positions(axes)
+        loop = args.points/(time.perf_counter() - t0)
+        s.mv(axes[0], 0)
+        t0 = time.perf_counter()
+        for point in s.scan({axes[0]: xs, axes[1]: xs}):
+            pass
+        scan = args.points/(time.perf_counter() - t0)
+        s.mv_many({axes[0]: 0, axes[1]: 0})
+    finally:
+        s.close()
+    return {
+        "step_scan_rate": _result(loop, "points/s", "higher"),
+        "scan_rate": _result(scan, "points/s", "higher"),
+    }
+
+def bench_ioc(args):
+    # caget throughput of RBV and DMOV with many concurrent clients
+    try:
+        from caproto.asyncio.server import Context as ServerContext
+        from caproto.asyncio.client import Context as ClientContext
+    except ImportError:
+        print("caproto is not installed, skipping the IOC benchmark.")
+        return {}
+    from SmaractStage import SmaractMotorRecord as mr
+
+    async def client(names, counter, deadline):
+        ctx = ClientContext()
+        pvs = await ctx.get_pvs(*names)
+        for pv in pvs:
+            await pv.wait_for_connection()
+        while time.perf_counter() < deadline:
+            for pv in pvs:
+                await pv.read()
+                counter[0] += 1
+        await ctx.disconnect()
+
+    poller = mr.open_controller(SERIAL, CHANNELS)
+
+    async def run():
+        records = [mr.SmarActMotorRecord(prefix="bench:m{}:".format(ax), axis=ax, poller=poller) for ax in CHANNELS]
+        pvdb = {}
+        for record in records:
+            pvdb.update(record.pvdb)
+        server = asyncio.get_running_loop().create_task(ServerContext(pvdb, ["127.0.0.1"]).run(log_pv_names=False))
+        await asyncio.sleep(0.5)
+        names = [name for record in records for name in (record.RBV.pvname, record.DMOV.pvname)]
+        counter = [0]
+        t0 = time.perf_counter()
+        await asyncio.gather(*(client(names, counter, t0 + args.duration) for _ in range(args.clients)))
+        rate = counter[0]/(time.perf_counter() - t0)
+        server.cancel()
+        return rate
+
+    try:
+        rate = asyncio.run(run())
+    finally:
+        mr.close_controllers([poller])
+    return {"ioc_caget_rate": _result(rate, "gets/s", "higher")}
+
+BENCHMARKS = {
+    "construct": bench_construct,
+    "readback": bench_readback,
+    "move": bench_move_latency,
+    "scan": bench_step_scan,
+    "ioc": bench_ioc,
+}
+
+def run_benchmarks(args):
+    SmaractSim.set_latency(args.latency)
+    results = {}
+    for name in args.only or list(BENCHMARKS):
+        print("running {} ...".format(name))
+        results.update(BENCHMARKS[name](args))
+    meta = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "latency": args.latency,
+        "duration": args.duration,
+        "clients": args.clients,
+    }
+    return {"meta": meta, "results": results}
+
+def compare(old, new, threshold):
+    # print the change of every metric; returns the names of the regressions
+    regressions = []
+    print("{:24s} {:>12s} {:>12s} {:>8s}".format("metric", "old", "new", "change"))
+    for name, res in new["results"].items():
+        ref = old["results"].get(name)
+        if ref is None or not ref["value"]:
+            print("{:24s} {:>12s} {:12.4g} {:>8s}".format(name, "-", res["value"], "new"))
+            continue
+        change = res["value"]/ref["value"] - 1
+        worse = -change if res["better"] == "higher" else change
+        flag = ""
+        if worse > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print("{:24s} {:12.4g} {:12.4g} {:+7.1%}{}".format(name, ref["value"], res["value"], change, flag))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="SmaractStage benchmarks on the simulated MCS2.")
+    parser.add_argument("--latency", type=float, default=0.0005, help="simulated round trip per controller call [s]")
+    parser.add_argument("--duration", type=float, default=2.0, help="duration of each rate measurement [s]")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions of the construction benchmark")
+    parser.add_argument("--moves", type=int, default=20, help="moves of the latency benchmark")
+    parser.add_argument("--points", type=int, default=50, help="points of the step scan benchmark")
+    parser.add_argument("--clients", type=int, default=20, help="concurrent CA clients of the IOC benchmark")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="run only these benchmarks")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", nargs="+", metavar="JSON",
+                        help="compare with a baseline: BASELINE (runs the benchmarks) or BASELINE RESULTS")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change that counts as a regression")
+    args = parser.parse_args()
+
+    if args.compare and len(args.compare) > 2:
+        parser.error("--compare takes one or two files.")
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[1]) as f:
+            data = json.load(f)
+    else:
+        data = run_benchmarks(args)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(data, f, indent=2)
+    if not args.compare:
+        for name, res in data["results"].items():
+            print("{:24s} {:12.4g} {}".format(name, res["value"], res["unit"]))
+        return 0
+    with open(args.compare[0]) as f:
+        baseline = json.load(f)
+    return 1 if compare(baseline, data, args.threshold) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,7 +9,17 @@ setup(
    url='#',
    license='LICENSE.txt',
    description='APS 12ID smaract stage control',
-#   install_requires=[
+   install_requires=[
+       "numpy",
 #       "SmarAct SDK",
-#   ],
+   ],
+   extras_require={
+       "ioc": ["caproto", "pyyaml"],
+   },
+   entry_points={
+       "console_scripts": [
+           "smaract-ioc = SmaractStage.SmaractMotorRecord:main",
+           "smaract-server = SmaractStage.SmaractServer:main",
+       ],
+   },
 )
\ No newline at end of file
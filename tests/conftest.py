@@ -0,0 +1,20 @@
+import pytest
+from SmaractStage import SmaractStage as stage
+from SmaractStage import SmaractSim as sim
+
+# all tests run on the simulated controller
+stage.use_backend("sim")
+
+SERIAL = "MCS2-00015447"
+
+@pytest.fixture
+def device():
+    sim.reset()
+    return sim.get_device(SERIAL)
+
+@pytest.fixture
+def smaract(device):
+    s = stage.SmarAct(SERIAL, channels=[0, 1])
+    yield s
+    stage.disable_stats()
+    s.close()
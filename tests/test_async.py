@@ -0,0 +1,40 @@
+import asyncio
+import time
+import pytest
+from SmaractStage import SmaractStage as stage
+from SmaractStage.SmaractAsync import AsyncSmarAct
+
+def test_waitdone_timeout_releases_waiter(smaract, monkeypatch):
+    monkeypatch.setattr(stage, "EVENT_RECHECK", 0.1)
+    smaract.set_speed(0, vel=0.01)
+    async def run():
+        ctrl = AsyncSmarAct(smaract)
+        try:
+            await ctrl.mv(0, 1.0, wait=False)
+            assert not await ctrl.waitdone(0, timeout=0.2)
+            assert ctrl._waiters == {}
+            # no recheck of the abandoned waiter keeps reading
+            reads = ctrl.worker.reads_requested
+            await asyncio.sleep(5*stage.EVENT_RECHECK)
+            assert ctrl.worker.reads_requested == reads
+            await ctrl.stop(0)
+        finally:
+            ctrl.close()
+    asyncio.run(run())
+
+def test_waitdone_cancel_releases_waiter(smaract):
+    smaract.set_speed(0, vel=0.01)
+    async def run():
+        ctrl = AsyncSmarAct(smaract)
+        try:
+            await ctrl.mv(0, 1.0, wait=False)
+            task = asyncio.ensure_future(ctrl.waitdone(0))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert ctrl._waiters == {}
+            await ctrl.stop(0)
+        finally:
+            ctrl.close()
+    asyncio.run(run())
@@ -0,0 +1,39 @@
+import time
+import numpy as np
+
+def capture_samples(cap, n):
+    cap.start()
+    while cap.count < n:
+        time.sleep(0.005)
+    cap.stop()
+
+def test_window_after_wraparound(smaract):
+    cap = smaract.capture(capacity=16, states=True)
+    capture_samples(cap, 40)
+    assert cap.count >= 40
+    t, positions, states = cap.window()
+    assert len(t) == len(positions) == len(states) == 16
+    # oldest first and contiguous across the wrap
+    assert (np.diff(t) > 0).all()
+    assert t[-1] == cap.t[(cap.count - 1) % 16]
+    assert np.shares_memory(t, cap.t)
+    t5, p5, _ = cap.window(5)
+    np.testing.assert_array_equal(t5, t[-5:])
+    np.testing.assert_array_equal(p5, positions[-5:])
+
+def test_window_before_wraparound(smaract):
+    cap = smaract.capture(capacity=1000)
+    capture_samples(cap, 10)
+    t, positions = cap.window()
+    assert len(t) == cap.count < 1000
+    assert (np.diff(t) > 0).all()
+
+def test_capture_during_move(smaract, tmp_path):
+    path = str(tmp_path / "trace")
+    cap = smaract.capture(axes=[0], path=path)
+    smaract.mv(0, 0.5, capture=cap)
+    t, positions = cap.window()
+    assert positions[0, 0] < 0.1 and abs(positions[-1, 0] - 0.5) < 1E-9
+    assert (np.diff(positions[:, 0]) >= 0).all()
+    # the memory-mapped buffers hold the trace on disk
+    assert np.load(path + ".pos.npy", mmap_mode="r").shape == (2*cap.capacity, 1)
@@ -0,0 +1,28 @@
+import time
+from SmaractStage import SmaractStage as stage
+from conftest import SERIAL
+
+def test_move_completes_on_event(smaract):
+    count = smaract.events.count(0)
+    smaract.mv(0, 0.1)
+    assert smaract.events.count(0) == count + 1
+    assert not smaract.ismoving(0)
+
+def test_polling_without_events(device):
+    s = stage.SmarAct(SERIAL, channels=[0, 1], events=False)
+    try:
+        assert s.events is None
+        s.mv(0, 0.1)
+        assert abs(s.get_pos(0) - 0.1) < 1E-9
+    finally:
+        s.close()
+
+def test_event_callback_exception_keeps_listener(smaract):
+    def bad(event):
+        raise RuntimeError("callback failure")
+    smaract.events.add_callback(bad)
+    smaract.mv(0, 0.1)
+    t = time.monotonic()
+    smaract.mv(0, 0.2)
+    assert smaract.events._thread.is_alive()
+    assert time.monotonic() - t < 0.5*stage.EVENT_RECHECK
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+from SmaractStage import SmaractStage as stage
+
+def test_grid_scan(smaract):
+    out = smaract.grid_scan(0, 1, (0, 0.04), (0, 0.02), 0.01)
+    assert out.shape == (3, 5)
+    np.testing.assert_allclose(out['fast'], np.tile(np.linspace(0, 0.04, 5), (3, 1)), atol=1E-9)
+    np.testing.assert_allclose(out['slow'][:, 0], [0, 0.01, 0.02], atol=1E-9)
+
+def test_grid_scan_tolerance(smaract):
+    with pytest.raises(ValueError):
+        smaract.grid_scan(0, 1, (0, 0.04), (0, 0.02), 0.01, tolerance=0.002, dwell=0.1)
+    out = smaract.grid_scan(0, 1, (0, 0.04), (0, 0.02), 0.01, tolerance=0.002)
+    targets = np.tile(np.linspace(0, 0.04, 5), (3, 1))
+    assert (np.abs(out['fast'] - targets) <= 0.002 + 1E-9).all()
+
+def test_grid_scan_order(smaract):
+    order = []
+    smaract.grid_scan(0, 1, (0, 0.02), (0, 0.01), 0.01, trigger=lambda j, i: order.append((j, i)))
+    assert order == [(0, 0), (0, 1), (0, 2), (1, 2), (1, 1), (1, 0)]
+    order.clear()
+    smaract.grid_scan(0, 1, (0, 0.02), (0, 0.01), 0.01, serpentine=False, trigger=lambda j, i: order.append((j, i)))
+    assert order == [(0, 0), (0, 1), (0, 2), (1, 0), (1, 1), (1, 2)]
+
+def test_grid_scan_fills_out(smaract):
+    out = np.full((2, 3), np.nan, dtype=stage.grid_point_dtype)
+    assert smaract.grid_scan("trans1", "trans2", (0, 0.02), (0, 0.01), 0.01, out=out) is out
+    assert not np.isnan(out['timestamp']).any()
+    np.testing.assert_allclose(out['slow'], [[0]*3, [0.01]*3], atol=1E-9)
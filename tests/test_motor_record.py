@@ -0,0 +1,87 @@
+import asyncio
+import pytest
+pytest.importorskip("caproto")
+from SmaractStage import SmaractMotorRecord as mr
+
+def run_records(config, body):
+    # build the records, run body(records, pollers) on an event loop, close the controllers
+    records, pollers = mr.build_records(config)
+    async def main():
+        for poller in pollers:
+            poller.start()
+        try:
+            await body(records, pollers)
+        finally:
+            for poller in pollers:
+                poller.stop()
+    try:
+        asyncio.run(main())
+    finally:
+        mr.close_controllers(pollers)
+
+def config(**extra):
+    controller = {"device": "MCS2-00015447", "motor": [{"channel": 0, "prefix": "TEST:m0:"}]}
+    controller.update(extra)
+    return {"controller": [controller]}
+
+async def wait_dmov(record, timeout=5.0):
+    t = 0.0
+    while record.DMOV.value != 1 and t < timeout:
+        await asyncio.sleep(0.01)
+        t += 0.01
+    return record.DMOV.value == 1
+
+def test_retarget(device):
+    async def body(records, pollers):
+        rec = records[0]
+        await rec.VAL.write(1.0)
+        await asyncio.sleep(0.05)
+        assert rec.DMOV.value == 0
+        await rec.VAL.write(0.2)
+        assert await wait_dmov(rec)
+        assert abs(rec.RBV.value - 0.2) < 1E-9
+    run_records(config(), body)
+
+def test_dmov_stays_low_while_move_is_commanded(device):
+    async def body(records, pollers):
+        rec = records[0]
+        mv = rec.motor.mv
+        async def slow_mv(*args, **kwargs):
+            # a slow link: status scans run while move_to() sends the command
+            await asyncio.sleep(0.1)
+            return await mv(*args, **kwargs)
+        rec.motor.mv = slow_mv
+        write = asyncio.ensure_future(rec.VAL.write(0.5))
+        await asyncio.sleep(0.05)
+        await pollers[0].scan()
+        assert rec.DMOV.value == 0
+        await write
+        assert await wait_dmov(rec)
+        assert abs(rec.RBV.value - 0.5) < 1E-9
+    run_records(config(), body)
+
+def test_stop_holds_position(device):
+    async def body(records, pollers):
+        rec = records[0]
+        await rec.VAL.write(2.0)
+        await asyncio.sleep(0.1)
+        await rec.STOP.write(1)
+        assert await wait_dmov(rec)
+        assert 0 < rec.RBV.value < 2.0
+        assert rec.VAL.value == rec.RBV.value
+    run_records(config(), body)
+
+def test_spmg(device):
+    async def body(records, pollers):
+        rec = records[0]
+        await rec.SPMG.write('Pause')
+        await rec.VAL.write(0.3)
+        await asyncio.sleep(0.1)
+        await pollers[0].scan()
+        assert rec.RBV.value == 0.0
+        await rec.SPMG.write('Move')
+        assert await wait_dmov(rec)
+        await asyncio.sleep(0.05)
+        assert abs(rec.RBV.value - 0.3) < 1E-9
+        assert rec.SPMG.value == 'Pause'
+    run_records(config(), body)
@@ -0,0 +1,34 @@
+import time
+import numpy as np
+from SmaractStage import SmaractStage as stage
+
+def test_mv_many(smaract):
+    result = smaract.mv_many({"trans1": 0.2, 1: -0.3})
+    assert result.dtype.names == stage.move_result_dtype.names
+    assert list(result.channel) == [0, 1]
+    assert result.done.all() and not result.end_stop.any()
+    np.testing.assert_allclose(result.target, [0.2, -0.3])
+    np.testing.assert_allclose(result.position, [0.2, -0.3])
+    result = smaract.mv_many({0: 0.1, 1: 0.1}, absolute=False)
+    np.testing.assert_allclose(result.target, [0.3, -0.2])
+
+def test_mv_many_synchronize(smaract):
+    t = time.monotonic()
+    smaract.mv_many({0: 1.0, 1: 0.1}, wait=False, synchronize=True)
+    # the short move is slowed down to the duration of the long one
+    assert smaract.get_speed(1)[0] < stage.DEFAULT_VELOCITY
+    result = smaract.waitdone_many([0, 1])
+    assert result.done.all()
+    assert time.monotonic() - t < stage.move_time(1.0, stage.DEFAULT_VELOCITY, stage.DEFAULT_ACCELERATION) + 0.5
+    assert smaract.get_speed(1) == (stage.DEFAULT_VELOCITY, stage.DEFAULT_ACCELERATION)
+
+def test_waitdone_many_survives_lost_event(smaract):
+    smaract.mv_many({0: 0.2, 1: 0.3}, wait=False)
+    for ch in (0, 1):
+        # MOVEMENT_FINISHED events that never arrive
+        smaract._pending[ch] += 5
+    t = time.monotonic()
+    result = smaract.waitdone_many([0, 1])
+    assert result.done.all()
+    np.testing.assert_allclose(result.position, [0.2, 0.3])
+    assert time.monotonic() - t < stage.EVENT_RECHECK + 1
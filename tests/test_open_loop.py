@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from SmaractStage import SmaractStage as stage
+from SmaractStage import SmaractSim as sim
+
+def test_volts_to_scan_range():
+    assert stage.volts_to_scan(100) == stage.SCAN_MAX
+    np.testing.assert_array_equal(stage.volts_to_scan([0, 50]), [0, round(stage.SCAN_MAX/2)])
+    assert stage.volts_to_scan(-100, relative=True) == -stage.SCAN_MAX
+    for volts, relative in ((-0.1, False), (100.1, False), (-100.1, True), ([10, 101], False)):
+        with pytest.raises(ValueError):
+            stage.volts_to_scan(volts, relative=relative)
+
+def test_scan_move_range(smaract, device):
+    mode = device.channels[0].props[sim.Property.MOVE_MODE]
+    for volts, absolute in ((120, True), (-1, True), (-150, False)):
+        with pytest.raises(ValueError):
+            smaract.scan_move(0, volts, absolute=absolute)
+    with pytest.raises(ValueError):
+        smaract.scan_move(0, 10, velocity=-1)
+    # nothing was sent for the rejected moves
+    assert device.channels[0].props[sim.Property.MOVE_MODE] == mode
+    assert not smaract.ismoving(0)
+
+def test_scan_move(smaract):
+    p0 = smaract.get_pos(0)
+    smaract.scan_move(0, 60)
+    p1 = smaract.get_pos(0)
+    smaract.scan_move(0, -10, absolute=False)
+    assert p1 != p0
+    assert smaract.get_pos(0) != p1
+    assert smaract.scan_gain(0) != 0
+
+def test_step_move_range(smaract, device):
+    for frequency in (0, 20001):
+        with pytest.raises(ValueError):
+            smaract.step_move(0, 100, frequency=frequency)
+    with pytest.raises(ValueError):
+        smaract.step_move(0, 100, amplitude=101)
+    p0 = smaract.get_pos(0)
+    smaract.step_move(0, 100, frequency=1000, amplitude=50)
+    assert device.channels[0].props[sim.Property.STEP_FREQUENCY] == 1000
+    assert smaract.get_pos(0) > p0
+
+def test_scan_values_range(smaract):
+    with pytest.raises(ValueError):
+        smaract.scan_values(0, [10, 20, 200])
+    times = smaract.scan_values(0, [10, 20, 30], rate=100)
+    assert len(times) == 3 and (np.diff(times) > 0).all()
+
+def test_mv_fine(smaract):
+    position = smaract.mv_fine(0, 0.123456, tolerance=1E-6)
+    assert abs(position - 0.123456) <= 1E-6
+    assert abs(smaract.get_pos(0) - position) < 1E-9
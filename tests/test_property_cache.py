@@ -0,0 +1,36 @@
+from SmaractStage import SmaractStage as stage
+from SmaractStage import SmaractSim as sim
+
+def writes(device):
+    return device.calls["SetProperty_i32"] + device.calls["SetProperty_i64"]
+
+def test_redundant_writes_skipped(smaract, device):
+    smaract.set_speed(0, 2, 20)
+    n = writes(device)
+    smaract.set_speed(0, 2, 20)
+    smaract.set_property(0, sim.Property.MOVE_VELOCITY, int(2E9))
+    assert writes(device) == n
+    smaract.set_speed(0, 3, 20)
+    assert writes(device) == n + 1
+    assert device.channels[0].props[sim.Property.MOVE_VELOCITY] == int(3E9)
+
+def test_reads_served_from_cache(smaract, device):
+    smaract.get_speed(0)
+    reads = device.calls["GetProperty_i64"]
+    assert smaract.get_speed(0) == (stage.DEFAULT_VELOCITY, stage.DEFAULT_ACCELERATION)
+    assert device.calls["GetProperty_i64"] == reads
+
+def test_refresh_and_invalidate(smaract, device):
+    smaract.get_speed(1)
+    # another client changes the settings
+    device.channels[0].props[sim.Property.MOVE_VELOCITY] = int(4E9)
+    device.channels[1].props[sim.Property.MOVE_VELOCITY] = int(6E9)
+    assert smaract.get_speed(0)[0] == stage.DEFAULT_VELOCITY
+    smaract.refresh([0])
+    assert smaract.get_speed(0)[0] == 4
+    assert smaract.get_speed(1)[0] == stage.DEFAULT_VELOCITY
+    smaract.invalidate(1)
+    assert smaract.get_speed(1)[0] == 6
+    # a cached value that is no longer true on the controller is written again
+    smaract.set_speed(0)
+    assert device.channels[0].props[sim.Property.MOVE_VELOCITY] == int(stage.DEFAULT_VELOCITY*1E9)
@@ -0,0 +1,30 @@
+import time
+import numpy as np
+import pytest
+from SmaractStage import SmaractStage as stage
+from SmaractStage import SmaractSim as sim
+
+def test_read_status(smaract):
+    smaract.mv(0, 0.2)
+    smaract.mv(1, -0.1)
+    status = smaract.read_status()
+    assert status.dtype == stage.status_dtype
+    assert list(status.channel) == [0, 1]
+    np.testing.assert_allclose(status.position, [0.2, -0.1])
+    assert not (status.state & sim.ChannelState.ACTIVELY_MOVING).any()
+    np.testing.assert_allclose(smaract.get_positions(["trans2", "trans1"]), [-0.1, 0.2])
+    np.testing.assert_array_equal(smaract.get_states(), status.state)
+
+def test_readback_is_one_round_trip(smaract, device):
+    device.latency = 0.05
+    requests = device.calls["RequestReadProperty"]
+    t = time.monotonic()
+    smaract.read_status()
+    assert time.monotonic() - t < 2*device.latency
+    assert device.calls["RequestReadProperty"] - requests == 4
+
+def test_failed_read_drains_replies(smaract, device):
+    with pytest.raises(sim.Error):
+        smaract.get_positions([0, 7, 1])
+    assert device.replies == {}
+    np.testing.assert_allclose(smaract.get_positions(), [0, 0])
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from SmaractStage import SmaractStage as stage
+from SmaractStage import SmaractSim as sim
+
+def target(smaract, ch):
+    return smaract.get_property(ch, sim.Property.TARGET_POSITION)/1E9
+
+def test_scan_points(smaract):
+    xs = np.linspace(0, 0.1, 5)
+    seen = []
+    points = list(smaract.scan({0: xs, "trans2": -xs}, trigger=seen.append, speed=(2, 20)))
+    assert [p.index for p in points] == list(range(5))
+    assert all(p.done for p in points) and seen == points
+    np.testing.assert_allclose([p.measured for p in points], np.column_stack([xs, -xs]), atol=1E-9)
+    assert all(p.settle > 0 for p in points)
+    assert smaract.get_speed(0) == (stage.DEFAULT_VELOCITY, stage.DEFAULT_ACCELERATION)
+    with pytest.raises(ValueError):
+        next(smaract.scan({0: xs, 1: xs[:3]}))
+
+def test_scan_prefetch(smaract):
+    xs = [0.1, 0.2, 0.3]
+    scan = smaract.scan({0: xs})
+    next(scan)
+    # the next point is commanded before the current one is handed out
+    assert target(smaract, 0) == pytest.approx(0.2)
+    scan.close()
+    scan = smaract.scan({0: xs}, prefetch=False)
+    next(scan)
+    assert target(smaract, 0) == pytest.approx(0.1)
+    scan.close()
+
+def test_abandoned_scan_stops_axes(smaract):
+    scan = smaract.scan({0: [0.0, 2.0]}, speed=(0.5, 10))
+    next(scan)
+    assert smaract.ismoving(0)
+    # leaving the loop with the prefetched move in flight
+    scan.close()
+    assert not smaract.ismoving(0)
+    assert 0 < smaract.get_pos(0) < 2.0
+    assert smaract.get_speed(0) == (stage.DEFAULT_VELOCITY, stage.DEFAULT_ACCELERATION)
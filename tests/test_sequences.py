@@ -0,0 +1,67 @@
+import asyncio
+import time
+from SmaractStage import SmaractStage as stage
+from SmaractStage import SmaractSim as sim
+from SmaractStage.SmaractAsync import AsyncSmarAct
+
+def test_calibrate_in_parallel(smaract, device):
+    device.calibration_time = 0.3
+    t = time.monotonic()
+    result = smaract.calibrate_all(skip_done=False)
+    # both channels calibrate at the same time
+    assert time.monotonic() - t < 2*device.calibration_time
+    assert list(result.channel) == [0, 1]
+    assert result.done.all() and result.ok.all() and not result.skipped.any()
+    result = smaract.calibrate_all()
+    assert result.skipped.all()
+
+def test_calibrate_groups(smaract, device):
+    device.calibration_time = 0.2
+    t = time.monotonic()
+    result = smaract.calibrate_all(groups=[[0], ["trans2"]], skip_done=False)
+    # one group after the other
+    assert time.monotonic() - t >= 2*device.calibration_time
+    assert result.ok.all()
+
+def test_reference_all(smaract):
+    smaract.mv_many({0: 0.3, 1: -0.2})
+    result = smaract.reference_all(skip_done=False, speed=(2, 20))
+    assert result.done.all() and result.ok.all()
+    assert (result.state & sim.ChannelState.IS_REFERENCED).all()
+    assert smaract.get_speed(0) == (stage.DEFAULT_VELOCITY, stage.DEFAULT_ACCELERATION)
+
+def test_calibrate_timeout_stops_sequences(smaract, device):
+    device.calibration_time = 3.0
+    result = smaract.calibrate_all(skip_done=False, timeout=0.3)
+    assert not result.done.any() and not result.ok.any()
+    assert not any(ch.flags & sim.ChannelState.CALIBRATING for ch in device.channels[:2])
+    assert smaract.get_speed(0) == (stage.DEFAULT_VELOCITY, stage.DEFAULT_ACCELERATION)
+
+def test_async_calibrate_waits_for_running_bit(smaract, device):
+    device.calibration_time = 0.3
+    ctrl = AsyncSmarAct(smaract)
+    async def run():
+        task = asyncio.ensure_future(ctrl.calibrate_all(skip_done=False))
+        await asyncio.sleep(0.05)
+        with device.lock:
+            # ACTIVELY_MOVING drops while the sequence still runs
+            for ch in device.channels[:2]:
+                ch.flags &= ~sim.ChannelState.ACTIVELY_MOVING
+        return await task
+    try:
+        t = time.monotonic()
+        result = asyncio.run(run())
+        assert time.monotonic() - t >= 0.3
+        assert result.ok.all()
+    finally:
+        ctrl.close()
+
+def test_async_calibrate_timeout_stops_sequences(smaract, device):
+    device.calibration_time = 3.0
+    ctrl = AsyncSmarAct(smaract)
+    try:
+        result = asyncio.run(ctrl.calibrate_all(skip_done=False, timeout=0.3))
+    finally:
+        ctrl.close()
+    assert not result.done.any()
+    assert not any(ch.flags & sim.ChannelState.CALIBRATING for ch in device.channels[:2])
@@ -0,0 +1,148 @@
+import asyncio
+import threading
+import time
+import numpy as np
+import pytest
+from SmaractStage import SmaractStage as stage
+from SmaractStage.SmaractAsync import AsyncSmarAct
+from SmaractStage.SmaractServer import SmarActServer, SmarActClient, RemoteError
+
+@pytest.fixture
+def address(smaract, tmp_path):
+    # a server on a Unix socket, run on its own event loop thread
+    path = str(tmp_path / "smaract.sock")
+    ctrl = AsyncSmarAct(smaract)
+    server = SmarActServer(ctrl, path)
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(server.start())
+        ready.set()
+        loop.run_forever()
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    ready.wait()
+    yield path
+    asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    ctrl.close()
+
+def test_info_and_status(address):
+    client = SmarActClient(address)
+    try:
+        assert client.channels == [0, 1]
+        status = client.read_status()
+        assert list(status.channel) == [0, 1]
+        assert status.position.dtype == np.float64
+    finally:
+        client.close()
+
+def test_move_and_read(address):
+    client = SmarActClient(address)
+    try:
+        assert client.move(0, 0.25)
+        assert abs(client.get_pos(0) - 0.25) < 1E-9
+        client.mv(client.channel_names[1], 0.1, wait=False)
+        assert client.waitdone(1, 5)
+        np.testing.assert_allclose(client.get_positions(), [0.25, 0.1])
+        assert not client.ismoving(0)
+    finally:
+        client.close()
+
+def test_batched_reads_and_calls(address):
+    client = SmarActClient(address)
+    try:
+        client.set_speed(0, 3, 30)
+        assert client.get_speed(0) == (3.0, 30.0)
+        values = client.read_properties([(0, stage.ctl.Property.MOVE_VELOCITY), (1, stage.ctl.Property.POSITION)])
+        assert values[0] == 3E9
+        result = client.mv_many({0: 0.1, 1: 0.2})
+        assert [r['done'] for r in result] == [True, True]
+    finally:
+        client.close()
+
+def test_call_whitelist(address):
+    client = SmarActClient(address)
+    try:
+        with pytest.raises(RemoteError):
+            client._call("close")
+    finally:
+        client.close()
+
+def test_subscriptions_fan_out(address):
+    clients = [SmarActClient(address) for _ in range(2)]
+    updates = [[], []]
+    try:
+        for client, seen in zip(clients, updates):
+            client.subscribe(lambda t, status, seen=seen: seen.append(status.copy()), [0])
+        clients[0].mv(0, 0.3)
+        for seen in updates:
+            # the first update has the subscribed channels, then only changes follow
+            assert seen and list(seen[0].channel) == [0]
+        deadline = 50
+        while deadline and not all(abs(seen[-1].position[0] - 0.3) < 1E-9 for seen in updates):
+            threading.Event().wait(0.05)
+            deadline -= 1
+        assert deadline
+    finally:
+        for client in clients:
+            client.close()
+
+def test_waitdone_many_does_not_block_other_clients(address):
+    clients = [SmarActClient(address) for _ in range(2)]
+    try:
+        clients[0].set_speed(0, 0.5, 10)
+        clients[0].mv_many({0: 0.5, 1: 0.1}, wait=False)
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(clients[0].waitdone_many([0, 1])))
+        waiter.start()
+        threading.Event().wait(0.1)
+        t = time.monotonic()
+        clients[1].get_pos(1)
+        assert time.monotonic() - t < 0.2
+        waiter.join()
+        result = results[0]
+        assert result.dtype.names == stage.move_result_dtype.names
+        assert list(result.channel) == [0, 1]
+        assert result.done.all()
+        np.testing.assert_allclose(result.target, [0.5, 0.1])
+        np.testing.assert_allclose(result.position, [0.5, 0.1])
+    finally:
+        for client in clients:
+            client.close()
+
+def test_failing_callback_keeps_reader(address):
+    client = SmarActClient(address)
+    seen = []
+    def fail(t, status):
+        raise RuntimeError("callback failed")
+    try:
+        client.subscribe(fail, [0])
+        client.subscribe(lambda t, status: seen.append(status.copy()), [0])
+        client.mv(0, 0.2)
+        assert client._reader.is_alive()
+        assert abs(client.get_pos(0) - 0.2) < 1E-9
+    finally:
+        client.close()
+    assert seen
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_request_after_reader_ended(address, monkeypatch):
+    client, other = SmarActClient(address, timeout=5), SmarActClient(address)
+    def corrupt(body):
+        raise ValueError("corrupt update")
+    try:
+        client.subscribe(lambda t, status: None, [0])
+        monkeypatch.setattr(client, "_dispatch_update", corrupt)
+        # the next update ends the reader thread
+        other.mv(0, 0.2)
+        client._reader.join(5)
+        t = time.monotonic()
+        with pytest.raises(ConnectionError):
+            client.get_pos(0)
+        assert time.monotonic() - t < 1
+    finally:
+        client.close()
+        other.close()
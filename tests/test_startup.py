@@ -0,0 +1,35 @@
+from SmaractStage import SmaractStage as stage
+from SmaractStage import SmaractSim as sim
+from conftest import SERIAL
+
+def test_lazy_writes_nothing_before_first_use(device):
+    s = stage.SmarAct(SERIAL, channels=[0, 1, 2], lazy=True)
+    try:
+        assert s.units == ["mm"]*3
+        assert device.calls["RequestWriteProperty_i32"] == 0
+        assert s._configured == set()
+        s.get_pos(0)
+        assert device.calls["RequestWriteProperty_i32"] == 0
+        s.get_speed(1)
+        assert s._configured == {1}
+    finally:
+        s.close()
+
+def test_eager_configuration(device):
+    s = stage.SmarAct(SERIAL, channels=[0, 1, 2])
+    try:
+        assert s._configured == {0, 1, 2}
+        assert device.calls["RequestWriteProperty_i32"] > 0
+    finally:
+        s.close()
+
+def test_lazy_configuration_before_first_read(device):
+    device.channels[0].props[sim.Property.MOVE_VELOCITY] = int(2E9)
+    s = stage.SmarAct(SERIAL, channels=[0, 1], lazy=True)
+    try:
+        assert s._configured == set()
+        before = s.get_speed(0)
+        s.mv(0, 0.1)
+        assert before == s.get_speed(0) == (stage.DEFAULT_VELOCITY, stage.DEFAULT_ACCELERATION)
+    finally:
+        s.close()
@@ -0,0 +1,27 @@
+import time
+from SmaractStage import SmaractStage as stage
+
+def test_stats_skip_wait_for_event(smaract):
+    stage.enable_stats()
+    smaract.mv(0, 0.1)
+    time.sleep(0.3)
+    calls = smaract.get_stats()
+    assert not any(func == "WaitForEvent" for func, _ in calls)
+    assert set(ch for _, ch in calls) <= {0, 1, None}
+    assert ("Move", 0) in calls
+
+def test_move_stats(smaract):
+    stage.enable_stats()
+    smaract.mv(0, 0.1)
+    smaract.mv(0, 0.2)
+    moves = smaract.get_move_stats(0)
+    assert moves[0]['count'] == 2
+    assert 0 < moves[0]['p50'] <= moves[0]['max'] < 1
+    summary = smaract.get_stats(0)
+    assert summary[("Move", 0)]['count'] == 2
+
+def test_stats_off(smaract):
+    stage.enable_stats()
+    stage.disable_stats()
+    smaract.mv(0, 0.1)
+    assert smaract.get_stats() == {} and smaract.get_move_stats() == {}
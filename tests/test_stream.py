@@ -0,0 +1,49 @@
+import time
+import numpy as np
+import pytest
+from SmaractStage import SmaractSim as sim
+
+def ramp(n):
+    return {0: np.linspace(0, 0.1, n), 1: np.linspace(0, -0.05, n)}
+
+def test_stream_runs_path(smaract):
+    stream = smaract.stream_trajectory(ramp(50), rate=500)
+    assert stream.result == sim.ErrorCode.NONE
+    assert stream.frames_written == 50
+    assert not stream.underrun and not stream.aborted
+    np.testing.assert_allclose(smaract.get_positions(), [0.1, -0.05])
+
+def test_stream_validation(smaract):
+    with pytest.raises(ValueError):
+        smaract.stream_trajectory({0: [0, 0.1], 1: [0]}, rate=100)
+    with pytest.raises(ValueError):
+        smaract.stream_trajectory(ramp(10), rate=20000)
+    with pytest.raises(ValueError):
+        smaract.stream_trajectory(ramp(10))
+
+def test_stream_underrun(smaract, monkeypatch):
+    write = sim.WriteCommandStream
+    def slow_host(d_handle, s_handle, buffer):
+        write(d_handle, s_handle, buffer)
+        if slow_host.n == 5:
+            # the host stalls for longer than the buffered frames last
+            time.sleep(0.2)
+        slow_host.n += 1
+    slow_host.n = 0
+    monkeypatch.setattr(sim, "WriteCommandStream", slow_host)
+    stream = smaract.stream_trajectory(ramp(50), rate=100, approach=False)
+    assert stream.wait(5)
+    assert stream.underrun
+    assert stream.result == sim.ErrorCode.BUFFER_UNDERFLOW
+    assert stream.frames_written < 50
+
+def test_stream_abort_by_stop(smaract):
+    stream = smaract.stream_trajectory(ramp(500), rate=100, wait=False)
+    time.sleep(0.1)
+    smaract.stop(1)
+    assert stream.wait(5)
+    assert stream.aborted and not stream.underrun
+    assert stream.result == sim.ErrorCode.ABORTED
+    assert not smaract.ismoving(0)
+    # the next stream can start
+    assert smaract.stream_trajectory(ramp(10), rate=100).result == sim.ErrorCode.NONE
@@ -0,0 +1,73 @@
+import glob
+import os
+import time
+import pytest
+from SmaractStage.SmaractTelemetry import TelemetryStore
+
+def test_query_without_t0_uses_finest_tier_with_data(tmp_path):
+    store = TelemetryStore(str(tmp_path), [0, 1])
+    t = time.time()
+    for i in range(64):
+        store.append(t + i*0.01, [0.0, 1.0], [0.0, 1.0], [0, 0], [0, 0])
+    assert len(store.query()['t']) == 64
+    assert len(store.query(tier=0)['t']) == 64
+    assert len(store.query(t - 10)['t']) == 64
+
+def test_query_after_flush(tmp_path):
+    store = TelemetryStore(str(tmp_path), [0], chunk=16)
+    t = time.time()
+    for i in range(40):
+        store.append(t + i, [i], [i], [0], [0])
+    store.flush()
+    rows = store.query(t + 10, t + 20, columns=['position'])
+    assert list(rows['position'][:, 0]) == list(range(10, 20))
+
+def test_telemetry_sample(smaract, tmp_path):
+    tel = smaract.telemetry(str(tmp_path), period=0.01)
+    smaract.mv(0, 0.1)
+    tel.sample()
+    rows = tel.query()
+    assert abs(rows['position'][-1, 0] - 0.1) < 1E-9
+    tel.close()
+
+def test_rows_reach_disk_without_close(tmp_path):
+    store = TelemetryStore(str(tmp_path), [0], tiers=((0, 0),), flush_interval=0.05)
+    t = time.time()
+    for i in range(10):
+        store.append(t + i, [i], [i], [0], [0])
+    time.sleep(0.1)
+    store.append(t + 10, [10], [10], [0], [0])
+    # a new store on the same path, as after a killed process
+    rows = TelemetryStore(str(tmp_path), [0], tiers=((0, 0),)).query()
+    assert list(rows['position'][:, 0]) == list(range(11))
+    # the restored rows go into the next chunk file
+    store = TelemetryStore(str(tmp_path), [0], tiers=((0, 0),), chunk=16)
+    for i in range(11, 16):
+        store.append(t + i, [i], [i], [0], [0])
+    assert len(store.tiers[0].chunks) == 1
+    assert list(TelemetryStore(str(tmp_path), [0], tiers=((0, 0),)).query()['position'][:, 0]) == list(range(16))
+
+def test_telemetry_thread(smaract, tmp_path):
+    tel = smaract.telemetry(str(tmp_path), period=0.01)
+    tel.start()
+    time.sleep(0.2)
+    tel.close()
+    rows = tel.query()
+    assert len(rows['t']) > 5
+    assert (rows['error'] == 0).all()
+    assert glob.glob(os.path.join(str(tmp_path), "tier0_0s", "*.npz"))
+
+def test_telemetry_failure_keeps_status(device, tmp_path):
+    pytest.importorskip("caproto")
+    from test_motor_record import run_records, config, wait_dmov
+    async def body(records, pollers):
+        poller = pollers[0]
+        def full_disk(*args, **kwargs):
+            raise OSError(28, "No space left on device")
+        poller.telemetry.record = full_disk
+        await records[0].VAL.write(0.1)
+        assert await wait_dmov(records[0])
+        await poller.scan()
+        assert abs(records[0].RBV.value - 0.1) < 1E-9
+        assert not poller._task.done()
+    run_records(config(telemetry={"path": str(tmp_path), "period": 0.0}), body)
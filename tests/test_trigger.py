@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from SmaractStage import SmaractStage as stage
+
+def test_trigger_count(smaract, device):
+    smaract.set_trigger(0, 0.2, 0.1, count=3, arm=True)
+    smaract.mv(0, 0.25)
+    assert smaract.trigger_count(0) == 1
+    smaract.mv(0, 2.0)
+    assert smaract.trigger_count(0) == 3
+    np.testing.assert_allclose(smaract.trigger_positions(0), [0.2, 0.3, 0.4])
+    assert smaract.disarm_trigger(0) == 3
+    assert device.channels[0].trigger_pulses == 3
+
+def test_trigger_either_direction(smaract, device):
+    smaract.set_trigger(1, 0.0, 0.1, direction="either", arm=True)
+    smaract.mv(1, 0.35)
+    smaract.mv(1, 0.05)
+    assert smaract.trigger_count(1) is None
+    assert device.channels[1].trigger_pulses == 6
+
+def test_fly_scan(smaract, device):
+    assert smaract.fly_scan(0, 0.0, 0.5, 0.01) == 51
+    assert smaract.fly_scan(0, 0.5, 0.0, 0.05, velocity=2) == 11
+    assert device.channels[0].trigger_pulses == 62
+    assert smaract.get_speed(0) == (stage.DEFAULT_VELOCITY, stage.DEFAULT_ACCELERATION)
+
+def test_set_trigger_validation(smaract):
+    with pytest.raises(ValueError):
+        smaract.set_trigger(0, 0.0, -0.1)
+    with pytest.raises(ValueError):
+        smaract.set_trigger(0, 0.0, 0.1, direction="sideways")
+    with pytest.raises(RuntimeError):
+        smaract.arm_trigger(1)
+
+def test_trigger_fields(device):
+    pytest.importorskip("caproto")
+    from test_motor_record import run_records, config, wait_dmov
+    async def body(records, pollers):
+        rec = records[0]
+        await rec.TRGSTART.write(0.1)
+        await rec.TRGINCR.write(0.05)
+        await rec.TRGCNT.write(10)
+        await rec.TRGARM.write('Arm')
+        await rec.VAL.write(1.0)
+        assert await wait_dmov(rec)
+        await pollers[0].scan()
+        assert rec.TRGEMIT.value == 10
+        await rec.TRGARM.write('Disarm')
+        assert rec.TRGEMIT.value == 10
+    run_records(config(), body)
@@ -0,0 +1,48 @@
+import asyncio
+import pytest
+from SmaractStage import SmaractStage as stage
+from SmaractStage import SmaractSim as sim
+from SmaractStage.SmaractAsync import AsyncSmarAct
+from conftest import SERIAL
+
+@pytest.fixture
+def polling(device):
+    s = stage.SmarAct(SERIAL, channels=[0, 1], events=False)
+    yield s
+    s.close()
+
+def fail_once(monkeypatch, obj, name, ex):
+    func = getattr(obj, name)
+    calls = []
+    def failing(*args, **kwargs):
+        if not calls:
+            calls.append(args)
+            raise ex
+        return func(*args, **kwargs)
+    monkeypatch.setattr(obj, name, failing)
+    return calls
+
+def test_poll_error_keeps_worker(polling, monkeypatch):
+    async def run():
+        ctrl = AsyncSmarAct(polling)
+        try:
+            calls = fail_once(monkeypatch, polling, "get_states", sim.Error("GetProperty_i32", sim.ErrorCode.TIMEOUT))
+            await ctrl.mv(0, 0.2, wait=False)
+            assert await ctrl.waitdone(0, timeout=5)
+            assert calls
+            return await ctrl.get_pos(0)
+        finally:
+            ctrl.close()
+    assert asyncio.run(run()) == pytest.approx(0.2)
+
+def test_read_error_fails_batch_only(polling, monkeypatch):
+    async def run():
+        ctrl = AsyncSmarAct(polling)
+        try:
+            fail_once(monkeypatch, sim, "ReadProperty_i64", RuntimeError("link down"))
+            with pytest.raises(RuntimeError):
+                await ctrl.get_pos(0)
+            return await ctrl.get_pos(0)
+        finally:
+            ctrl.close()
+    assert asyncio.run(run()) == pytest.approx(0)